@@ -1,17 +1,28 @@
 import logging
+import os
 import sqlite3
 import random
 import schedule
 import time
 import asyncio
-from threading import Thread
+import gzip
+import json
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from itertools import count
+from string import Formatter
+from threading import Thread, Lock, local
 from datetime import datetime, timedelta
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, ChatMember, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ContextTypes, ConversationHandler, filters
+    Application, CallbackContext, ChatMemberHandler, CommandHandler, MessageHandler, CallbackQueryHandler,
+    ContextTypes, ConversationHandler, TypeHandler, filters
 )
+from telegram.helpers import escape_markdown
 
 # Настройка логирования
 logging.basicConfig(
@@ -27,89 +38,481 @@ JOIN_GAME = 5
 ANON_MESSAGE_CHOOSE_GAME, ANON_MESSAGE_TEXT = range(6, 8)
 RATING_SCORE, RATING_FEEDBACK = range(8, 10)
 
-# Система локализации
-LOCALES = {
-    'ru': {
-        'welcome': "🎅 Добро пожаловать в Тайного Санту!",
-        'help': """
-🎅 *Тайный Санта - Помощь* 🎅
-
-*Основные команды:*
-/start - Начать работу с ботом
-/register - Зарегистрироваться для участия
-/create - Создать новую игру
-/join - Присоединиться к существующей игре
-/my_games - Просмотреть мои игры
-/draw <ID_игры> - Провести жеребьевку (для организатора)
-/message - Отправить анонимное сообщение
-/messages - Просмотреть анонимные сообщения
-/gift_sent <ID_игры> - Подтвердить отправку подарка
-/gift_received <ID_игры> - Подтвердить получение подарка
-/gift_status <ID_игры> - Статус подарков в игре
-/reminders - Настройки напоминаний
-/language - Выбрать язык
-/help - Показать эту справку
-
-*Как это работает:*
-1. 📝 Зарегистрируйтесь командой /register
-2. 🎮 Создайте игру (/create) или присоединитесь к существующей (/join)
-3. 👥 Дождитесь, когда соберется достаточно участников
-4. 🎲 Организатор проводит жеребьевку (/draw)
-5. 🎅 Каждый участник получает имя того, кому нужно подарить подарок
-6. 📨 Общайтесь анонимно через /message
-7. 🎁 Подтверждайте отправку и получение подарков
-8. ⭐ Оценивайте подарки и оставляйте отзывы
-
-*Примечание:* Для жеребьевки нужно минимум 3 участника.
-""",
-        'game_created': "🎉 Игра '{}' успешно создана!",
-        'registration_complete': "🎉 Поздравляем! Вы успешно зарегистрированы!",
+# Система локализации: каталоги сообщений в locales/<язык>.json
+LOCALES_DIR = os.environ.get(
+    'SECRET_SANTA_LOCALES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+)
+# Язык новых пользователей и последнее звено любой цепочки запасных языков
+DEFAULT_LANGUAGE = 'ru'
+
+class Template:
+    """Скомпилированный шаблон сообщения.
+
+    Шаблон без подстановок (справка, меню, подсказки) отрисовывается один раз
+    при загрузке каталога, остальные - одним вызовом str.format.
+    """
+    __slots__ = ('text', 'fields', 'rendered')
+
+    def __init__(self, text):
+        self.text = text
+        self.fields = tuple(name for _, name, _, _ in Formatter().parse(text) if name is not None)
+        self.rendered = None if self.fields else text.format()
+
+    def render(self, *args, **values):
+        if self.rendered is not None:
+            return self.rendered
+        return self.text.format(*args, **values)
+
+class MessageCatalog:
+    """Каталог локализованных сообщений, загружаемый один раз при запуске.
+
+    Файл языка - словарь ключ -> текст (строка или список строк). Ключ
+    _fallback задает цепочку языков, из которых берутся недостающие сообщения;
+    последним в цепочке всегда идет DEFAULT_LANGUAGE. Цепочки разрешаются при
+    загрузке, поэтому render - два обращения к словарю и подстановка.
+    """
+
+    def __init__(self, sources, default=DEFAULT_LANGUAGE):
+        self.default = default
+        # Язык по умолчанию первым: в этом порядке строится меню выбора языка
+        self.languages = tuple(sorted(sources, key=lambda language: (language != default, language)))
+        keys = set()
+        for source in sources.values():
+            keys.update(key for key in source if key != '_fallback')
+        self._templates = {}
+        for language, source in sources.items():
+            chain = [language, *source.get('_fallback', []), default]
+            templates = {}
+            for key in keys:
+                text = next(
+                    (sources[name][key] for name in chain if key in sources.get(name, {})), None
+                )
+                if text is not None:
+                    templates[key] = Template('\n'.join(text) if isinstance(text, list) else text)
+            self._templates[language] = templates
+
+    @classmethod
+    def load(cls, directory=LOCALES_DIR, default=DEFAULT_LANGUAGE):
+        sources = {}
+        for name in sorted(os.listdir(directory)):
+            language, extension = os.path.splitext(name)
+            if extension == '.json':
+                with open(os.path.join(directory, name), encoding='utf-8') as file:
+                    sources[language] = json.load(file)
+        return cls(sources, default)
+
+    def render(self, language, key, *args, **values):
+        """Текст сообщения на языке пользователя; неизвестный ключ возвращается как есть"""
+        templates = self._templates.get(language) or self._templates[self.default]
+        template = templates.get(key)
+        if template is None:
+            return key
+        return template.render(*args, **values)
+
+catalog = MessageCatalog.load()
+
+# ========== КЛАВИАТУРЫ ==========
+
+class KeyboardFactory:
+    """Inline-клавиатуры бота.
+
+    Статические меню (язык, напоминания, оценка, строки отмены) собираются
+    один раз на каждый язык каталога при запуске: объекты
+    InlineKeyboardMarkup и InlineKeyboardButton неизменяемы, поэтому одна и
+    та же клавиатура отдается всем пользователям. Списки игр строятся на
+    каждый вызов из кортежей с уже готовой строкой отмены.
+    """
+
+    # Строки отмены разговоров и их callback_data
+    CANCEL_CALLBACKS = ('cancel_join', 'cancel_anon_msg', 'cancel_rate')
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._cancel_rows = {}
+        self._reminders = {}
+        self._rating = {}
+        for language in catalog.languages:
+            cancel_text = catalog.render(language, 'button_cancel')
+            for callback_data in self.CANCEL_CALLBACKS:
+                self._cancel_rows[language, callback_data] = (
+                    InlineKeyboardButton(cancel_text, callback_data=callback_data),
+                )
+            self._reminders[language] = InlineKeyboardMarkup((
+                (InlineKeyboardButton(catalog.render(language, 'button_reminders_on'), callback_data="reminders_on"),),
+                (InlineKeyboardButton(catalog.render(language, 'button_reminders_off'), callback_data="reminders_off"),),
+            ))
+            self._rating[language] = InlineKeyboardMarkup((
+                tuple(
+                    InlineKeyboardButton("⭐" * stars, callback_data=f"rate_{stars}")
+                    for stars in range(1, 6)
+                ),
+                self._cancel_rows[language, 'cancel_rate'],
+            ))
+        # Выбор языка одинаков для всех: кнопка на каждый язык каталога
+        self.language_menu = InlineKeyboardMarkup((tuple(
+            InlineKeyboardButton(catalog.render(language, 'language_name'), callback_data=f"lang_{language}")
+            for language in catalog.languages
+        ),))
+        self.language_prompt = "🌍 " + " / ".join(
+            catalog.render(language, 'language_prompt') for language in catalog.languages
+        ) + ":"
+
+    def _language(self, language):
+        return language if language in self._reminders else self.catalog.default
+
+    def reminders(self, language):
+        return self._reminders[self._language(language)]
+
+    def rating(self, language):
+        return self._rating[self._language(language)]
+
+    def choices(self, language, items, cancel_callback):
+        """Список кнопок по одной в строке из пар (текст, callback_data) и строка отмены"""
+        rows = [(InlineKeyboardButton(text, callback_data=callback_data),) for text, callback_data in items]
+        rows.append(self._cancel_rows[self._language(language), cancel_callback])
+        return InlineKeyboardMarkup(rows)
+
+    def rate_gift(self, language, game_id):
+        return InlineKeyboardMarkup((
+            (InlineKeyboardButton(self.catalog.render(language, 'button_rate_gift'), callback_data=f"rate_{game_id}"),),
+        ))
+
+keyboards = KeyboardFactory(catalog)
+
+# Путь к базе и профиль настройки хранилища задаются через окружение
+DB_PATH = os.environ.get('SECRET_SANTA_DB', 'secret_santa.db')
+DB_PROFILE = os.environ.get('SECRET_SANTA_DB_PROFILE', 'balanced')
+# Реализация хранилища: 'sqlite' или 'memory' (без диска, для бенчмарков и тестов)
+STORAGE_BACKEND = os.environ.get('SECRET_SANTA_STORAGE', 'sqlite')
+# Архивация: игры, дата обмена которых прошла более ARCHIVE_AFTER_DAYS дней назад,
+# выгружаются в сжатые файлы в ARCHIVE_DIR и удаляются из рабочих таблиц
+ARCHIVE_DIR = os.environ.get('SECRET_SANTA_ARCHIVE_DIR', 'archive')
+ARCHIVE_AFTER_DAYS = int(os.environ.get('SECRET_SANTA_ARCHIVE_AFTER_DAYS', '30'))
+# Сколько строк user_settings держать в кэше процесса
+SETTINGS_CACHE_SIZE = int(os.environ.get('SECRET_SANTA_SETTINGS_CACHE', '10000'))
+# Число потоков с соединениями только для чтения
+READ_POOL_SIZE = int(os.environ.get('SECRET_SANTA_READ_POOL', '4'))
+# Жеребьевка: 'derangement' (любое распределение без самоназначений) или 'cycle' (один общий круг)
+DRAW_MODE = os.environ.get('SECRET_SANTA_DRAW_MODE', 'derangement')
+# Пары из игр того же организатора с тем же названием за последние REPEAT_SEASONS сезонов
+# не повторяются: 'avoid' - по возможности, 'exclude' - строго; 0 отключает проверку
+REPEAT_SEASONS = int(os.environ.get('SECRET_SANTA_REPEAT_SEASONS', '2'))
+REPEAT_POLICY = os.environ.get('SECRET_SANTA_REPEAT_POLICY', 'avoid')
+# Рассылка: общий лимит Telegram около 30 сообщений в секунду и число одновременных запросов
+BROADCAST_RATE = float(os.environ.get('SECRET_SANTA_BROADCAST_RATE', '30'))
+BROADCAST_CONCURRENCY = int(os.environ.get('SECRET_SANTA_BROADCAST_CONCURRENCY', '8'))
+# Очередь уведомлений: число попыток доставки и предел паузы между ними (с)
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('SECRET_SANTA_OUTBOX_ATTEMPTS', '8'))
+OUTBOX_MAX_BACKOFF = float(os.environ.get('SECRET_SANTA_OUTBOX_MAX_BACKOFF', '3600'))
+# Сколько дней хранятся уведомления, которые так и не удалось доставить (статус failed)
+OUTBOX_RETENTION_DAYS = int(os.environ.get('SECRET_SANTA_OUTBOX_RETENTION_DAYS', '7'))
+# Окно (с), в течение которого однотипные уведомления организатору копятся в одну сводку
+DIGEST_WINDOW = float(os.environ.get('SECRET_SANTA_DIGEST_WINDOW', '60'))
+
+# Профили настройки SQLite: PRAGMA, применяемые к каждому новому соединению.
+# WAL позволяет читателям не ждать писателя, busy_timeout (мс) вместо
+# немедленной ошибки "database is locked" ждет освобождения блокировки,
+# cache_size в отрицательных значениях задается в КиБ.
+STORAGE_PROFILES = {
+    # Каждый коммит сбрасывается на диск: ничего не теряется даже при отключении питания
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 10000,
+        'cache_size': -8000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+    # По умолчанию: в WAL режим NORMAL сохраняет целостность базы,
+    # при сбое питания могут потеряться только последние коммиты
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -32000,
+        'mmap_size': 64 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    # Без fsync: для бенчмарков и тестовых стендов, где данные не жалко
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'busy_timeout': 5000,
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
     },
-    'en': {
-        'welcome': "🎅 Welcome to Secret Santa!",
-        'help': """
-🎅 *Secret Santa - Help* 🎅
-
-*Main commands:*
-/start - Start using the bot
-/register - Register for participation
-/create - Create a new game
-/join - Join an existing game
-/my_games - View my games
-/draw <game_id> - Draw names (for admin)
-/message - Send anonymous message
-/messages - View anonymous messages
-/gift_sent <game_id> - Confirm gift sent
-/gift_received <game_id> - Confirm gift received
-/gift_status <game_id> - Gift status in game
-/reminders - Reminder settings
-/language - Choose language
-/help - Show this help
-
-*How it works:*
-1. 📝 Register with /register
-2. 🎮 Create a game (/create) or join existing one (/join)
-3. 👥 Wait for enough participants
-4. 🎲 Admin draws names (/draw)
-5. 🎅 Each participant gets who to gift
-6. 📨 Communicate anonymously via /message
-7. 🎁 Confirm sending and receiving gifts
-8. ⭐ Rate gifts and leave feedback
-
-*Note:* Minimum 3 participants for drawing.
-""",
-        'game_created': "🎉 Game '{}' created successfully!",
-        'registration_complete': "🎉 Congratulations! You have been registered successfully!",
-    }
 }
 
-# Инициализация базы данных
-def init_db():
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
-    
-    # Таблица пользователей
-    cursor.execute('''
+# Размер кэша подготовленных выражений на соединение: с запасом на все SQL репозиториев
+STATEMENT_CACHE_SIZE = 256
+
+def get_storage_profile(profile):
+    """PRAGMA профиля по имени; словарь используется как есть поверх 'balanced'"""
+    if isinstance(profile, dict):
+        return {**STORAGE_PROFILES['balanced'], **profile}
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Неизвестный профиль хранилища: {profile}")
+    return STORAGE_PROFILES[profile]
+
+# Общий слой доступа к базе данных
+class Database:
+    """Долгоживущие соединения с SQLite: по одному соединению и курсору на поток.
+
+    Все обработчики работают с базой только через этот класс, он же
+    единственное место, где открываются и фиксируются транзакции.
+    Асинхронные обработчики вызывают методы с префиксом a* и run_transaction:
+    запросы выполняются в выделенных потоках и не блокируют цикл событий бота.
+    Записи идут через единственный поток-писатель, чтения (afetchone, afetchall,
+    read) - через пул потоков с соединениями только для чтения: в режиме WAL
+    они не ждут писателя и видят последнее зафиксированное состояние.
+    """
+
+    def __init__(self, path, profile=DB_PROFILE, read_pool_size=READ_POOL_SIZE):
+        self.path = path
+        self.pragmas = get_storage_profile(profile)
+        self._local = local()
+        self._lock = Lock()
+        self._connections = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='santa-db')
+        self._read_executor = ThreadPoolExecutor(
+            max_workers=read_pool_size, thread_name_prefix='santa-db-read',
+            initializer=self._mark_reader
+        )
+
+    def _mark_reader(self):
+        self._local.readonly = True
+
+    def _connect(self, readonly=False):
+        # isolation_level=None: транзакции открываем сами в transaction().
+        # Соединение используется только своим потоком, close() закрывает все разом
+        conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        # journal_mode первым: остальные настройки относятся уже к WAL
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        # Ключ группы истории пар считается той же функцией, что и в MemoryStorage
+        conn.create_function('casefold', 1, group_name, deterministic=True)
+        if readonly:
+            # Случайная запись из потока чтения завершится ошибкой, а не гонкой с писателем
+            conn.execute('PRAGMA query_only = ON')
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _state(self):
+        state = self._local
+        if getattr(state, 'conn', None) is None:
+            state.conn = self._connect(getattr(state, 'readonly', False))
+            state.cursor = state.conn.cursor()
+            state.depth = 0
+        return state
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """Транзакция на соединении текущего потока; вложенные вызовы входят во внешнюю.
+
+        immediate=True сразу берет блокировку на запись (BEGIN IMMEDIATE).
+        """
+        state = self._state()
+        if state.depth == 0:
+            state.cursor.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        state.depth += 1
+        try:
+            yield state.cursor
+        except BaseException:
+            state.depth -= 1
+            if state.depth == 0:
+                state.cursor.execute('ROLLBACK')
+            raise
+        state.depth -= 1
+        if state.depth == 0:
+            state.cursor.execute('COMMIT')
+
+    def fetchone(self, sql, params=()):
+        cursor = self._state().cursor
+        cursor.execute(sql, params)
+        return cursor.fetchone()
+
+    def fetchall(self, sql, params=()):
+        cursor = self._state().cursor
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+    def execute(self, sql, params=()):
+        """Одиночный оператор записи в собственной транзакции, возвращает rowcount"""
+        with self.transaction() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    # ---------- Асинхронный доступ ----------
+
+    async def run(self, func, *args):
+        """Выполнение синхронной функции работы с базой в потоке-писателе"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    async def read(self, func, *args):
+        """Выполнение функции, которая только читает, в пуле соединений для чтения"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, partial(func, *args))
+
+    async def afetchone(self, sql, params=()):
+        return await self.read(self.fetchone, sql, params)
+
+    async def afetchall(self, sql, params=()):
+        return await self.read(self.fetchall, sql, params)
+
+    async def aexecute(self, sql, params=()):
+        return await self.run(self.execute, sql, params)
+
+    def _run_transaction(self, func, *args):
+        with self.transaction() as cursor:
+            return func(cursor, *args)
+
+    async def run_transaction(self, func, *args):
+        """Выполнение func(cursor, *args) в одной транзакции в потоке БД"""
+        return await self.run(self._run_transaction, func, *args)
+
+    def close(self):
+        """Закрытие всех соединений при остановке бота"""
+        self._read_executor.shutdown(wait=True)
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = local()
+
+# Групповой коммит мелких записей
+class GroupCommitWriter:
+    """Единственный писатель для мелких однострочных записей.
+
+    Операторы копятся в очереди не дольше max_delay секунд (или до max_batch
+    штук) и фиксируются одной транзакцией: один fsync на пачку вместо одного
+    на каждую запись. Каждый оператор выполняется в своей точке сохранения,
+    поэтому ошибка одного не откатывает остальные.
+    """
+
+    def __init__(self, database, max_delay=0.005, max_batch=500):
+        self.db = database
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.batches = 0
+        self.writes = 0
+        self._queue = None
+        self._task = None
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def submit(self, sql, params=(), *related):
+        """Постановка записи в очередь; future завершается после коммита с rowcount.
+
+        related - пары (sql, params), которые фиксируются или откатываются
+        вместе с основной записью (например, уведомления в outbox).
+        """
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(([(sql, params), *related], future))
+        return future
+
+    async def write(self, sql, params=(), *related, wait=True):
+        """Запись через общий коммит; wait=False не ждет фиксации на диске"""
+        future = self.submit(sql, params, *related)
+        if wait:
+            return await future
+        future.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Ошибка отложенной записи в базу: {future.exception()}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            stopping = False
+            while len(batch) < self.max_batch:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch):
+        groups = [statements for statements, _ in batch]
+        try:
+            results = await self.db.run(self._commit, groups)
+        except Exception as e:
+            results = [e] * len(batch)
+        self.batches += 1
+        self.writes += len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _commit(self, groups):
+        results = []
+        with self.db.transaction() as cursor:
+            for statements in groups:
+                cursor.execute('SAVEPOINT grouped_write')
+                try:
+                    (sql, params), *related = statements
+                    cursor.execute(sql, params)
+                    rowcount = cursor.rowcount
+                    for sql, params in related:
+                        cursor.execute(sql, params)
+                    results.append(rowcount)
+                except sqlite3.Error as e:
+                    cursor.execute('ROLLBACK TO grouped_write')
+                    results.append(e)
+                cursor.execute('RELEASE grouped_write')
+        return results
+
+    async def close(self):
+        """Фиксация всего, что уже в очереди, и остановка писателя"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+db = Database(DB_PATH, DB_PROFILE)
+
+# Миграции схемы: (версия, описание, список SQL-операторов).
+# Каждая миграция применяется один раз в отдельной короткой транзакции,
+# примененные версии записываются в таблицу schema_version.
+# Новые изменения схемы добавляются только в конец списка.
+MIGRATIONS = [
+    (1, 'Базовые таблицы', [
+        # Таблица пользователей
+        '''
         CREATE TABLE IF NOT EXISTS users (
             user_id INTEGER PRIMARY KEY,
             username TEXT,
@@ -118,10 +521,9 @@ def init_db():
             wishes TEXT,
             registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    # Таблица игр
-    cursor.execute('''
+        ''',
+        # Таблица игр
+        '''
         CREATE TABLE IF NOT EXISTS games (
             game_id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT,
@@ -131,10 +533,9 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             status TEXT DEFAULT 'active'
         )
-    ''')
-    
-    # Таблица участников игр
-    cursor.execute('''
+        ''',
+        # Таблица участников игр
+        '''
         CREATE TABLE IF NOT EXISTS game_participants (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             game_id INTEGER,
@@ -143,10 +544,9 @@ def init_db():
             FOREIGN KEY (game_id) REFERENCES games (game_id),
             FOREIGN KEY (user_id) REFERENCES users (user_id)
         )
-    ''')
-    
-    # Таблица для напоминаний
-    cursor.execute('''
+        ''',
+        # Таблица для напоминаний
+        '''
         CREATE TABLE IF NOT EXISTS reminders (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             game_id INTEGER,
@@ -158,10 +558,9 @@ def init_db():
             FOREIGN KEY (game_id) REFERENCES games (game_id),
             FOREIGN KEY (user_id) REFERENCES users (user_id)
         )
-    ''')
-    
-    # Таблица для анонимных сообщений
-    cursor.execute('''
+        ''',
+        # Таблица для анонимных сообщений
+        '''
         CREATE TABLE IF NOT EXISTS anonymous_messages (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             game_id INTEGER,
@@ -174,10 +573,9 @@ def init_db():
             FOREIGN KEY (from_user_id) REFERENCES users (user_id),
             FOREIGN KEY (to_user_id) REFERENCES users (user_id)
         )
-    ''')
-    
-    # Таблица для подтверждения подарков
-    cursor.execute('''
+        ''',
+        # Таблица для подтверждения подарков
+        '''
         CREATE TABLE IF NOT EXISTS gift_confirmations (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             game_id INTEGER,
@@ -192,10 +590,9 @@ def init_db():
             FOREIGN KEY (game_id) REFERENCES games (game_id),
             FOREIGN KEY (user_id) REFERENCES users (user_id)
         )
-    ''')
-    
-    # Таблица для настроек языка
-    cursor.execute('''
+        ''',
+        # Таблица для настроек языка
+        '''
         CREATE TABLE IF NOT EXISTS user_settings (
             user_id INTEGER PRIMARY KEY,
             language TEXT DEFAULT 'ru',
@@ -203,38 +600,1961 @@ def init_db():
             reminders_enabled BOOLEAN DEFAULT TRUE,
             FOREIGN KEY (user_id) REFERENCES users (user_id)
         )
-    ''')
-    
-    conn.commit()
-    conn.close()
+        ''',
+    ]),
+    (2, 'Индексы для частых выборок', [
+        'CREATE INDEX IF NOT EXISTS idx_game_participants_game_user ON game_participants (game_id, user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_game_participants_game_assigned ON game_participants (game_id, assigned_to)',
+        'CREATE INDEX IF NOT EXISTS idx_game_participants_user ON game_participants (user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_games_event_date ON games (event_date)',
+        'CREATE INDEX IF NOT EXISTS idx_anonymous_messages_to_read ON anonymous_messages (to_user_id, is_read)',
+        'CREATE INDEX IF NOT EXISTS idx_reminders_game_type ON reminders (game_id, reminder_type)',
+        'CREATE INDEX IF NOT EXISTS idx_gift_confirmations_game_user ON gift_confirmations (game_id, user_id)',
+    ]),
+    (3, 'Уникальные ключи для gift_confirmations и game_participants', [
+        # Сливаем дубликаты подтверждений в самую раннюю строку пары (game_id, user_id)
+        '''
+        UPDATE gift_confirmations SET
+            gift_sent = (SELECT MAX(d.gift_sent) FROM gift_confirmations d
+                         WHERE d.game_id = gift_confirmations.game_id AND d.user_id = gift_confirmations.user_id),
+            gift_received = (SELECT MAX(d.gift_received) FROM gift_confirmations d
+                             WHERE d.game_id = gift_confirmations.game_id AND d.user_id = gift_confirmations.user_id),
+            sent_at = (SELECT MAX(d.sent_at) FROM gift_confirmations d
+                       WHERE d.game_id = gift_confirmations.game_id AND d.user_id = gift_confirmations.user_id),
+            received_at = (SELECT MAX(d.received_at) FROM gift_confirmations d
+                           WHERE d.game_id = gift_confirmations.game_id AND d.user_id = gift_confirmations.user_id),
+            rating = (SELECT d.rating FROM gift_confirmations d
+                      WHERE d.game_id = gift_confirmations.game_id AND d.user_id = gift_confirmations.user_id
+                      AND d.rating IS NOT NULL ORDER BY d.id DESC LIMIT 1),
+            feedback = (SELECT d.feedback FROM gift_confirmations d
+                        WHERE d.game_id = gift_confirmations.game_id AND d.user_id = gift_confirmations.user_id
+                        AND d.feedback IS NOT NULL ORDER BY d.id DESC LIMIT 1)
+        WHERE id IN (
+            SELECT MIN(id) FROM gift_confirmations
+            GROUP BY game_id, user_id HAVING COUNT(*) > 1
+        )
+        ''',
+        '''
+        DELETE FROM gift_confirmations WHERE id NOT IN (
+            SELECT MIN(id) FROM gift_confirmations GROUP BY game_id, user_id
+        )
+        ''',
+        # Из повторных участий оставляем строку с назначением, иначе самую раннюю
+        '''
+        DELETE FROM game_participants WHERE id NOT IN (
+            SELECT COALESCE(MIN(CASE WHEN assigned_to IS NOT NULL THEN id END), MIN(id))
+            FROM game_participants GROUP BY game_id, user_id
+        )
+        ''',
+        'DROP INDEX IF EXISTS idx_gift_confirmations_game_user',
+        'DROP INDEX IF EXISTS idx_game_participants_game_user',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_gift_confirmations_game_user ON gift_confirmations (game_id, user_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_game_participants_game_user ON game_participants (game_id, user_id)',
+    ]),
+    (4, 'Исключенные пары жеребьевки', [
+        # user_id не дарит excluded_id; пары пишутся в обе стороны
+        '''
+        CREATE TABLE IF NOT EXISTS draw_exclusions (
+            game_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            excluded_id INTEGER NOT NULL,
+            PRIMARY KEY (game_id, user_id, excluded_id),
+            FOREIGN KEY (game_id) REFERENCES games (game_id)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (5, 'История пар по группам игр', [
+        # Группа - игры одного организатора с одним названием; сезон - год даты обмена.
+        # Без внешнего ключа на games: история переживает архивацию игр
+        '''
+        CREATE TABLE IF NOT EXISTS pairing_history (
+            admin_id INTEGER NOT NULL,
+            game_name TEXT NOT NULL COLLATE NOCASE,
+            giver_id INTEGER NOT NULL,
+            receiver_id INTEGER NOT NULL,
+            season INTEGER NOT NULL,
+            game_id INTEGER NOT NULL,
+            PRIMARY KEY (admin_id, game_name, giver_id, receiver_id, season, game_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_pairing_history_game ON pairing_history (game_id)',
+    ]),
+    (6, 'Очередь исходящих уведомлений', [
+        # Текст рендерится при доставке на текущем языке получателя; время - unix-секунды.
+        # Доставленные строки удаляются, исчерпавшие попытки остаются со статусом 'failed'
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            template TEXT NOT NULL,
+            params TEXT NOT NULL,
+            parse_mode TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            next_attempt_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON outbox (status, next_attempt_at)',
+    ]),
+    (7, 'Недоступные пользователи', [
+        # Строка живет, пока пользователь не напишет боту снова (разблокирует его)
+        '''
+        CREATE TABLE IF NOT EXISTS unreachable_users (
+            user_id INTEGER PRIMARY KEY,
+            reason TEXT,
+            failures INTEGER NOT NULL DEFAULT 1,
+            since TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_failure_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_chat ON outbox (chat_id, status)',
+    ]),
+    (8, 'Сводки уведомлений', [
+        # Уведомления с одинаковым ключом digest одному получателю отправляются одной сводкой
+        'ALTER TABLE outbox ADD COLUMN digest TEXT',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_digest ON outbox (digest) WHERE digest IS NOT NULL',
+    ]),
+    (9, 'Задания рассылки', [
+        # Задание - пачка уведомлений одного события игры (kind = 'draw'); доставленные строки
+        # из outbox удаляются, поэтому прогресс считается как total минус оставшиеся
+        '''
+        CREATE TABLE IF NOT EXISTS delivery_jobs (
+            job_id INTEGER PRIMARY KEY,
+            game_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_delivery_jobs_game ON delivery_jobs (game_id, kind)',
+        'ALTER TABLE outbox ADD COLUMN job_id INTEGER',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_job ON outbox (job_id) WHERE job_id IS NOT NULL',
+    ]),
+    (10, 'Названия групп истории через casefold', [
+        # COLLATE NOCASE сворачивает только ASCII: 'Офис' и 'офис' считались разными группами.
+        # Строки, совпавшие после свертки с уже существующими, - дубликаты и удаляются
+        'UPDATE OR IGNORE pairing_history SET game_name = casefold(game_name)',
+        'DELETE FROM pairing_history WHERE game_name != casefold(game_name) COLLATE BINARY',
+    ]),
+]
+
+def get_schema_version(database=None):
+    """Текущая версия схемы базы данных"""
+    database = database or db
+    return database.fetchone('SELECT COALESCE(MAX(version), 0) FROM schema_version')[0]
+
+def migrate(database=None):
+    """Применение недостающих миграций к базе данных"""
+    database = database or db
+    database.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    for version, description, statements in MIGRATIONS:
+        # BEGIN IMMEDIATE: второй запущенный экземпляр дождется блокировки
+        # и увидит, что миграция уже применена
+        with database.transaction(immediate=True) as cursor:
+            if get_schema_version(database) >= version:
+                continue
+            for sql in statements:
+                cursor.execute(sql)
+            cursor.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+        logger.info(f"Применена миграция схемы {version}: {description}")
+
+# Инициализация базы данных
+def init_db():
+    migrate()
+
+# ========== РЕПОЗИТОРИИ ==========
+
+# Записи выборок. __slots__ вместо __dict__ экономит память на каждой строке,
+# а поля перечислены явно в том же порядке, что и колонки в SELECT.
+class Record:
+    """Базовый класс компактных записей: поля перечислены в _fields"""
+    __slots__ = ()
+    _fields = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self._fields, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row) if row is not None else None
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self._fields
+        )
+
+    def __repr__(self):
+        values = ', '.join(f"{name}={getattr(self, name)!r}" for name in self._fields)
+        return f"{type(self).__name__}({values})"
+
+class User(Record):
+    __slots__ = _fields = ('user_id', 'username', 'first_name', 'wishes')
+
+class Game(Record):
+    __slots__ = _fields = ('game_id', 'name', 'admin_id', 'budget', 'event_date', 'status')
+
+class UserSettings(Record):
+    __slots__ = _fields = ('user_id', 'language', 'reminders_enabled')
+
+class GameSummary(Record):
+    """Игра со счетчиками для списков игр и проверок перед жеребьевкой"""
+    __slots__ = _fields = (
+        'game_id', 'name', 'admin_id', 'budget', 'event_date', 'status',
+        'admin_name', 'participants_count', 'assigned_count'
+    )
+
+class DrawParticipant(Record):
+    __slots__ = _fields = ('user_id', 'first_name', 'wishes')
+
+class Assignment(Record):
+    """Назначение дарителя: кому он дарит в игре"""
+    __slots__ = _fields = ('game_id', 'game_name', 'receiver_id', 'receiver_name')
+
+class AnonymousMessage(Record):
+    __slots__ = _fields = ('message_id', 'message', 'sent_at', 'game_name')
+
+class GiftStatus(Record):
+    __slots__ = _fields = ('first_name', 'gift_sent', 'gift_received')
+
+class DueReminder(Record):
+    __slots__ = _fields = ('game_id', 'game_name', 'event_date', 'user_id')
+
+class Exclusion(Record):
+    """Пара, которая не должна выпасть при жеребьевке: user_id не дарит excluded_id"""
+    __slots__ = _fields = ('user_id', 'excluded_id')
+
+class Pairing(Record):
+    """Пара из прошлой жеребьевки группы"""
+    __slots__ = _fields = ('giver_id', 'receiver_id')
+
+class Notification(Record):
+    """Уведомление для outbox: шаблон каталога и его параметры.
+
+    digest - ключ сводки: уведомления с одним ключом одному получателю копятся
+    DIGEST_WINDOW секунд и уходят одним сообщением.
+    """
+    __slots__ = _fields = ('chat_id', 'template', 'params', 'parse_mode', 'digest')
+
+    def __init__(self, chat_id, template, params=None, parse_mode=None, digest=None):
+        super().__init__(chat_id, template, params or {}, parse_mode, digest)
+
+class OutboxMessage(Record):
+    __slots__ = _fields = ('id', 'chat_id', 'template', 'params', 'parse_mode', 'attempts', 'created_at', 'digest')
+
+class OutboxStats(Record):
+    """Глубина очереди, возраст самого старого уведомления (с), отложенные для недоступных и недоставленные"""
+    __slots__ = _fields = ('pending', 'oldest_age', 'held', 'failed')
+
+class DeliveryProgress(Record):
+    """Прогресс задания рассылки: всего, в очереди, отложено для недоступных, не доставлено"""
+    __slots__ = _fields = ('total', 'created_at', 'pending', 'held', 'failed')
+
+    @property
+    def delivered(self):
+        return self.total - self.pending - self.held - self.failed
+
+class UnreachableUser(Record):
+    """Участник, которому бот не может писать"""
+    __slots__ = _fields = ('user_id', 'first_name', 'username', 'reason', 'failures', 'since')
+
+class DonorInfo(Record):
+    """Даритель получателя, которого нужно уведомить об оценке"""
+    __slots__ = _fields = ('donor_id', 'game_name')
+
+# Репозитории держат SQL в атрибутах класса: одна и та же строка на каждый
+# вызов попадает в кэш подготовленных выражений соединения (cached_statements)
+# и не компилируется заново.
+class Repository:
+    def __init__(self, database, writer):
+        self.db = database
+        # Мелкие записи идут через общий писатель с групповым коммитом
+        self.writer = writer
+
+    async def _one(self, record, sql, params=()):
+        return record.from_row(await self.db.afetchone(sql, params))
+
+    async def _all(self, record, sql, params=()):
+        return [record(*row) for row in await self.db.afetchall(sql, params)]
+
+class UserRepository(Repository):
+    """Пользователи"""
+    GET = 'SELECT user_id, username, first_name, wishes FROM users WHERE user_id = ?'
+    INSERT = 'INSERT INTO users (user_id, username, first_name, wishes) VALUES (?, ?, ?, ?)'
+    INSERT_SETTINGS = '''
+        INSERT INTO user_settings (user_id)
+        VALUES (?)
+        ON CONFLICT (user_id) DO NOTHING
+    '''
+
+    async def get(self, user_id):
+        return await self._one(User, self.GET, (user_id,))
+
+    def _register(self, cursor, user_id, username, first_name, wishes):
+        cursor.execute(self.INSERT, (user_id, username, first_name, wishes))
+        # Создаем настройки по умолчанию
+        cursor.execute(self.INSERT_SETTINGS, (user_id,))
+
+    async def register(self, user_id, username, first_name, wishes):
+        await self.db.run_transaction(self._register, user_id, username, first_name, wishes)
+
+class SettingsRepository(Repository):
+    """Настройки пользователей: язык и напоминания"""
+    GET = 'SELECT user_id, language, reminders_enabled FROM user_settings WHERE user_id = ?'
+    # Список ID передается одним JSON-параметром: один и тот же текст запроса
+    # для любого числа пользователей и без лимита на число параметров
+    GET_MANY = '''
+        SELECT user_id, language, reminders_enabled FROM user_settings
+        WHERE user_id IN (SELECT value FROM json_each(?))
+    '''
+    SET_LANGUAGE = '''
+        INSERT INTO user_settings (user_id, language)
+        VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET language = excluded.language
+    '''
+    SET_REMINDERS = '''
+        INSERT INTO user_settings (user_id, reminders_enabled)
+        VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET reminders_enabled = excluded.reminders_enabled
+    '''
+
+    async def get(self, user_id):
+        """Настройки пользователя; значения по умолчанию, если строки еще нет"""
+        settings = await self._one(UserSettings, self.GET, (user_id,))
+        return settings or UserSettings(user_id, DEFAULT_LANGUAGE, True)
+
+    async def get_many(self, user_ids):
+        """Настройки группы пользователей одним запросом: {user_id: UserSettings}"""
+        user_ids = list(set(user_ids))
+        if not user_ids:
+            return {}
+        found = {
+            settings.user_id: settings
+            for settings in await self._all(UserSettings, self.GET_MANY, (json.dumps(user_ids),))
+        }
+        return {user_id: found.get(user_id) or UserSettings(user_id, DEFAULT_LANGUAGE, True) for user_id in user_ids}
+
+    async def set_language(self, user_id, language):
+        await self.writer.write(self.SET_LANGUAGE, (user_id, language))
+
+    async def set_reminders(self, user_id, enabled):
+        await self.writer.write(self.SET_REMINDERS, (user_id, enabled))
+
+class SettingsCache:
+    """LRU-кэш строк user_settings поверх репозитория настроек.
+
+    Язык нужен почти каждому обработчику, а меняется редко: после прогрева
+    большинство обновлений обходится без запроса настроек. Записи идут
+    сквозь кэш: сначала в базу, затем обновляется закэшированная строка.
+    """
+
+    def __init__(self, settings, maxsize=SETTINGS_CACHE_SIZE):
+        self.settings = settings
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()
+        # Меняется при каждой записи: промах, начатый до нее, не кладет в кэш устаревшую строку
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _remember(self, settings):
+        self._rows[settings.user_id] = settings
+        self._rows.move_to_end(settings.user_id)
+        if len(self._rows) > self.maxsize:
+            self._rows.popitem(last=False)
+
+    async def get(self, user_id):
+        settings = self._rows.get(user_id)
+        if settings is not None:
+            self.hits += 1
+            self._rows.move_to_end(user_id)
+            return settings
+        self.misses += 1
+        generation = self._generation
+        settings = await self.settings.get(user_id)
+        if generation == self._generation:
+            self._remember(settings)
+        return settings
+
+    async def get_many(self, user_ids):
+        """Настройки группы пользователей: из кэша, остальные одним запросом"""
+        result = {}
+        missing = []
+        for user_id in set(user_ids):
+            settings = self._rows.get(user_id)
+            if settings is None:
+                missing.append(user_id)
+            else:
+                self.hits += 1
+                self._rows.move_to_end(user_id)
+                result[user_id] = settings
+        if missing:
+            self.misses += len(missing)
+            generation = self._generation
+            loaded = await self.settings.get_many(missing)
+            if generation == self._generation:
+                for settings in loaded.values():
+                    self._remember(settings)
+            result.update(loaded)
+        return result
+
+    async def set_language(self, user_id, language):
+        await self.settings.set_language(user_id, language)
+        self._generation += 1
+        cached = self._rows.get(user_id)
+        if cached is not None:
+            self._rows[user_id] = UserSettings(user_id, language, cached.reminders_enabled)
+
+    async def set_reminders(self, user_id, enabled):
+        await self.settings.set_reminders(user_id, enabled)
+        self._generation += 1
+        cached = self._rows.get(user_id)
+        if cached is not None:
+            self._rows[user_id] = UserSettings(user_id, cached.language, enabled)
+
+class GameRepository(Repository):
+    """Игры"""
+    INSERT = 'INSERT INTO games (name, admin_id, budget, event_date) VALUES (?, ?, ?, ?)'
+    INSERT_ADMIN = 'INSERT INTO game_participants (game_id, user_id) VALUES (?, ?)'
+    GET = 'SELECT game_id, name, admin_id, budget, event_date, status FROM games WHERE game_id = ?'
+    SUMMARY = '''
+        SELECT g.game_id, g.name, g.admin_id, g.budget, g.event_date, g.status,
+               u.first_name,
+               (SELECT COUNT(*) FROM game_participants
+                WHERE game_id = g.game_id),
+               (SELECT COUNT(*) FROM game_participants
+                WHERE game_id = g.game_id AND assigned_to IS NOT NULL)
+        FROM games g
+        LEFT JOIN users u ON g.admin_id = u.user_id
+        WHERE g.game_id = ?
+    '''
+    # Активные игры, к которым пользователь еще не присоединился
+    AVAILABLE = '''
+        SELECT g.game_id, g.name, g.admin_id, g.budget, g.event_date, g.status,
+               u.first_name, COUNT(gp.user_id), NULL
+        FROM games g
+        JOIN game_participants gp ON g.game_id = gp.game_id
+        LEFT JOIN users u ON g.admin_id = u.user_id
+        WHERE g.status = 'active'
+        AND NOT EXISTS (
+            SELECT 1 FROM game_participants mine
+            WHERE mine.game_id = g.game_id AND mine.user_id = ?
+        )
+        GROUP BY g.game_id
+    '''
+    # Игры, где пользователь участник
+    FOR_USER = '''
+        SELECT g.game_id, g.name, g.admin_id, g.budget, g.event_date, g.status,
+               NULL, COUNT(gp.user_id), COUNT(gp.assigned_to)
+        FROM game_participants mine
+        JOIN games g ON g.game_id = mine.game_id
+        JOIN game_participants gp ON gp.game_id = g.game_id
+        WHERE mine.user_id = ?
+        GROUP BY g.game_id
+        ORDER BY g.event_date
+    '''
+
+    def _create(self, cursor, name, admin_id, budget, event_date):
+        cursor.execute(self.INSERT, (name, admin_id, budget, event_date))
+        game_id = cursor.lastrowid
+        # Добавляем создателя как участника
+        cursor.execute(self.INSERT_ADMIN, (game_id, admin_id))
+        return game_id
+
+    async def create(self, name, admin_id, budget, event_date):
+        """Создание игры вместе с участием организатора, возвращает game_id"""
+        return await self.db.run_transaction(self._create, name, admin_id, budget, event_date)
+
+    async def get(self, game_id):
+        return await self._one(Game, self.GET, (game_id,))
+
+    async def summary(self, game_id):
+        return await self._one(GameSummary, self.SUMMARY, (game_id,))
+
+    async def available_for(self, user_id):
+        return await self._all(GameSummary, self.AVAILABLE, (user_id,))
+
+    async def for_user(self, user_id):
+        return await self._all(GameSummary, self.FOR_USER, (user_id,))
+
+class ParticipantRepository(Repository):
+    """Участники игр и результаты жеребьевки"""
+    JOIN = '''
+        INSERT INTO game_participants (game_id, user_id)
+        VALUES (?, ?)
+        ON CONFLICT (game_id, user_id) DO NOTHING
+    '''
+    FOR_DRAW = '''
+        SELECT gp.user_id, u.first_name, u.wishes
+        FROM game_participants gp
+        JOIN users u ON gp.user_id = u.user_id
+        WHERE gp.game_id = ?
+    '''
+    ASSIGN = 'UPDATE game_participants SET assigned_to = ? WHERE game_id = ? AND user_id = ?'
+    RESET = 'UPDATE game_participants SET assigned_to = NULL WHERE game_id = ?'
+    # История пар пишется в той же транзакции, что и результаты жеребьевки
+    RECORD_HISTORY = '''
+        INSERT INTO pairing_history (admin_id, game_name, giver_id, receiver_id, season, game_id)
+        SELECT g.admin_id, casefold(g.name), gp.user_id, gp.assigned_to,
+               CAST(strftime('%Y', COALESCE(g.event_date, 'now')) AS INTEGER), g.game_id
+        FROM game_participants gp
+        JOIN games g ON gp.game_id = g.game_id
+        WHERE gp.game_id = ? AND gp.assigned_to IS NOT NULL
+        ON CONFLICT DO NOTHING
+    '''
+    RESET_HISTORY = 'DELETE FROM pairing_history WHERE game_id = ?'
+    RECEIVER = 'SELECT assigned_to FROM game_participants WHERE game_id = ? AND user_id = ?'
+    SANTA = 'SELECT user_id FROM game_participants WHERE game_id = ? AND assigned_to = ?'
+    FIND = '''
+        SELECT gp.user_id
+        FROM game_participants gp
+        JOIN users u ON gp.user_id = u.user_id
+        WHERE gp.game_id = ? AND (gp.user_id = ? OR u.username = ? COLLATE NOCASE)
+    '''
+    MEMBER_GAME = '''
+        SELECT g.game_id, g.name, g.admin_id, g.budget, g.event_date, g.status
+        FROM game_participants gp
+        JOIN games g ON gp.game_id = g.game_id
+        WHERE gp.game_id = ? AND gp.user_id = ?
+    '''
+    ASSIGNMENTS = '''
+        SELECT g.game_id, g.name, u.user_id, u.first_name
+        FROM game_participants gp
+        JOIN games g ON g.game_id = gp.game_id
+        JOIN users u ON gp.assigned_to = u.user_id
+        WHERE gp.user_id = ?
+    '''
+    ASSIGNMENT = '''
+        SELECT g.game_id, g.name, u.user_id, u.first_name
+        FROM game_participants gp
+        JOIN games g ON g.game_id = gp.game_id
+        JOIN users u ON gp.assigned_to = u.user_id
+        WHERE gp.game_id = ? AND gp.user_id = ?
+    '''
+
+    def _join(self, cursor, game_id, user_id, notify):
+        # Повторная вставка упирается в уникальный ключ (game_id, user_id)
+        # и ничего не меняет
+        cursor.execute(self.JOIN, (game_id, user_id))
+        if cursor.rowcount == 0:
+            return None
+        cursor.execute(GameRepository.SUMMARY, (game_id,))
+        # None, если игру успели заархивировать или удалить
+        game_info = GameSummary.from_row(cursor.fetchone())
+        if game_info is not None and notify is not None:
+            OutboxRepository.enqueue(cursor, notify(game_info))
+        return game_info
+
+    async def join(self, game_id, user_id, notify=None):
+        """Вступление в игру; None, если пользователь уже участвует.
+
+        notify(game_info) возвращает уведомления, которые ставятся в outbox в
+        той же транзакции.
+        """
+        return await self.db.run_transaction(self._join, game_id, user_id, notify)
+
+    async def for_draw(self, game_id):
+        return await self._all(DrawParticipant, self.FOR_DRAW, (game_id,))
+
+    def _assign(self, cursor, game_id, pairs, notifications):
+        # Одно подготовленное выражение на все пары, строки находятся по уникальному ключу (game_id, user_id)
+        cursor.executemany(self.ASSIGN, ((receiver_id, game_id, giver_id) for giver_id, receiver_id in pairs))
+        cursor.execute(self.RECORD_HISTORY, (game_id,))
+        OutboxRepository.enqueue(cursor, notifications, job=(game_id, 'draw'))
+
+    async def assign(self, game_id, pairs, notifications=()):
+        """Сохранение пар (даритель, получатель), истории пар и уведомлений одной транзакцией.
+
+        Уведомления образуют задание рассылки 'draw' игры.
+        """
+        await self.db.run_transaction(self._assign, game_id, pairs, notifications)
+
+    def _reset(self, cursor, game_id):
+        cursor.execute(self.RESET, (game_id,))
+        # Сброшенная жеребьевка не считается прошлой парой
+        cursor.execute(self.RESET_HISTORY, (game_id,))
+        # и ее недоставленные результаты больше не нужны
+        OutboxRepository.cancel_jobs(cursor, game_id, 'draw')
+
+    async def reset(self, game_id):
+        await self.db.run_transaction(self._reset, game_id)
+
+    async def receiver_of(self, game_id, user_id):
+        row = await self.db.afetchone(self.RECEIVER, (game_id, user_id))
+        return row[0] if row else None
+
+    async def santa_of(self, game_id, user_id):
+        row = await self.db.afetchone(self.SANTA, (game_id, user_id))
+        return row[0] if row else None
+
+    async def member_game(self, game_id, user_id):
+        """Игра, если пользователь в ней участвует, иначе None"""
+        return await self._one(Game, self.MEMBER_GAME, (game_id, user_id))
+
+    async def find(self, game_id, handle):
+        """ID участника игры по @username или ID; None, если такого участника нет"""
+        username = handle.lstrip('@')
+        user_id = int(username) if username.isdigit() else None
+        row = await self.db.afetchone(self.FIND, (game_id, user_id, username))
+        return row[0] if row else None
+
+    async def assignments_of(self, user_id):
+        """Назначения пользователя во всех играх с проведенной жеребьевкой"""
+        return await self._all(Assignment, self.ASSIGNMENTS, (user_id,))
+
+    async def assignment(self, game_id, user_id):
+        return await self._one(Assignment, self.ASSIGNMENT, (game_id, user_id))
+
+class MessageRepository(Repository):
+    """Анонимные сообщения"""
+    INSERT = 'INSERT INTO anonymous_messages (game_id, from_user_id, to_user_id, message) VALUES (?, ?, ?, ?)'
+    UNREAD = '''
+        SELECT am.id, am.message, am.sent_at, g.name
+        FROM anonymous_messages am
+        JOIN games g ON am.game_id = g.game_id
+        WHERE am.to_user_id = ? AND am.is_read = FALSE
+        ORDER BY am.sent_at DESC
+    '''
+    MARK_READ = '''
+        UPDATE anonymous_messages
+        SET is_read = TRUE
+        WHERE to_user_id = ? AND is_read = FALSE AND id <= ?
+    '''
+
+    async def add(self, game_id, from_user_id, to_user_id, text, notifications=()):
+        await self.writer.write(
+            self.INSERT, (game_id, from_user_id, to_user_id, text),
+            *((OutboxRepository.ENQUEUE, OutboxRepository.row(notification)) for notification in notifications)
+        )
+
+    async def unread_for(self, user_id):
+        return await self._all(AnonymousMessage, self.UNREAD, (user_id,))
+
+    async def mark_read(self, user_id, up_to_id):
+        """Пометка прочитанными только показанных сообщений (id <= up_to_id)"""
+        await self.writer.write(self.MARK_READ, (user_id, up_to_id))
+
+class ConfirmationRepository(Repository):
+    """Подтверждения отправки и получения подарков, оценки"""
+    MARK_SENT = '''
+        INSERT INTO gift_confirmations (game_id, user_id, gift_sent, sent_at)
+        VALUES (?, ?, TRUE, CURRENT_TIMESTAMP)
+        ON CONFLICT (game_id, user_id) DO UPDATE SET
+            gift_sent = TRUE, sent_at = excluded.sent_at
+    '''
+    MARK_RECEIVED = '''
+        INSERT INTO gift_confirmations (game_id, user_id, gift_received, received_at)
+        VALUES (?, ?, TRUE, CURRENT_TIMESTAMP)
+        ON CONFLICT (game_id, user_id) DO UPDATE SET
+            gift_received = TRUE, received_at = excluded.received_at
+    '''
+    RATE = 'UPDATE gift_confirmations SET rating = ? WHERE game_id = ? AND user_id = ?'
+    RATE_WITH_FEEDBACK = '''
+        UPDATE gift_confirmations SET rating = ?, feedback = ?
+        WHERE game_id = ? AND user_id = ?
+    '''
+    DONOR = '''
+        SELECT gp.user_id, g.name
+        FROM game_participants gp
+        JOIN games g ON gp.game_id = g.game_id
+        WHERE gp.game_id = ? AND gp.assigned_to = ?
+    '''
+    STATUSES = '''
+        SELECT u.first_name, COALESCE(gc.gift_sent, FALSE), COALESCE(gc.gift_received, FALSE)
+        FROM game_participants gp
+        JOIN users u ON gp.user_id = u.user_id
+        LEFT JOIN gift_confirmations gc ON gp.game_id = gc.game_id AND gp.user_id = gc.user_id
+        WHERE gp.game_id = ?
+    '''
+
+    async def mark_sent(self, game_id, user_id, notifications=()):
+        await self.writer.write(
+            self.MARK_SENT, (game_id, user_id),
+            *((OutboxRepository.ENQUEUE, OutboxRepository.row(notification)) for notification in notifications)
+        )
+
+    async def mark_received(self, game_id, user_id):
+        await self.writer.write(self.MARK_RECEIVED, (game_id, user_id))
+
+    def _rate(self, cursor, game_id, user_id, rating, feedback, notify):
+        if feedback is None:
+            cursor.execute(self.RATE, (rating, game_id, user_id))
+        else:
+            cursor.execute(self.RATE_WITH_FEEDBACK, (rating, feedback, game_id, user_id))
+        # Находим дарителя для уведомления
+        cursor.execute(self.DONOR, (game_id, user_id))
+        donor_info = DonorInfo.from_row(cursor.fetchone())
+        if donor_info is not None and notify is not None:
+            OutboxRepository.enqueue(cursor, notify(donor_info))
+        return donor_info
+
+    async def rate(self, game_id, user_id, rating, feedback=None, notify=None):
+        """Сохранение оценки (и отзыва), возвращает дарителя подарка.
+
+        notify(donor_info) возвращает уведомления дарителю для outbox в той же
+        транзакции.
+        """
+        return await self.db.run_transaction(self._rate, game_id, user_id, rating, feedback, notify)
+
+    async def statuses(self, game_id):
+        return await self._all(GiftStatus, self.STATUSES, (game_id,))
+
+class ReminderRepository(Repository):
+    """Напоминания о предстоящих обменах подарками"""
+    # Участники игр с датой обмена event_date, которым напоминание этого типа еще не ставилось
+    DUE = '''
+        SELECT g.game_id, g.name, g.event_date, gp.user_id
+        FROM games g
+        JOIN game_participants gp ON g.game_id = gp.game_id
+        JOIN users u ON gp.user_id = u.user_id
+        LEFT JOIN reminders r ON g.game_id = r.game_id AND r.reminder_type = ?
+        WHERE g.event_date = ? AND r.id IS NULL
+    '''
+    INSERT = '''
+        INSERT INTO reminders (game_id, user_id, reminder_type, scheduled_time)
+        VALUES (?, ?, ?, ?)
+    '''
+    MARK_SENT = '''
+        UPDATE reminders SET sent = TRUE
+        WHERE game_id = ? AND user_id = ? AND reminder_type = ?
+    '''
+
+    async def due(self, event_date, reminder_type):
+        return await self._all(DueReminder, self.DUE, (reminder_type, event_date))
+
+    async def record(self, game_id, user_id, reminder_type):
+        await self.writer.write(self.INSERT, (game_id, user_id, reminder_type, datetime.now().isoformat()))
+
+    async def mark_sent(self, game_id, user_id, reminder_type):
+        # Отметка об отправке не критична: не ждем коммита
+        await self.writer.write(self.MARK_SENT, (game_id, user_id, reminder_type), wait=False)
+
+# Таблицы, строки которых уходят в архив вместе со своей игрой
+ARCHIVED_TABLES = (
+    'game_participants', 'anonymous_messages', 'gift_confirmations', 'reminders', 'draw_exclusions', 'delivery_jobs'
+)
+
+class OutboxRepository(Repository):
+    """Исходящие уведомления.
+
+    Другие репозитории добавляют строки в той же транзакции, что и изменение
+    состояния: уведомление не теряется, даже если процесс упадет до отправки.
+    Доставляет их OutboxDispatcher.
+    """
+    ENQUEUE = '''
+        INSERT INTO outbox (chat_id, template, params, parse_mode, digest, created_at, next_attempt_at, job_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    START_JOB = 'INSERT INTO delivery_jobs (game_id, kind, total) VALUES (?, ?, ?)'
+    # Неотправленные уведомления заданий игры, например результаты сброшенной жеребьевки
+    CANCEL_JOBS = '''
+        DELETE FROM outbox
+        WHERE job_id IN (SELECT job_id FROM delivery_jobs WHERE game_id = ? AND kind = ?)
+    '''
+    DELETE_JOBS = 'DELETE FROM delivery_jobs WHERE game_id = ? AND kind = ?'
+    PROGRESS = '''
+        SELECT j.total, j.created_at,
+               COALESCE(SUM(o.status = 'pending'), 0),
+               COALESCE(SUM(o.status = 'held'), 0),
+               COALESCE(SUM(o.status = 'failed'), 0)
+        FROM delivery_jobs j
+        LEFT JOIN outbox o ON o.job_id = j.job_id
+        WHERE j.job_id = (SELECT MAX(job_id) FROM delivery_jobs WHERE game_id = ? AND kind = ?)
+        GROUP BY j.job_id
+    '''
+    DUE = '''
+        SELECT id, chat_id, template, params, parse_mode, attempts, created_at, digest FROM outbox
+        WHERE status = 'pending' AND next_attempt_at <= ?
+        ORDER BY next_attempt_at
+        LIMIT ?
+    '''
+    # Все ожидающие строки сводок, даже если окно последних еще не истекло
+    PENDING_DIGESTS = '''
+        SELECT id, chat_id, template, params, parse_mode, attempts, created_at, digest FROM outbox
+        WHERE status = 'pending' AND digest IN (SELECT value FROM json_each(?))
+        ORDER BY id
+    '''
+    NEXT_ATTEMPT = "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+    DELIVERED = 'DELETE FROM outbox WHERE id IN (SELECT value FROM json_each(?))'
+    RETRY = 'UPDATE outbox SET attempts = ?, next_attempt_at = ?, status = ? WHERE id = ?'
+    # Уведомления недоступным пользователям ждут, пока ReachabilityRepository не вернет их в очередь
+    HOLD = "UPDATE outbox SET status = 'held' WHERE id IN (SELECT value FROM json_each(?))"
+    RELEASE = "UPDATE outbox SET status = 'pending', next_attempt_at = ? WHERE chat_id = ? AND status = 'held'"
+    # Строки заданий рассылки не трогаем: по ним progress считает недоставленное,
+    # они уходят вместе с заданием при сбросе жеребьевки или архивации игры
+    PURGE_FAILED = "DELETE FROM outbox WHERE status = 'failed' AND job_id IS NULL AND created_at < ?"
+    STATS = '''
+        SELECT COALESCE(SUM(status = 'pending'), 0),
+               MIN(CASE WHEN status = 'pending' THEN created_at END),
+               COALESCE(SUM(status = 'held'), 0),
+               COALESCE(SUM(status = 'failed'), 0)
+        FROM outbox
+    '''
+
+    @staticmethod
+    def row(notification, now=None, job_id=None):
+        """Параметры ENQUEUE для уведомления; сводка откладывается на DIGEST_WINDOW"""
+        now = now or time.time()
+        return (
+            notification.chat_id, notification.template,
+            json.dumps(notification.params, ensure_ascii=False, default=str),
+            notification.parse_mode, notification.digest,
+            now, now + DIGEST_WINDOW if notification.digest else now, job_id
+        )
+
+    @classmethod
+    def enqueue(cls, cursor, notifications, job=None):
+        """Добавление уведомлений в транзакции cursor.
+
+        job - пара (game_id, kind): уведомления становятся заданием, прогресс
+        которого можно запросить через progress.
+        """
+        now = time.time()
+        job_id = None
+        if job is not None:
+            notifications = list(notifications)
+            cursor.execute(cls.START_JOB, (*job, len(notifications)))
+            job_id = cursor.lastrowid
+        cursor.executemany(cls.ENQUEUE, (cls.row(notification, now, job_id) for notification in notifications))
+
+    @classmethod
+    def cancel_jobs(cls, cursor, game_id, kind):
+        """Отмена заданий игры вместе с неотправленными уведомлениями"""
+        cursor.execute(cls.CANCEL_JOBS, (game_id, kind))
+        cursor.execute(cls.DELETE_JOBS, (game_id, kind))
+
+    async def add(self, notifications):
+        await self.db.run_transaction(self.enqueue, notifications)
+
+    async def due(self, limit=100):
+        """Уведомления, время попытки которых наступило"""
+        rows = await self.db.afetchall(self.DUE, (time.time(), limit))
+        return [OutboxMessage(row[0], row[1], row[2], json.loads(row[3]), *row[4:]) for row in rows]
+
+    async def pending_digests(self, digests):
+        """Ожидающие уведомления с ключами сводок digests"""
+        rows = await self.db.afetchall(self.PENDING_DIGESTS, (json.dumps(list(digests)),))
+        return [OutboxMessage(row[0], row[1], row[2], json.loads(row[3]), *row[4:]) for row in rows]
+
+    async def next_attempt(self):
+        """Время ближайшей попытки доставки или None, если очередь пуста"""
+        return (await self.db.afetchone(self.NEXT_ATTEMPT))[0]
+
+    async def delivered(self, message_ids):
+        await self.writer.write(self.DELIVERED, (json.dumps(list(message_ids)),))
+
+    async def retry(self, message_id, attempts, next_attempt_at, failed=False):
+        await self.writer.write(
+            self.RETRY, (attempts, next_attempt_at, 'failed' if failed else 'pending', message_id)
+        )
+
+    async def hold(self, message_ids):
+        await self.writer.write(self.HOLD, (json.dumps(list(message_ids)),))
+
+    async def purge_failed(self, before):
+        """Удаление недоставленных уведомлений вне заданий, созданных раньше before, возвращает их число"""
+        return await self.db.aexecute(self.PURGE_FAILED, (before,))
+
+    async def stats(self):
+        pending, oldest, held, failed = await self.db.afetchone(self.STATS)
+        return OutboxStats(pending, time.time() - oldest if oldest else 0.0, held, failed)
+
+    async def progress(self, game_id, kind):
+        """Прогресс последнего задания kind игры или None"""
+        return await self._one(DeliveryProgress, self.PROGRESS, (game_id, kind))
+
+class ReachabilityRepository(Repository):
+    """Пользователи, заблокировавшие бота или удалившие аккаунт.
+
+    Рассылки пропускают их, не тратя запрос к Telegram на заведомый отказ
+    Forbidden, а уведомления из outbox откладываются до возвращения пользователя.
+    """
+    MARK = '''
+        INSERT INTO unreachable_users (user_id, reason) VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            reason = excluded.reason,
+            failures = failures + 1,
+            last_failure_at = CURRENT_TIMESTAMP
+    '''
+    CLEAR = 'DELETE FROM unreachable_users WHERE user_id = ?'
+    AMONG = 'SELECT user_id FROM unreachable_users WHERE user_id IN (SELECT value FROM json_each(?))'
+    FOR_GAME = '''
+        SELECT u.user_id, u.first_name, u.username, r.reason, r.failures, r.since
+        FROM game_participants gp
+        JOIN unreachable_users r ON gp.user_id = r.user_id
+        JOIN users u ON gp.user_id = u.user_id
+        WHERE gp.game_id = ?
+        ORDER BY u.first_name
+    '''
+
+    async def mark_unreachable(self, user_id, reason):
+        await self.writer.write(self.MARK, (user_id, reason))
+
+    async def mark_reachable(self, user_id):
+        """Пользователь снова доступен: отложенные уведомления возвращаются в очередь"""
+        await self.writer.write(self.CLEAR, (user_id,), (OutboxRepository.RELEASE, (time.time(), user_id)))
+
+    async def among(self, user_ids):
+        """Недоступные из user_ids одним запросом"""
+        user_ids = list(set(user_ids))
+        if not user_ids:
+            return set()
+        rows = await self.db.afetchall(self.AMONG, (json.dumps(user_ids),))
+        return {row[0] for row in rows}
+
+    async def for_game(self, game_id):
+        return await self._all(UnreachableUser, self.FOR_GAME, (game_id,))
+
+class ExclusionRepository(Repository):
+    """Пары участников, которые не должны дарить друг другу"""
+    ADD = '''
+        INSERT INTO draw_exclusions (game_id, user_id, excluded_id)
+        VALUES (?, ?, ?), (?, ?, ?)
+        ON CONFLICT DO NOTHING
+    '''
+    FOR_GAME = 'SELECT user_id, excluded_id FROM draw_exclusions WHERE game_id = ?'
+
+    async def add(self, game_id, first_id, second_id):
+        """Запрет дарить друг другу в обе стороны"""
+        await self.writer.write(self.ADD, (game_id, first_id, second_id, game_id, second_id, first_id))
+
+    async def for_game(self, game_id):
+        return await self._all(Exclusion, self.FOR_GAME, (game_id,))
+
+def season_of(event_date):
+    """Сезон игры - год даты обмена"""
+    return int(event_date[:4]) if event_date else datetime.now().year
+
+def group_name(name):
+    """Ключ группы игр в истории пар: название без учета регистра на любом языке"""
+    return name.casefold()
+
+class HistoryRepository(Repository):
+    """Пары прошлых жеребьевок для игр одного организатора с одним названием"""
+    # Диапазон по префиксу первичного ключа (admin_id, game_name)
+    RECENT = '''
+        SELECT DISTINCT giver_id, receiver_id FROM pairing_history
+        WHERE admin_id = ? AND game_name = ? AND season >= ? AND game_id != ?
+    '''
+
+    async def recent(self, game, seasons):
+        """Пары группы игры game за последние seasons сезонов, кроме самой игры"""
+        since = season_of(game.event_date) - seasons
+        return await self._all(Pairing, self.RECENT, (game.admin_id, group_name(game.name), since, game.game_id))
+
+def write_archive(directory, bundles):
+    """Выгрузка игр со всеми зависимыми строками в сжатый файл JSON Lines.
+
+    Файл записывается и сбрасывается на диск до удаления строк из базы:
+    при сбое удаления игры просто попадут в следующий архив повторно.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"games-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.jsonl.gz")
+    with gzip.open(path, 'wt', encoding='utf-8') as archive:
+        for bundle in bundles:
+            archive.write(json.dumps(bundle, ensure_ascii=False, default=str) + '\n')
+        archive.flush()
+        os.fsync(archive.fileno())
+    return path
+
+class ArchiveRepository(Repository):
+    """Закрытие прошедших игр, выгрузка их в архив и сжатие базы"""
+    FINISH = "UPDATE games SET status = 'finished' WHERE status = 'active' AND event_date < ?"
+    EXPIRED_GAMES = 'SELECT * FROM games WHERE event_date < ?'
+    EXPIRED = 'SELECT * FROM {table} WHERE game_id IN (SELECT game_id FROM games WHERE event_date < ?)'
+    DELETE = 'DELETE FROM {table} WHERE game_id IN (SELECT game_id FROM games WHERE event_date < ?)'
+    DELETE_GAMES = 'DELETE FROM games WHERE event_date < ?'
+    # Недоставленные уведомления заданий рассылки уходят вместе с заданиями своей игры
+    DELETE_JOB_OUTBOX = '''
+        DELETE FROM outbox WHERE job_id IN (
+            SELECT job_id FROM delivery_jobs
+            WHERE game_id IN (SELECT game_id FROM games WHERE event_date < ?)
+        )
+    '''
+
+    async def finish(self, today):
+        """Перевод игр с прошедшей датой обмена в статус 'finished', возвращает их число"""
+        return await self.db.aexecute(self.FINISH, (today,))
+
+    @staticmethod
+    def _rows(cursor):
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def _export(self, cursor, before, directory):
+        # Одним проходом по каждой таблице, а не запросом на каждую игру
+        cursor.execute(self.EXPIRED_GAMES, (before,))
+        bundles = {game['game_id']: {'game': game} for game in self._rows(cursor)}
+        if not bundles:
+            return 0, None
+        for table in ARCHIVED_TABLES:
+            for bundle in bundles.values():
+                bundle[table] = []
+            cursor.execute(self.EXPIRED.format(table=table), (before,))
+            for row in self._rows(cursor):
+                bundles[row['game_id']][table].append(row)
+        path = write_archive(directory, bundles.values())
+        cursor.execute(self.DELETE_JOB_OUTBOX, (before,))
+        for table in ARCHIVED_TABLES:
+            cursor.execute(self.DELETE.format(table=table), (before,))
+        cursor.execute(self.DELETE_GAMES, (before,))
+        return len(bundles), path
+
+    async def export(self, before, directory=ARCHIVE_DIR):
+        """Выгрузка игр с датой обмена раньше before в архив и удаление их из базы.
+
+        Возвращает (число игр, путь к файлу архива или None).
+        """
+        return await self.db.run_transaction(self._export, before, directory)
+
+    def _compact(self):
+        # Выполняется вне транзакции: VACUUM внутри нее невозможен
+        pages = self.db.fetchone('PRAGMA page_count')[0]
+        if self.db.fetchone('PRAGMA auto_vacuum')[0] != 2:
+            # Инкрементальный режим включается только полной пересборкой файла, один раз
+            self.db.fetchall('PRAGMA auto_vacuum = INCREMENTAL')
+            self.db.fetchall('VACUUM')
+        else:
+            self.db.fetchall('PRAGMA incremental_vacuum')
+        # Усекаем WAL, чтобы освобожденное место вернулось файловой системе
+        self.db.fetchall('PRAGMA wal_checkpoint(TRUNCATE)')
+        return pages - self.db.fetchone('PRAGMA page_count')[0]
+
+    async def compact(self):
+        """Возврат свободных страниц файловой системе, возвращает число освобожденных страниц"""
+        return await self.db.run(self._compact)
+
+class Storage:
+    """Точка доступа ко всем репозиториям; от него зависят обработчики и ReminderSystem.
+
+    Реализации предоставляют одинаковые атрибуты users, settings, games,
+    participants, exclusions, history, messages, confirmations, reminders,
+    outbox, reachability и archive с одинаковыми асинхронными методами и
+    записями в ответах.
+    """
+
+    def init(self):
+        """Подготовка хранилища перед запуском бота"""
+
+    async def close(self):
+        """Фиксация незаписанного и освобождение ресурсов"""
+
+class SqliteStorage(Storage):
+    """Репозитории поверх базы SQLite"""
+
+    def __init__(self, database):
+        self.db = database
+        self.writer = GroupCommitWriter(database)
+        self.users = UserRepository(database, self.writer)
+        self.settings = SettingsCache(SettingsRepository(database, self.writer))
+        self.games = GameRepository(database, self.writer)
+        self.participants = ParticipantRepository(database, self.writer)
+        self.exclusions = ExclusionRepository(database, self.writer)
+        self.history = HistoryRepository(database, self.writer)
+        self.messages = MessageRepository(database, self.writer)
+        self.confirmations = ConfirmationRepository(database, self.writer)
+        self.reminders = ReminderRepository(database, self.writer)
+        self.outbox = OutboxRepository(database, self.writer)
+        self.reachability = ReachabilityRepository(database, self.writer)
+        self.archive = ArchiveRepository(database, self.writer)
+
+    def init(self):
+        migrate(self.db)
+
+    async def close(self):
+        # Сначала дописываем очередь группового коммита, затем закрываем соединения
+        await self.writer.close()
+        self.db.close()
+
+# ========== ХРАНИЛИЩЕ В ПАМЯТИ ==========
+
+def _timestamp():
+    """Метка времени в формате CURRENT_TIMESTAMP SQLite"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+class MemoryTables:
+    """Таблицы хранилища в памяти: словари по первичным ключам"""
+
+    def __init__(self):
+        self.users = {}
+        self.settings = {}
+        self.games = {}
+        # game_id -> {user_id: assigned_to}, порядок вступления сохраняется
+        self.participants = {}
+        # game_id -> {(user_id, excluded_id)}
+        self.exclusions = {}
+        # (admin_id, название в нижнем регистре) -> {(giver_id, receiver_id, season, game_id)}
+        self.history = {}
+        self.messages = {}
+        self.confirmations = {}
+        self.reminders = {}
+        # id -> строка outbox
+        self.outbox = {}
+        # user_id -> строка unreachable_users
+        self.unreachable = {}
+        # job_id -> строка delivery_jobs
+        self.jobs = {}
+        self.game_ids = count(1)
+        self.message_ids = count(1)
+        self.outbox_ids = count(1)
+        self.job_ids = count(1)
+
+    def enqueue(self, notifications, job=None):
+        now = time.time()
+        job_id = None
+        if job is not None:
+            notifications = list(notifications)
+            job_id = next(self.job_ids)
+            self.jobs[job_id] = {
+                'game_id': job[0], 'kind': job[1], 'total': len(notifications), 'created_at': _timestamp(),
+            }
+        for notification in notifications:
+            self.outbox[next(self.outbox_ids)] = {
+                'chat_id': notification.chat_id, 'template': notification.template,
+                'params': dict(notification.params), 'parse_mode': notification.parse_mode,
+                'digest': notification.digest, 'status': 'pending', 'attempts': 0, 'created_at': now,
+                'next_attempt_at': now + DIGEST_WINDOW if notification.digest else now, 'job_id': job_id,
+            }
+
+    def cancel_jobs(self, game_id, kind):
+        job_ids = {
+            job_id for job_id, job in self.jobs.items() if job['game_id'] == game_id and job['kind'] == kind
+        }
+        self.outbox = {key: row for key, row in self.outbox.items() if row['job_id'] not in job_ids}
+        for job_id in job_ids:
+            del self.jobs[job_id]
+
+    def settings_of(self, user_id):
+        return self.settings.setdefault(user_id, {'language': DEFAULT_LANGUAGE, 'reminders_enabled': True})
+
+    def summary(self, game, with_admin=True, with_assigned=True):
+        """Игра со счетчиками; поля, которых нет в соответствующем SQL, остаются None"""
+        members = self.participants.get(game.game_id, {})
+        admin = self.users.get(game.admin_id) if with_admin else None
+        return GameSummary(
+            game.game_id, game.name, game.admin_id, game.budget, game.event_date, game.status,
+            admin.first_name if admin else None, len(members),
+            sum(1 for receiver_id in members.values() if receiver_id is not None)
+            if with_assigned else None
+        )
+
+    def santa_of(self, game_id, user_id):
+        for giver_id, receiver_id in self.participants.get(game_id, {}).items():
+            if receiver_id == user_id:
+                return giver_id
+        return None
+
+    def assignment(self, game_id, user_id):
+        receiver_id = self.participants.get(game_id, {}).get(user_id)
+        receiver = self.users.get(receiver_id)
+        if receiver is None:
+            return None
+        return Assignment(game_id, self.games[game_id].name, receiver_id, receiver.first_name)
+
+class MemoryRepository:
+    def __init__(self, tables):
+        self.tables = tables
+
+class MemoryUserRepository(MemoryRepository):
+    async def get(self, user_id):
+        return self.tables.users.get(user_id)
+
+    async def register(self, user_id, username, first_name, wishes):
+        if user_id in self.tables.users:
+            raise ValueError(f"Пользователь {user_id} уже зарегистрирован")
+        self.tables.users[user_id] = User(user_id, username, first_name, wishes)
+        self.tables.settings_of(user_id)
+
+class MemorySettingsRepository(MemoryRepository):
+    async def get(self, user_id):
+        settings = self.tables.settings.get(user_id, {'language': DEFAULT_LANGUAGE, 'reminders_enabled': True})
+        return UserSettings(user_id, settings['language'], settings['reminders_enabled'])
+
+    async def get_many(self, user_ids):
+        return {user_id: await self.get(user_id) for user_id in set(user_ids)}
+
+    async def set_language(self, user_id, language):
+        self.tables.settings_of(user_id)['language'] = language
+
+    async def set_reminders(self, user_id, enabled):
+        self.tables.settings_of(user_id)['reminders_enabled'] = enabled
+
+class MemoryGameRepository(MemoryRepository):
+    async def create(self, name, admin_id, budget, event_date):
+        game_id = next(self.tables.game_ids)
+        self.tables.games[game_id] = Game(game_id, name, admin_id, budget, event_date, 'active')
+        self.tables.participants[game_id] = {admin_id: None}
+        return game_id
+
+    async def get(self, game_id):
+        return self.tables.games.get(game_id)
+
+    async def summary(self, game_id):
+        game = self.tables.games.get(game_id)
+        return self.tables.summary(game) if game else None
+
+    async def available_for(self, user_id):
+        return [
+            self.tables.summary(game, with_assigned=False)
+            for game_id, game in self.tables.games.items()
+            if game.status == 'active'
+            and self.tables.participants.get(game_id)
+            and user_id not in self.tables.participants[game_id]
+        ]
+
+    async def for_user(self, user_id):
+        games = [
+            self.tables.summary(self.tables.games[game_id], with_admin=False)
+            for game_id, members in self.tables.participants.items()
+            if user_id in members
+        ]
+        # Как ORDER BY event_date в SQLite: игры без даты первыми
+        games.sort(key=lambda game: (game.event_date is not None, game.event_date or ''))
+        return games
+
+class MemoryParticipantRepository(MemoryRepository):
+    async def join(self, game_id, user_id, notify=None):
+        members = self.tables.participants.setdefault(game_id, {})
+        if user_id in members:
+            return None
+        members[user_id] = None
+        game = self.tables.games.get(game_id)
+        game_info = self.tables.summary(game) if game else None
+        if game_info is not None and notify is not None:
+            self.tables.enqueue(notify(game_info))
+        return game_info
+
+    async def for_draw(self, game_id):
+        return [
+            DrawParticipant(user_id, user.first_name, user.wishes)
+            for user_id in self.tables.participants.get(game_id, {})
+            if (user := self.tables.users.get(user_id)) is not None
+        ]
+
+    async def assign(self, game_id, pairs, notifications=()):
+        members = self.tables.participants[game_id]
+        for giver_id, receiver_id in pairs:
+            if giver_id in members:
+                members[giver_id] = receiver_id
+        game = self.tables.games[game_id]
+        season = season_of(game.event_date)
+        self.tables.history.setdefault((game.admin_id, group_name(game.name)), set()).update(
+            (giver_id, receiver_id, season, game_id)
+            for giver_id, receiver_id in members.items() if receiver_id is not None
+        )
+        self.tables.enqueue(notifications, job=(game_id, 'draw'))
+
+    async def reset(self, game_id):
+        members = self.tables.participants.get(game_id, {})
+        for user_id in members:
+            members[user_id] = None
+        game = self.tables.games.get(game_id)
+        if game is not None:
+            group = self.tables.history.get((game.admin_id, group_name(game.name)), set())
+            group -= {row for row in group if row[3] == game_id}
+        self.tables.cancel_jobs(game_id, 'draw')
+
+    async def receiver_of(self, game_id, user_id):
+        return self.tables.participants.get(game_id, {}).get(user_id)
+
+    async def santa_of(self, game_id, user_id):
+        return self.tables.santa_of(game_id, user_id)
+
+    async def member_game(self, game_id, user_id):
+        if user_id in self.tables.participants.get(game_id, {}):
+            return self.tables.games.get(game_id)
+        return None
+
+    async def find(self, game_id, handle):
+        username = handle.lstrip('@').lower()
+        for user_id in self.tables.participants.get(game_id, {}):
+            user = self.tables.users.get(user_id)
+            if str(user_id) == username or (user and user.username and user.username.lower() == username):
+                return user_id
+        return None
+
+    async def assignments_of(self, user_id):
+        assignments = (
+            self.tables.assignment(game_id, user_id)
+            for game_id, members in self.tables.participants.items()
+            if user_id in members
+        )
+        return [assignment for assignment in assignments if assignment is not None]
+
+    async def assignment(self, game_id, user_id):
+        return self.tables.assignment(game_id, user_id)
+
+class MemoryExclusionRepository(MemoryRepository):
+    async def add(self, game_id, first_id, second_id):
+        self.tables.exclusions.setdefault(game_id, set()).update(((first_id, second_id), (second_id, first_id)))
+
+    async def for_game(self, game_id):
+        return [Exclusion(*pair) for pair in self.tables.exclusions.get(game_id, ())]
+
+class MemoryHistoryRepository(MemoryRepository):
+    async def recent(self, game, seasons):
+        since = season_of(game.event_date) - seasons
+        return [
+            Pairing(giver_id, receiver_id)
+            for giver_id, receiver_id in {
+                (giver_id, receiver_id)
+                for giver_id, receiver_id, season, game_id in self.tables.history.get((game.admin_id, group_name(game.name)), ())
+                if season >= since and game_id != game.game_id
+            }
+        ]
+
+class MemoryMessageRepository(MemoryRepository):
+    async def add(self, game_id, from_user_id, to_user_id, text, notifications=()):
+        message_id = next(self.tables.message_ids)
+        self.tables.messages[message_id] = {
+            'game_id': game_id, 'from_user_id': from_user_id, 'to_user_id': to_user_id,
+            'message': text, 'sent_at': _timestamp(), 'is_read': False,
+        }
+        self.tables.enqueue(notifications)
+
+    async def unread_for(self, user_id):
+        return [
+            AnonymousMessage(message_id, row['message'], row['sent_at'], self.tables.games[row['game_id']].name)
+            for message_id, row in reversed(self.tables.messages.items())
+            if row['to_user_id'] == user_id and not row['is_read']
+        ]
+
+    async def mark_read(self, user_id, up_to_id):
+        for message_id, row in self.tables.messages.items():
+            if row['to_user_id'] == user_id and message_id <= up_to_id:
+                row['is_read'] = True
+
+class MemoryConfirmationRepository(MemoryRepository):
+    def _row(self, game_id, user_id):
+        return self.tables.confirmations.setdefault((game_id, user_id), {
+            'gift_sent': False, 'gift_received': False, 'sent_at': None,
+            'received_at': None, 'rating': None, 'feedback': None,
+        })
+
+    async def mark_sent(self, game_id, user_id, notifications=()):
+        self._row(game_id, user_id).update(gift_sent=True, sent_at=_timestamp())
+        self.tables.enqueue(notifications)
+
+    async def mark_received(self, game_id, user_id):
+        self._row(game_id, user_id).update(gift_received=True, received_at=_timestamp())
+
+    async def rate(self, game_id, user_id, rating, feedback=None, notify=None):
+        row = self.tables.confirmations.get((game_id, user_id))
+        if row is not None:
+            row['rating'] = rating
+            if feedback is not None:
+                row['feedback'] = feedback
+        # Находим дарителя для уведомления
+        donor_id = self.tables.santa_of(game_id, user_id)
+        if donor_id is None:
+            return None
+        donor_info = DonorInfo(donor_id, self.tables.games[game_id].name)
+        if notify is not None:
+            self.tables.enqueue(notify(donor_info))
+        return donor_info
+
+    async def statuses(self, game_id):
+        statuses = []
+        for user_id in self.tables.participants.get(game_id, {}):
+            user = self.tables.users.get(user_id)
+            if user is None:
+                continue
+            row = self.tables.confirmations.get((game_id, user_id), {})
+            statuses.append(GiftStatus(
+                user.first_name, row.get('gift_sent', False), row.get('gift_received', False)
+            ))
+        return statuses
+
+class MemoryReminderRepository(MemoryRepository):
+    async def due(self, event_date, reminder_type):
+        reminded = {game_id for game_id, _, kind in self.tables.reminders if kind == reminder_type}
+        return [
+            DueReminder(game_id, game.name, game.event_date, user_id)
+            for game_id, game in self.tables.games.items()
+            if game.event_date == event_date and game_id not in reminded
+            for user_id in self.tables.participants.get(game_id, {})
+            if user_id in self.tables.users
+        ]
+
+    async def record(self, game_id, user_id, reminder_type):
+        self.tables.reminders[(game_id, user_id, reminder_type)] = {
+            'scheduled_time': datetime.now().isoformat(), 'sent': False,
+        }
+
+    async def mark_sent(self, game_id, user_id, reminder_type):
+        row = self.tables.reminders.get((game_id, user_id, reminder_type))
+        if row is not None:
+            row['sent'] = True
+
+class MemoryOutboxRepository(MemoryRepository):
+    async def add(self, notifications):
+        self.tables.enqueue(notifications)
+
+    async def due(self, limit=100):
+        now = time.time()
+        rows = sorted(
+            (row['next_attempt_at'], message_id) for message_id, row in self.tables.outbox.items()
+            if row['status'] == 'pending' and row['next_attempt_at'] <= now
+        )[:limit]
+        return [self._message(message_id) for _, message_id in rows]
+
+    async def pending_digests(self, digests):
+        digests = set(digests)
+        return [
+            self._message(message_id) for message_id, row in self.tables.outbox.items()
+            if row['status'] == 'pending' and row['digest'] in digests
+        ]
+
+    def _message(self, message_id):
+        row = self.tables.outbox[message_id]
+        return OutboxMessage(message_id, *(row[name] for name in OutboxMessage._fields[1:]))
+
+    async def next_attempt(self):
+        return min(
+            (row['next_attempt_at'] for row in self.tables.outbox.values() if row['status'] == 'pending'),
+            default=None
+        )
+
+    async def delivered(self, message_ids):
+        for message_id in message_ids:
+            self.tables.outbox.pop(message_id, None)
+
+    async def retry(self, message_id, attempts, next_attempt_at, failed=False):
+        self.tables.outbox[message_id].update(
+            attempts=attempts, next_attempt_at=next_attempt_at, status='failed' if failed else 'pending'
+        )
+
+    async def hold(self, message_ids):
+        for message_id in message_ids:
+            self.tables.outbox[message_id]['status'] = 'held'
+
+    async def purge_failed(self, before):
+        expired = [
+            message_id for message_id, row in self.tables.outbox.items()
+            if row['status'] == 'failed' and row['job_id'] is None and row['created_at'] < before
+        ]
+        for message_id in expired:
+            del self.tables.outbox[message_id]
+        return len(expired)
+
+    async def stats(self):
+        pending = [row['created_at'] for row in self.tables.outbox.values() if row['status'] == 'pending']
+        held = sum(1 for row in self.tables.outbox.values() if row['status'] == 'held')
+        failed = sum(1 for row in self.tables.outbox.values() if row['status'] == 'failed')
+        return OutboxStats(len(pending), time.time() - min(pending) if pending else 0.0, held, failed)
+
+    async def progress(self, game_id, kind):
+        job_ids = [
+            job_id for job_id, job in self.tables.jobs.items() if job['game_id'] == game_id and job['kind'] == kind
+        ]
+        if not job_ids:
+            return None
+        job_id = max(job_ids)
+        statuses = [row['status'] for row in self.tables.outbox.values() if row['job_id'] == job_id]
+        job = self.tables.jobs[job_id]
+        return DeliveryProgress(
+            job['total'], job['created_at'],
+            statuses.count('pending'), statuses.count('held'), statuses.count('failed')
+        )
+
+class MemoryReachabilityRepository(MemoryRepository):
+    async def mark_unreachable(self, user_id, reason):
+        row = self.tables.unreachable.get(user_id)
+        if row is None:
+            self.tables.unreachable[user_id] = {
+                'reason': reason, 'failures': 1, 'since': _timestamp(), 'last_failure_at': _timestamp(),
+            }
+        else:
+            row.update(reason=reason, failures=row['failures'] + 1, last_failure_at=_timestamp())
+
+    async def mark_reachable(self, user_id):
+        self.tables.unreachable.pop(user_id, None)
+        now = time.time()
+        for row in self.tables.outbox.values():
+            if row['chat_id'] == user_id and row['status'] == 'held':
+                row.update(status='pending', next_attempt_at=now)
+
+    async def among(self, user_ids):
+        return {user_id for user_id in user_ids if user_id in self.tables.unreachable}
+
+    async def for_game(self, game_id):
+        result = []
+        for user_id in self.tables.participants.get(game_id, {}):
+            row = self.tables.unreachable.get(user_id)
+            user = self.tables.users.get(user_id)
+            if row is not None and user is not None:
+                result.append(UnreachableUser(
+                    user_id, user.first_name, user.username, row['reason'], row['failures'], row['since']
+                ))
+        return sorted(result, key=lambda unreachable: unreachable.first_name)
+
+class MemoryArchiveRepository(MemoryRepository):
+    async def finish(self, today):
+        finished = 0
+        for game in self.tables.games.values():
+            if game.status == 'active' and game.event_date is not None and game.event_date < today:
+                game.status = 'finished'
+                finished += 1
+        return finished
+
+    async def export(self, before, directory=ARCHIVE_DIR):
+        tables = self.tables
+        expired = [
+            game_id for game_id, game in tables.games.items()
+            if game.event_date is not None and game.event_date < before
+        ]
+        if not expired:
+            return 0, None
+        bundles = []
+        for game_id in expired:
+            game = tables.games[game_id]
+            bundles.append({
+                'game': dict(zip(game._fields, (getattr(game, name) for name in game._fields))),
+                'game_participants': [
+                    {'game_id': game_id, 'user_id': user_id, 'assigned_to': receiver_id}
+                    for user_id, receiver_id in tables.participants.get(game_id, {}).items()
+                ],
+                'anonymous_messages': [
+                    dict(row, id=message_id) for message_id, row in tables.messages.items()
+                    if row['game_id'] == game_id
+                ],
+                'gift_confirmations': [
+                    dict(row, game_id=key[0], user_id=key[1]) for key, row in tables.confirmations.items()
+                    if key[0] == game_id
+                ],
+                'reminders': [
+                    dict(row, game_id=key[0], user_id=key[1], reminder_type=key[2])
+                    for key, row in tables.reminders.items() if key[0] == game_id
+                ],
+                'draw_exclusions': [
+                    {'game_id': game_id, 'user_id': user_id, 'excluded_id': excluded_id}
+                    for user_id, excluded_id in tables.exclusions.get(game_id, ())
+                ],
+                'delivery_jobs': [
+                    dict(row, job_id=job_id) for job_id, row in tables.jobs.items() if row['game_id'] == game_id
+                ],
+            })
+        path = write_archive(directory, bundles)
+        expired = set(expired)
+        for game_id in expired:
+            del tables.games[game_id]
+            tables.participants.pop(game_id, None)
+            tables.exclusions.pop(game_id, None)
+        tables.messages = {key: row for key, row in tables.messages.items() if row['game_id'] not in expired}
+        tables.confirmations = {key: row for key, row in tables.confirmations.items() if key[0] not in expired}
+        tables.reminders = {key: row for key, row in tables.reminders.items() if key[0] not in expired}
+        expired_jobs = {job_id for job_id, row in tables.jobs.items() if row['game_id'] in expired}
+        tables.outbox = {key: row for key, row in tables.outbox.items() if row['job_id'] not in expired_jobs}
+        tables.jobs = {key: row for key, row in tables.jobs.items() if key not in expired_jobs}
+        return len(bundles), path
+
+    async def compact(self):
+        # Освобожденная память возвращается сборщиком мусора
+        return 0
+
+class MemoryStorage(Storage):
+    """Хранилище в памяти процесса без дискового ввода-вывода.
+
+    Для бенчмарков и тестовых прогонов всего сценария бота: данные живут
+    до остановки процесса, а разница с SqliteStorage показывает, какая
+    часть задержки обработчиков приходится на хранилище.
+    """
+
+    def __init__(self):
+        self.tables = MemoryTables()
+        self.users = MemoryUserRepository(self.tables)
+        self.settings = MemorySettingsRepository(self.tables)
+        self.games = MemoryGameRepository(self.tables)
+        self.participants = MemoryParticipantRepository(self.tables)
+        self.exclusions = MemoryExclusionRepository(self.tables)
+        self.history = MemoryHistoryRepository(self.tables)
+        self.messages = MemoryMessageRepository(self.tables)
+        self.confirmations = MemoryConfirmationRepository(self.tables)
+        self.reminders = MemoryReminderRepository(self.tables)
+        self.outbox = MemoryOutboxRepository(self.tables)
+        self.reachability = MemoryReachabilityRepository(self.tables)
+        self.archive = MemoryArchiveRepository(self.tables)
+
+# Реализации хранилища по имени для SECRET_SANTA_STORAGE
+STORAGE_BACKENDS = {
+    'sqlite': lambda: SqliteStorage(db),
+    'memory': MemoryStorage,
+}
+
+def create_storage(backend=STORAGE_BACKEND):
+    """Хранилище по имени реализации"""
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Неизвестное хранилище: {backend}")
+    return STORAGE_BACKENDS[backend]()
+
+storage = create_storage()
+
+# ========== КОНТЕКСТ ОБНОВЛЕНИЯ ==========
+
+class UserProfile:
+    """Автор обновления: строка users (None до регистрации) и его настройки"""
+    __slots__ = ('user', 'settings')
+
+    def __init__(self, user, settings):
+        self.user = user
+        self.settings = settings
+
+    @property
+    def language(self):
+        return self.settings.language
+
+class SantaContext(CallbackContext):
+    """Контекст обработчиков с профилем автора обновления.
+
+    Профиль загружает load_profile в группе -1 до всех обработчиков; контекст
+    один на обновление, поэтому обработчики берут пользователя и язык отсюда,
+    а не запрашивают их заново.
+    """
+
+    def __init__(self, application, chat_id=None, user_id=None):
+        super().__init__(application, chat_id, user_id)
+        self.profile = None
+
+async def load_profile(update: Update, context: SantaContext):
+    """Загрузка пользователя и настроек один раз на обновление.
+
+    Любое сообщение или нажатие кнопки снимает отметку недоступности: пользователь
+    снова пишет боту, и отложенные для него уведомления возвращаются в очередь.
+    Изменения статуса бота (my_chat_member) разбирает track_bot_status.
+    """
+    user = update.effective_user
+    if user is None:
+        return
+    user_data, settings, unreachable = await asyncio.gather(
+        storage.users.get(user.id), storage.settings.get(user.id), storage.reachability.among([user.id])
+    )
+    context.profile = UserProfile(user_data, settings)
+    if unreachable and update.my_chat_member is None:
+        await storage.reachability.mark_reachable(user.id)
+        outbox.wake()
+
+def parse_game_id(text):
+    """ID игры из аргумента команды; None, если это не число (игра не будет найдена)"""
+    try:
+        return int(text)
+    except ValueError:
+        return None
+
+async def archive_finished_games(storage, today=None):
+    """Закрытие прошедших игр, выгрузка старых в архив, очистка outbox и сжатие базы"""
+    today = today or datetime.now().date()
+    try:
+        finished = await storage.archive.finish(today.isoformat())
+        before = (today - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+        archived, path = await storage.archive.export(before)
+        purged = await storage.outbox.purge_failed(time.time() - OUTBOX_RETENTION_DAYS * 86400)
+        freed = await storage.archive.compact() if archived or purged else 0
+        logger.info(
+            f"Архивация: завершено игр {finished}, в архив {archived} ({path}), "
+            f"удалено недоставленных уведомлений {purged}, освобождено страниц {freed}"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка архивации игр: {e}")
 
-def get_user_language(user_id):
-    """Получение языка пользователя"""
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT language FROM user_settings WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    
-    return result[0] if result else 'ru'
+# ========== РАССЫЛКА ==========
 
-def get_localized_text(user_id, text_key, *format_args):
-    """Получение локализованного текста"""
-    language = get_user_language(user_id)
-    text = LOCALES[language].get(text_key, text_key)
-    
-    if format_args:
-        return text.format(*format_args)
-    return text
+class TokenBucket:
+    """Ведро токенов: в среднем не больше rate событий в секунду, всплеск до capacity.
+
+    Пауза - общий срок paused_until: одновременные RetryAfter не складываются,
+    а acquire проверяет его после каждого ожидания, поэтому во время паузы
+    токен не выдается никому. Все вызовы идут из одного цикла событий.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Никто не получит токен раньше чем через seconds секунд"""
+        until = time.monotonic() + seconds
+        if until > self.paused_until:
+            self.paused_until = until
+            # За время паузы токены не копятся: после нее рассылка разгоняется с нуля
+            self.tokens = 0
+            self.updated = until
+
+class Broadcaster:
+    """Отправка сообщений в пределах лимитов Telegram.
+
+    Общее ведро токенов держит около 30 сообщений в секунду на бота, в один
+    чат уходит не больше сообщения в секунду, одновременных запросов не больше
+    concurrency. RetryAfter приостанавливает всю рассылку на указанное время,
+    после чего сообщение отправляется повторно. Forbidden (бот заблокирован,
+    аккаунт удален) записывается в reachability, чтобы рассылки пропускали чат.
+    BadRequest (например, неразбираемая разметка) повтором не лечится, send
+    возвращает для него None вместо False.
+    """
+    # Telegram не рекомендует чаще одного сообщения в секунду в один чат
+    CHAT_INTERVAL = 1.0
+    MAX_RETRIES = 3
+
+    def __init__(self, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY, reachability=None):
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.reachability = reachability
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # chat_id -> время, раньше которого в чат писать нельзя
+        self._chat_ready = {}
+        self.sent = 0
+        self.failed = 0
+
+    async def _wait_chat(self, chat_id):
+        now = time.monotonic()
+        if len(self._chat_ready) > 10000:
+            self._chat_ready = {chat: ready for chat, ready in self._chat_ready.items() if ready > now}
+        ready = max(now, self._chat_ready.get(chat_id, 0))
+        self._chat_ready[chat_id] = ready + self.CHAT_INTERVAL
+        if ready > now:
+            await asyncio.sleep(ready - now)
+
+    async def send(self, bot, chat_id, text, **kwargs):
+        """Отправка одного сообщения; False, если доставить не удалось, None - Telegram отклонил его"""
+        for _ in range(self.MAX_RETRIES + 1):
+            await self._wait_chat(chat_id)
+            async with self._semaphore:
+                # Токен берется последним перед запросом: ожидание семафора не обходит паузу
+                await self.bucket.acquire()
+                try:
+                    await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                    self.sent += 1
+                    return True
+                except RetryAfter as e:
+                    delay = e.retry_after
+                    if isinstance(delay, timedelta):
+                        delay = delay.total_seconds()
+                    logger.warning(f"Лимит Telegram: пауза рассылки на {delay} с")
+                    self.bucket.pause(delay)
+                except Forbidden as e:
+                    logger.info(f"Пользователь {chat_id} недоступен: {e}")
+                    if self.reachability is not None:
+                        await self.reachability.mark_unreachable(chat_id, e.message)
+                    break
+                except BadRequest as e:
+                    logger.error(f"Telegram отклонил сообщение пользователю {chat_id}: {e}")
+                    self.failed += 1
+                    return None
+                except Exception as e:
+                    logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+                    break
+        self.failed += 1
+        return False
+
+broadcaster = Broadcaster(reachability=storage.reachability)
+
+class OutboxDispatcher:
+    """Фоновая доставка уведомлений из outbox.
+
+    Обработчики только ставят уведомления в очередь вместе с изменением
+    состояния, а диспетчер отправляет их через broadcaster. Неудачные попытки
+    повторяются с экспоненциальной паузой, после max_attempts строка помечается
+    'failed'. Уведомления с ключом digest одному получателю объединяются в одну
+    сводку по шаблонам DIGESTS. Уведомления недоступным пользователям не
+    отправляются и получают статус 'held' до их возвращения. Незавершенные
+    строки переживают перезапуск и отправляются при следующем старте; доставка -
+    не менее одного раза.
+    """
+    BATCH_SIZE = 100
+    BASE_BACKOFF = 5.0
+    # Шаблон уведомления -> (шаблон сводки, шаблон строки сводки)
+    DIGESTS = {
+        'join_admin_notice': ('join_admin_digest', 'join_admin_digest_item'),
+    }
+    # Сколько событий перечисляется в сводке, остальные - числом
+    DIGEST_ITEMS = 20
+    # Период записи в лог глубины очереди, с
+    STATS_INTERVAL = 300.0
+
+    def __init__(self, storage, max_attempts=OUTBOX_MAX_ATTEMPTS, max_backoff=OUTBOX_MAX_BACKOFF):
+        self.storage = storage
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.bot = None
+        self._task = None
+        self._wakeup = None
+
+    def start(self, bot):
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def wake(self):
+        """Сигнал о новых уведомлениях: доставка начинается без ожидания таймера"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_stats = loop.time()
+        while True:
+            self._wakeup.clear()
+            try:
+                processed = await self.dispatch()
+                if loop.time() >= next_stats:
+                    await self.log_stats()
+                    next_stats = loop.time() + self.STATS_INTERVAL
+                if processed == self.BATCH_SIZE:
+                    continue
+                next_attempt = await self.storage.outbox.next_attempt()
+                timeout = self.STATS_INTERVAL if next_attempt is None else next_attempt - time.time()
+                timeout = max(0.0, min(timeout, next_stats - loop.time()))
+            except Exception as e:
+                logger.error(f"Ошибка доставки уведомлений: {e}")
+                timeout = self.BASE_BACKOFF
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def dispatch(self):
+        """Одна порция доставки, возвращает число обработанных уведомлений"""
+        messages = await self.storage.outbox.due(self.BATCH_SIZE)
+        if not messages:
+            return 0
+        groups = await self._group(messages)
+        unreachable = await self.storage.reachability.among(chat_id for chat_id, _ in groups)
+        sendable = [(chat_id, group) for chat_id, group in groups if chat_id not in unreachable]
+        # Текст рендерится сейчас, на языке, который получатель выбрал к моменту доставки
+        settings = await self.storage.settings.get_many(chat_id for chat_id, _ in sendable)
+        results = await asyncio.gather(*(
+            self._deliver(group, settings[chat_id].language) for chat_id, group in sendable
+        ), return_exceptions=True)
+        # Ошибка одной отправки не должна терять результаты остальных: уже отправленное
+        # иначе не попадет в delivered и уйдет повторно
+        for index, ((chat_id, _), result) in enumerate(zip(sendable, results)):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка доставки уведомления пользователю {chat_id}: {result}")
+                results[index] = False
+
+        delivered = [message.id for (_, group), ok in zip(sendable, results) if ok for message in group]
+        if delivered:
+            await self.storage.outbox.delivered(delivered)
+        failures = [message for (_, group), ok in zip(sendable, results) if not ok for message in group]
+        # Отклоненные Telegram сообщения не повторяются
+        rejected = {message.id for (_, group), ok in zip(sendable, results) if ok is None for message in group}
+        if failures:
+            # Получатели, на которых отправка только что упала с Forbidden
+            unreachable |= await self.storage.reachability.among(message.chat_id for message in failures)
+        held = [message.id for chat_id, group in groups if chat_id in unreachable for message in group]
+        if held:
+            await self.storage.outbox.hold(held)
+        for message in failures:
+            if message.chat_id in unreachable:
+                continue
+            attempts = message.attempts + 1
+            failed = attempts >= self.max_attempts or message.id in rejected
+            delay = min(self.BASE_BACKOFF * 2 ** message.attempts, self.max_backoff)
+            await self.storage.outbox.retry(message.id, attempts, time.time() + delay, failed)
+            if failed:
+                logger.error(
+                    f"Уведомление {message.id} ({message.template}) для {message.chat_id} "
+                    f"не доставлено после {attempts} попыток"
+                )
+        return len(messages)
+
+    async def _group(self, messages):
+        """Пары (chat_id, уведомления одного сообщения): сводка забирает все накопленные строки своего ключа"""
+        groups = {}
+        digests = {message.digest for message in messages if message.digest}
+        if digests:
+            messages = [message for message in messages if not message.digest]
+            messages += await self.storage.outbox.pending_digests(digests)
+        for message in messages:
+            key = (message.chat_id, message.digest) if message.digest else message.id
+            groups.setdefault(key, (message.chat_id, []))[1].append(message)
+        return list(groups.values())
+
+    def _render(self, group, language):
+        first = group[0]
+        if len(group) == 1 or first.template not in self.DIGESTS:
+            return catalog.render(language, first.template, **first.params)
+        digest_template, item_template = self.DIGESTS[first.template]
+        items = [catalog.render(language, item_template, **message.params) for message in group[:self.DIGEST_ITEMS]]
+        if len(group) > self.DIGEST_ITEMS:
+            items.append(catalog.render(language, 'digest_more', count=len(group) - self.DIGEST_ITEMS))
+        return catalog.render(language, digest_template, **{**first.params, 'count': len(group), 'items': '\n'.join(items)})
+
+    async def _deliver(self, group, language):
+        first = group[0]
+        try:
+            text = self._render(group, language)
+        except Exception as e:
+            logger.error(f"Не удалось подготовить уведомление {first.id}: {e}")
+            return False
+        kwargs = {'parse_mode': first.parse_mode} if first.parse_mode else {}
+        return await broadcaster.send(self.bot, first.chat_id, text, **kwargs)
+
+    async def log_stats(self):
+        stats = await self.storage.outbox.stats()
+        if stats.pending or stats.held or stats.failed:
+            logger.info(
+                f"Очередь уведомлений: в ожидании {stats.pending}, старейшему {stats.oldest_age:.0f} с, "
+                f"отложено для недоступных {stats.held}, недоставлено {stats.failed}"
+            )
+        return stats
+
+    async def stop(self):
+        """Остановка диспетчера; неотправленное останется в outbox до следующего запуска"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.log_stats()
+
+outbox = OutboxDispatcher(storage)
 
 class ReminderSystem:
-    def __init__(self, application):
+    def __init__(self, application, storage):
         self.application = application
+        self.storage = storage
         self.running = True
     
-    def start(self):
+    def start(self, loop):
         """Запуск системы напоминаний в отдельном потоке"""
+        # Цикл событий бота: в нем выполняются отправка и асинхронные запросы
+        self.loop = loop
         thread = Thread(target=self._run_scheduler)
         thread.daemon = True
         thread.start()
@@ -242,1323 +2562,760 @@ class ReminderSystem:
     def _run_scheduler(self):
         """Запуск планировщика"""
         schedule.every(1).minutes.do(self._check_reminders)
+        schedule.every().day.at('04:00').do(self._archive)
         while self.running:
             schedule.run_pending()
             time.sleep(60)
     
     def _check_reminders(self):
         """Проверка и отправка напоминаний"""
-        conn = sqlite3.connect('secret_santa.db')
-        cursor = conn.cursor()
-        
-        # Напоминания за 3 дня до события
-        three_days_before = (datetime.now() + timedelta(days=3)).strftime('%Y-%m-%d')
-        cursor.execute('''
-            SELECT g.game_id, g.name, g.event_date, gp.user_id, u.first_name
-            FROM games g
-            JOIN game_participants gp ON g.game_id = gp.game_id
-            JOIN users u ON gp.user_id = u.user_id
-            LEFT JOIN reminders r ON g.game_id = r.game_id AND r.reminder_type = '3_days_before'
-            WHERE g.event_date = ? AND r.id IS NULL
-        ''', (three_days_before,))
-        
-        games_3_days = cursor.fetchall()
-        
-        for game in games_3_days:
-            game_id, game_name, event_date, user_id, user_name = game
-            self._send_reminder(user_id, game_id, '3_days_before', game_name, event_date)
-            
-            # Сохраняем в базу, что напоминание отправлено
-            cursor.execute('''
-                INSERT INTO reminders (game_id, user_id, reminder_type, scheduled_time)
-                VALUES (?, ?, ?, ?)
-            ''', (game_id, user_id, '3_days_before', datetime.now().isoformat()))
-        
-        # Напоминания за 1 день до события
-        one_day_before = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
-        cursor.execute('''
-            SELECT g.game_id, g.name, g.event_date, gp.user_id, u.first_name
-            FROM games g
-            JOIN game_participants gp ON g.game_id = gp.game_id
-            JOIN users u ON gp.user_id = u.user_id
-            LEFT JOIN reminders r ON g.game_id = r.game_id AND r.reminder_type = '1_day_before'
-            WHERE g.event_date = ? AND r.id IS NULL
-        ''', (one_day_before,))
-        
-        games_1_day = cursor.fetchall()
-        
-        for game in games_1_day:
-            game_id, game_name, event_date, user_id, user_name = game
-            self._send_reminder(user_id, game_id, '1_day_before', game_name, event_date)
-            
-            cursor.execute('''
-                INSERT INTO reminders (game_id, user_id, reminder_type, scheduled_time)
-                VALUES (?, ?, ?, ?)
-            ''', (game_id, user_id, '1_day_before', datetime.now().isoformat()))
-        
-        conn.commit()
-        conn.close()
-    
-    async def _send_reminder_async(self, user_id, game_id, reminder_type, game_name, event_date):
+        # Запросы и запись идут через цикл событий бота и общий писатель
+        self._submit(self._check_reminders_async(), 'проверки напоминаний')
+
+    def _submit(self, coroutine, what):
+        """Запуск задачи в цикле событий бота; ее исключение попадает в лог, а не теряется"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+        def report(future):
+            if not future.cancelled() and future.exception() is not None:
+                logger.error(f"Ошибка {what}: {future.exception()}")
+
+        future.add_done_callback(report)
+        return future
+
+    async def _check_reminders_async(self):
+        """Напоминания за 3 дня и за 1 день до события"""
+        for days, reminder_type in ((3, '3_days_before'), (1, '1_day_before')):
+            event_date = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
+            reminders = await self.storage.reminders.due(event_date, reminder_type)
+            # Язык и согласие на напоминания всех получателей одним запросом
+            settings = await self.storage.settings.get_many(reminder.user_id for reminder in reminders)
+            unreachable = await self.storage.reachability.among(reminder.user_id for reminder in reminders)
+            # Сохраняем в базу, что напоминания поставлены, до отправки: все записи
+            # ставятся в очередь писателя сразу и фиксируются общими коммитами
+            await asyncio.gather(*(
+                self.storage.reminders.record(reminder.game_id, reminder.user_id, reminder_type)
+                for reminder in reminders
+            ))
+            sends = []
+            for reminder in reminders:
+                user_settings = settings[reminder.user_id]
+                # Заблокировавшим бота напоминание все равно не дойти
+                if not user_settings.reminders_enabled or reminder.user_id in unreachable:
+                    continue
+                sends.append(self._send_reminder_async(
+                    reminder.user_id, reminder.game_id, reminder_type,
+                    reminder.game_name, reminder.event_date, user_settings.language
+                ))
+            # Отправляются параллельно, темп задает общий Broadcaster
+            await asyncio.gather(*sends)
+    
+    def _archive(self):
+        """Ночная архивация прошедших игр"""
+        self._submit(archive_finished_games(self.storage), 'ночной архивации')
+
+    async def _send_reminder_async(self, user_id, game_id, reminder_type, game_name, event_date, language):
         """Асинхронная отправка напоминания"""
         try:
-            language = get_user_language(user_id)
-            
-            if reminder_type == '3_days_before':
-                if language == 'ru':
-                    message = (
-                        f"🎅 Напоминание о Тайном Санте!\n\n"
-                        f"Игра: *{game_name}*\n"
-                        f"До обмена подарками осталось *3 дня*! 🎄\n"
-                        f"Дата: {event_date}\n\n"
-                        f"Не забудьте подготовить подарок! 🎁"
-                    )
-                else:
-                    message = (
-                        f"🎅 Secret Santa Reminder!\n\n"
-                        f"Game: *{game_name}*\n"
-                        f"*3 days* left until gift exchange! 🎄\n"
-                        f"Date: {event_date}\n\n"
-                        f"Don't forget to prepare your gift! 🎁"
-                    )
-            else:  # 1_day_before
-                if language == 'ru':
-                    message = (
-                        f"🎅 Срочное напоминание!\n\n"
-                        f"Игра: *{game_name}*\n"
-                        f"Обмен подарками *завтра*! ⏰\n"
-                        f"Дата: {event_date}\n\n"
-                        f"Убедитесь, что подарок готов! 🎁"
-                    )
-                else:
-                    message = (
-                        f"🎅 Urgent Reminder!\n\n"
-                        f"Game: *{game_name}*\n"
-                        f"Gift exchange is *tomorrow*! ⏰\n"
-                        f"Date: {event_date}\n\n"
-                        f"Make sure your gift is ready! 🎁"
-                    )
-            
-            await self.application.bot.send_message(
-                chat_id=user_id,
-                text=message,
-                parse_mode='Markdown'
+            # Ключ шаблона совпадает с типом напоминания
+            message = catalog.render(
+                language, f'reminder_{reminder_type}', game_name=game_name, event_date=event_date
             )
             
-            # Помечаем напоминание как отправленное
-            conn = sqlite3.connect('secret_santa.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE reminders SET sent = TRUE 
-                WHERE game_id = ? AND user_id = ? AND reminder_type = ?
-            ''', (game_id, user_id, reminder_type))
-            conn.commit()
-            conn.close()
+            if await broadcaster.send(self.application.bot, user_id, message, parse_mode='Markdown'):
+                # Помечаем напоминание как отправленное
+                await self.storage.reminders.mark_sent(game_id, user_id, reminder_type)
             
         except Exception as e:
             logger.error(f"Ошибка отправки напоминания пользователю {user_id}: {e}")
-    
-    def _send_reminder(self, user_id, game_id, reminder_type, game_name, event_date):
-        """Синхронная обертка для асинхронной отправки"""
-        asyncio.run_coroutine_threadsafe(
-            self._send_reminder_async(user_id, game_id, reminder_type, game_name, event_date),
-            asyncio.new_event_loop()
-        )
 
-# ========== ОСНОВНЫЕ КОМАНДЫ ==========
+# ========== ДВИЖОК ЖЕРЕБЬЕВКИ ==========
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    language = get_user_language(user.id)
-    
-    if language == 'ru':
-        welcome_text = f"""
-🎅 Привет, {user.first_name}! Добро пожаловать в бота "Тайный Санта"!
+def _derangement_shares(size=32):
+    """Доли (u-1)*D(u-2)/D(u) для u < size, где D(u) - число беспорядков из u элементов.
+
+    Считаются через d(u) = D(u)/u!, которые быстро сходятся к 1/e: доля равна
+    d(u-2) / (u * d(u)), а начиная с size совпадает с 1/u в пределах точности float.
+    """
+    # d(u) = сумма (-1)^k / k! по k <= u; term - последнее слагаемое, для k = 1 это -1
+    d = [1.0, 0.0]
+    term = -1.0
+    for u in range(2, size):
+        term /= -u
+        d.append(d[-1] + term)
+    return [0.0, 0.0] + [d[u - 2] / (u * d[u]) for u in range(2, size)]
 
-✨ Вот что я умею:
-/register - Зарегистрироваться для участия
-/create - Создать новую игру
-/join - Присоединиться к игре
-/my_games - Мои активные игры
-/message - Отправить анонимное сообщение
-/help - Помощь
+class DrawImpossible(ValueError):
+    """Исключения не оставляют ни одного допустимого распределения"""
 
-Давайте устроим волшебство обмена подарками! 🎁
+class DrawEngine:
+    """Жеребьевка: кто кому дарит.
+
+    derangement - равновероятный беспорядок (никто не дарит сам себе, участники
+    могут образовывать несколько кругов) по алгоритму Мартинеса-Панхольцера-Продингера;
+    cycle - равновероятный единый круг, в котором каждый дарит следующему.
+    Оба режима работают за линейное время без повторных попыток и не зависят от Telegram.
+
+    Немного исключений соблюдается перевыбором: распределение, в которое не
+    попала ни одна исключенная пара, равновероятно среди допустимых. Если
+    исключений много или перевыбор не удался, пары исправляются поиском
+    паросочетания со случайным выбором получателей: результат допустим, но
+    уже не строго равновероятен, а единый круг не гарантируется. Нежелательные
+    пары (avoid) соблюдаются, если это возможно вместе с исключениями.
+    """
+    MODES = ('derangement', 'cycle')
+    _SHARES = _derangement_shares()
+    # Ожидаемое число нарушенных исключений в случайном распределении, до которого
+    # перевыбор дешевле исправления (успех примерно с вероятностью e**-limit на попытку)
+    REJECTION_LIMIT = 2.0
+    REJECTION_ATTEMPTS = 30
+
+    def __init__(self, mode=DRAW_MODE, rng=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Неизвестный режим жеребьевки: {mode}")
+        self.mode = mode
+        self.random = rng or random.Random()
+
+    def draw(self, user_ids, exclusions=(), avoid=()):
+        """Список пар (даритель, получатель): каждый участник ровно один раз дарит и получает.
+
+        exclusions - пары (даритель, получатель), которые не должны выпасть;
+        если соблюсти их невозможно, поднимается DrawImpossible. avoid - пары,
+        которых следует избегать: они отбрасываются, если мешают жеребьевке.
         """
-    else:
-        welcome_text = f"""
-🎅 Hello, {user.first_name}! Welcome to Secret Santa bot!
-
-✨ What I can do:
-/register - Register for participation
-/create - Create a new game
-/join - Join a game
-/my_games - My active games
-/message - Send anonymous message
-/help - Help
-
-Let's create some gift exchange magic! 🎁
+        user_ids = list(user_ids)
+        if len(user_ids) < 2:
+            raise ValueError("Для жеребьевки нужно минимум 2 участника")
+        forbidden = defaultdict(set)
+        for giver_id, receiver_id in exclusions:
+            forbidden[giver_id].add(receiver_id)
+        if avoid:
+            preferred = defaultdict(set, {giver_id: set(blocked) for giver_id, blocked in forbidden.items()})
+            for giver_id, receiver_id in avoid:
+                preferred[giver_id].add(receiver_id)
+            try:
+                return self._draw(user_ids, preferred)
+            except DrawImpossible:
+                pass
+        return self._draw(user_ids, forbidden)
+
+    def _draw(self, user_ids, forbidden):
+        """Жеребьевка с исключениями forbidden: {даритель: {получатели}}"""
+        if not forbidden:
+            return self._sample(user_ids)
+        expected = sum(len(blocked) for blocked in forbidden.values()) / (len(user_ids) - 1)
+        if expected <= self.REJECTION_LIMIT:
+            for _ in range(self.REJECTION_ATTEMPTS):
+                pairs = self._sample(user_ids)
+                if not any(receiver_id in forbidden.get(giver_id, ()) for giver_id, receiver_id in pairs):
+                    return pairs
+        pairs = [(giver_id, user_ids[index]) for giver_id, index in zip(user_ids, self._derangement(len(user_ids)))]
+        return self._repair(pairs, forbidden)
+
+    def _sample(self, user_ids):
+        """Равновероятное распределение режима без учета исключений"""
+        if self.mode == 'cycle':
+            order = list(user_ids)
+            self.random.shuffle(order)
+            return list(zip(order, order[1:] + order[:1]))
+        return [(giver_id, user_ids[index]) for giver_id, index in zip(user_ids, self._derangement(len(user_ids)))]
+
+    def _repair(self, pairs, forbidden):
+        """Переназначение пар, попавших в исключения.
+
+        Случайный беспорядок обычно нарушает лишь несколько исключений. Их дарители
+        в случайном порядке освобождаются и получают случайного нового получателя:
+        сначала из освободившихся, иначе по цепочке переназначений (алгоритм Куна с
+        поиском в ширину). Если цепочки для дарителя нет, допустимого распределения
+        не существует (теорема Бержа).
         """
-    
-    await update.message.reply_text(welcome_text)
+        receiver_of = dict(pairs)
+        giver_of = {receiver_id: giver_id for giver_id, receiver_id in pairs}
+        free_givers = [giver_id for giver_id, receiver_id in pairs if receiver_id in forbidden.get(giver_id, ())]
+        self.random.shuffle(free_givers)
+        # Список, а не множество: порядок обхода множества задан хешами и смещал бы выбор
+        free_receivers = []
+        for giver_id in free_givers:
+            free_receivers.append(receiver_of[giver_id])
+            del giver_of[receiver_of[giver_id]]
+            receiver_of[giver_id] = None
+        for giver_id in free_givers:
+            blocked = forbidden.get(giver_id, ())
+            candidates = [
+                index for index, receiver_id in enumerate(free_receivers)
+                if receiver_id != giver_id and receiver_id not in blocked
+            ]
+            if candidates:
+                index = self.random.choice(candidates)
+                receiver_id = free_receivers[index]
+                free_receivers[index] = free_receivers[-1]
+                free_receivers.pop()
+                receiver_of[giver_id] = receiver_id
+                giver_of[receiver_id] = giver_id
+            else:
+                receiver_id = self._augment(giver_id, receiver_of, giver_of, forbidden)
+                if receiver_id is None:
+                    raise DrawImpossible(f"Участнику {giver_id} некому дарить при заданных исключениях")
+                free_receivers.remove(receiver_id)
+        return list(receiver_of.items())
+
+    def _augment(self, start, receiver_of, giver_of, forbidden):
+        """Поиск в ширину цепочки переназначений от дарителя start до свободного получателя.
+
+        Допустимые ребра - все, кроме самоназначений и исключений, поэтому вместо
+        списков смежности перебираются еще не посещенные получатели: каждый
+        посещается один раз, и поиск стоит O(n + число исключений). Порядок
+        раскрытия получателей случайный, чтобы цепочка не зависела от хешей.
+        Возвращает занятого в итоге свободного получателя или None.
+        """
+        unvisited = set(receiver_of)
+        reached_by = {}
+        queue = deque([start])
+        while queue:
+            giver_id = queue.popleft()
+            blocked = forbidden.get(giver_id, ())
+            reachable = [
+                receiver_id for receiver_id in unvisited
+                if receiver_id != giver_id and receiver_id not in blocked
+            ]
+            self.random.shuffle(reachable)
+            for receiver_id in reachable:
+                unvisited.discard(receiver_id)
+                reached_by[receiver_id] = giver_id
+                owner = giver_of.get(receiver_id)
+                if owner is not None:
+                    queue.append(owner)
+                    continue
+                # Сдвигаем назначения вдоль цепочки от свободного получателя к start
+                found = receiver_id
+                while receiver_id is not None:
+                    giver_id = reached_by[receiver_id]
+                    receiver_of[giver_id], receiver_id = receiver_id, receiver_of[giver_id]
+                    giver_of[receiver_of[giver_id]] = giver_id
+                return found
+        return None
+
+    def _derangement(self, n):
+        """Случайный беспорядок индексов 0..n-1: позиция i дарит позиции result[i]"""
+        result = list(range(n))
+        marked = [False] * n
+        shares = self._SHARES
+        # int(random() * i) заметно быстрее randrange при том же распределении для i < 2**53
+        uniform = self.random.random
+        i = n - 1
+        # u - сколько элементов еще не замкнуто в циклы
+        u = n
+        while u >= 2:
+            if not marked[i]:
+                j = int(uniform() * i)
+                while marked[j]:
+                    j = int(uniform() * i)
+                result[i], result[j] = result[j], result[i]
+                # С этой вероятностью j замыкает цикл из двух и выбывает вместе с i
+                if uniform() < (shares[u] if u < len(shares) else 1 / u):
+                    marked[j] = True
+                    u -= 1
+                u -= 1
+            i -= 1
+        return result
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+draw_engine = DrawEngine()
+
+# ========== ОСНОВНЫЕ КОМАНДЫ ==========
+
+async def start(update: Update, context: SantaContext):
     user = update.effective_user
-    help_text = get_localized_text(user.id, 'help')
+    language = context.profile.language
+    
+    await update.message.reply_text(catalog.render(language, 'start', first_name=user.first_name))
+
+async def track_bot_status(update: Update, context: SantaContext):
+    """Блокировка и разблокировка бота пользователем в личном чате"""
+    member = update.my_chat_member
+    if member.chat.type != 'private':
+        return
+    
+    if member.new_chat_member.status == ChatMember.BANNED:
+        await storage.reachability.mark_unreachable(member.from_user.id, 'blocked by user')
+    elif member.new_chat_member.status == ChatMember.MEMBER:
+        await storage.reachability.mark_reachable(member.from_user.id)
+        outbox.wake()
+
+async def help_command(update: Update, context: SantaContext):
+    help_text = catalog.render(context.profile.language, 'help')
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
 # ========== РЕГИСТРАЦИЯ ==========
 
-async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    language = get_user_language(user.id)
+async def register(update: Update, context: SantaContext):
+    language = context.profile.language
     
     # Проверяем, не зарегистрирован ли уже пользователь
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE user_id = ?', (user.id,))
-    existing_user = cursor.fetchone()
-    conn.close()
-    
-    if existing_user:
-        if language == 'ru':
-            await update.message.reply_text("Вы уже зарегистрированы! Можете создать или присоединиться к игре.")
-        else:
-            await update.message.reply_text("You are already registered! You can create or join a game.")
+    if context.profile.user:
+        await update.message.reply_text(catalog.render(language, 'register_already'))
         return ConversationHandler.END
     
-    if language == 'ru':
-        await update.message.reply_text(
-            "Отлично! Давайте зарегистрируем вас для участия в Тайном Санте.\n\n"
-            "Как вас зовут? (Это имя увидят другие участники)"
-        )
-    else:
-        await update.message.reply_text(
-            "Great! Let's register you for Secret Santa.\n\n"
-            "What's your name? (Other participants will see this name)"
-        )
+    await update.message.reply_text(catalog.render(language, 'register_ask_name'))
     return REGISTER_NAME
 
-async def register_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def register_name(update: Update, context: SantaContext):
     context.user_data['register_name'] = update.message.text
-    user = update.effective_user
-    language = get_user_language(user.id)
     
-    if language == 'ru':
-        await update.message.reply_text(
-            "Прекрасно! Теперь расскажите, что бы вы хотели получить в подарок?\n\n"
-            "💡 Напишите ваши пожелания, интересы, размер одежды или что-то еще, "
-            "что поможет вашему Тайному Санте выбрать подарок:"
-        )
-    else:
-        await update.message.reply_text(
-            "Great! Now tell us what you would like to receive as a gift?\n\n"
-            "💡 Write your wishes, interests, clothing size or anything else "
-            "that will help your Secret Santa choose a gift:"
-        )
+    await update.message.reply_text(catalog.render(context.profile.language, 'register_ask_wishes'))
     return REGISTER_WISHES
 
-async def register_wishes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def register_wishes(update: Update, context: SantaContext):
     wishes = update.message.text
     user = update.effective_user
     
     # Сохраняем пользователя в базу данных
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO users (user_id, username, first_name, wishes)
-        VALUES (?, ?, ?, ?)
-    ''', (user.id, user.username, context.user_data['register_name'], wishes))
-    
-    # Создаем настройки по умолчанию
-    cursor.execute('''
-        INSERT OR REPLACE INTO user_settings (user_id)
-        VALUES (?)
-    ''', (user.id,))
-    
-    conn.commit()
-    conn.close()
+    await storage.users.register(user.id, user.username, context.user_data['register_name'], wishes)
+    context.profile.user = User(user.id, user.username, context.user_data['register_name'], wishes)
     
     # Очищаем временные данные
     context.user_data.clear()
     
-    completion_text = get_localized_text(user.id, 'registration_complete')
-    
-    if get_user_language(user.id) == 'ru':
-        completion_text += "\n\nТеперь вы можете:\n• Создать свою игру (/create)\n• Присоединиться к существующей игре (/join)\n• Посмотреть активные игры (/my_games)"
-    else:
-        completion_text += "\n\nNow you can:\n• Create your own game (/create)\n• Join an existing game (/join)\n• View active games (/my_games)"
-    
-    await update.message.reply_text(completion_text)
+    await update.message.reply_text(catalog.render(context.profile.language, 'registration_complete'))
     return ConversationHandler.END
 
 # ========== СОЗДАНИЕ ИГРЫ ==========
 
-async def create_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    language = get_user_language(user.id)
+async def create_game(update: Update, context: SantaContext):
+    language = context.profile.language
     
     # Проверяем, зарегистрирован ли пользователь
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE user_id = ?', (user.id,))
-    user_data = cursor.fetchone()
-    conn.close()
-    
-    if not user_data:
-        if language == 'ru':
-            await update.message.reply_text("Сначала нужно зарегистрироваться! Используйте /register")
-        else:
-            await update.message.reply_text("You need to register first! Use /register")
+    if not context.profile.user:
+        await update.message.reply_text(catalog.render(language, 'registration_required'))
         return ConversationHandler.END
     
-    if language == 'ru':
-        await update.message.reply_text(
-            "🎄 Отлично! Давайте создадим новую игру Тайного Санты!\n\n"
-            "Как назовем вашу игру? (Например: 'Новогоднее чудо 2024')"
-        )
-    else:
-        await update.message.reply_text(
-            "🎄 Great! Let's create a new Secret Santa game!\n\n"
-            "What should we name your game? (Example: 'Christmas Magic 2024')"
-        )
+    await update.message.reply_text(catalog.render(language, 'create_ask_name'))
     return CREATE_GAME_NAME
 
-async def create_game_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def create_game_name(update: Update, context: SantaContext):
     context.user_data['game_name'] = update.message.text
-    user = update.effective_user
-    language = get_user_language(user.id)
     
-    if language == 'ru':
-        await update.message.reply_text(
-            "💰 Установите бюджет для подарков:\n\n"
-            "Например: '500-1000 рублей' или 'до 1500₽'"
-        )
-    else:
-        await update.message.reply_text(
-            "💰 Set a budget for gifts:\n\n"
-            "Example: '$20-30' or 'up to $50'"
-        )
+    await update.message.reply_text(catalog.render(context.profile.language, 'create_ask_budget'))
     return CREATE_GAME_BUDGET
 
-async def create_game_budget(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def create_game_budget(update: Update, context: SantaContext):
     context.user_data['game_budget'] = update.message.text
-    user = update.effective_user
-    language = get_user_language(user.id)
     
-    if language == 'ru':
-        await update.message.reply_text(
-            "📅 Когда планируется обмен подарками?\n\n"
-            "Укажите дату в формате ДД.ММ.ГГГГ\n"
-            "Например: 25.12.2024"
-        )
-    else:
-        await update.message.reply_text(
-            "📅 When is the gift exchange planned?\n\n"
-            "Enter the date in format DD.MM.YYYY\n"
-            "Example: 12.25.2024"
-        )
+    await update.message.reply_text(catalog.render(context.profile.language, 'create_ask_date'))
     return CREATE_GAME_DATE
 
-async def create_game_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def create_game_date(update: Update, context: SantaContext):
+    user = update.effective_user
+    
     try:
         event_date = datetime.strptime(update.message.text, '%d.%m.%Y')
-        user = update.effective_user
-        
-        # Сохраняем игру в базу данных
-        conn = sqlite3.connect('secret_santa.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO games (name, admin_id, budget, event_date)
-            VALUES (?, ?, ?, ?)
-        ''', (
-            context.user_data['game_name'],
-            user.id,
-            context.user_data['game_budget'],
-            event_date.strftime('%Y-%m-%d')
-        ))
-        
-        game_id = cursor.lastrowid
-        
-        # Добавляем создателя как участника
-        cursor.execute('''
-            INSERT INTO game_participants (game_id, user_id)
-            VALUES (?, ?)
-        ''', (game_id, user.id))
-        
-        conn.commit()
-        conn.close()
-        
-        # Очищаем временные данные
-        game_name = context.user_data['game_name']
-        context.user_data.clear()
-        
-        creation_text = get_localized_text(user.id, 'game_created', game_name)
-        
-        if get_user_language(user.id) == 'ru':
-            creation_text += f"\n\n📊 Статистика:\n• Бюджет: {context.user_data.get('game_budget', '')}\n• Дата: {update.message.text}\n• Участников: 1 (вы)\n\nПриглашайте друзей командой /join или отправив им ID игры: {game_id}"
-        else:
-            creation_text += f"\n\n📊 Statistics:\n• Budget: {context.user_data.get('game_budget', '')}\n• Date: {update.message.text}\n• Participants: 1 (you)\n\nInvite friends with /join or by sending them game ID: {game_id}"
-        
-        await update.message.reply_text(creation_text)
-        
     except ValueError:
-        user = update.effective_user
-        language = get_user_language(user.id)
-        
-        if language == 'ru':
-            await update.message.reply_text(
-                "❌ Неверный формат даты. Пожалуйста, используйте формат ДД.ММ.ГГГГ\n"
-                "Например: 25.12.2024"
-            )
-        else:
-            await update.message.reply_text(
-                "❌ Invalid date format. Please use DD.MM.YYYY format\n"
-                "Example: 12.25.2024"
-            )
+        await update.message.reply_text(catalog.render(context.profile.language, 'create_bad_date'))
         return CREATE_GAME_DATE
     
+    # Сохраняем игру в базу данных
+    game_id = await storage.games.create(
+        context.user_data['game_name'],
+        user.id,
+        context.user_data['game_budget'],
+        event_date.strftime('%Y-%m-%d')
+    )
+    
+    # Очищаем временные данные
+    game_name = context.user_data['game_name']
+    game_budget = context.user_data['game_budget']
+    context.user_data.clear()
+    
+    creation_text = catalog.render(
+        context.profile.language, 'game_created',
+        game_name=game_name, budget=game_budget, date=update.message.text, game_id=game_id
+    )
+    await update.message.reply_text(creation_text)
+    
     return ConversationHandler.END
 
 # ========== ПРИСОЕДИНЕНИЕ К ИГРЕ ==========
 
-async def join_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def join_game(update: Update, context: SantaContext):
     user = update.effective_user
-    language = get_user_language(user.id)
+    language = context.profile.language
     
     # Проверяем, зарегистрирован ли пользователь
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE user_id = ?', (user.id,))
-    user_data = cursor.fetchone()
-    
-    if not user_data:
-        if language == 'ru':
-            await update.message.reply_text("Сначала нужно зарегистрироваться! Используйте /register")
-        else:
-            await update.message.reply_text("You need to register first! Use /register")
-        conn.close()
+    if not context.profile.user:
+        await update.message.reply_text(catalog.render(language, 'registration_required'))
         return ConversationHandler.END
     
     # Получаем список активных игр, к которым пользователь еще не присоединился
-    cursor.execute('''
-        SELECT g.game_id, g.name, g.budget, g.event_date, 
-               COUNT(gp.user_id) as participants_count,
-               u.username as admin_name
-        FROM games g
-        LEFT JOIN game_participants gp ON g.game_id = gp.game_id
-        LEFT JOIN users u ON g.admin_id = u.user_id
-        WHERE g.status = 'active' 
-        AND g.game_id NOT IN (
-            SELECT game_id FROM game_participants WHERE user_id = ?
-        )
-        GROUP BY g.game_id
-        HAVING COUNT(gp.user_id) > 0
-    ''', (user.id,))
-    
-    available_games = cursor.fetchall()
-    conn.close()
+    available_games = await storage.games.available_for(user.id)
     
     if not available_games:
-        if language == 'ru':
-            await update.message.reply_text(
-                "😔 Сейчас нет доступных игр для присоединения.\n"
-                "Вы можете создать свою игру командой /create"
-            )
-        else:
-            await update.message.reply_text(
-                "😔 No available games to join right now.\n"
-                "You can create your own game with /create"
-            )
+        await update.message.reply_text(catalog.render(language, 'join_none_available'))
         return ConversationHandler.END
     
     # Создаем клавиатуру с доступными играми
-    keyboard = []
-    for game in available_games:
-        game_id, name, budget, event_date, participants_count, admin_name = game
-        if language == 'ru':
-            button_text = f"{name} ({participants_count} участ.)"
-        else:
-            button_text = f"{name} ({participants_count} part.)"
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"join_{game_id}")])
-    
-    if language == 'ru':
-        keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="cancel_join")])
-    else:
-        keyboard.append([InlineKeyboardButton("❌ Cancel", callback_data="cancel_join")])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = keyboards.choices(language, (
+        (
+            catalog.render(language, 'join_game_button', name=game.name, participants_count=game.participants_count),
+            f"join_{game.game_id}"
+        )
+        for game in available_games
+    ), 'cancel_join')
     
-    if language == 'ru':
-        await update.message.reply_text("🎮 Выберите игру для присоединения:", reply_markup=reply_markup)
-    else:
-        await update.message.reply_text("🎮 Select a game to join:", reply_markup=reply_markup)
+    await update.message.reply_text(catalog.render(language, 'join_choose'), reply_markup=reply_markup)
     
     return JOIN_GAME
 
-async def join_game_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def join_game_selected(update: Update, context: SantaContext):
     query = update.callback_query
     await query.answer()
     
     if query.data == "cancel_join":
-        language = get_user_language(query.from_user.id)
-        if language == 'ru':
-            await query.edit_message_text("Присоединение к игре отменено.")
-        else:
-            await query.edit_message_text("Game join cancelled.")
+        await query.edit_message_text(catalog.render(context.profile.language, 'join_cancelled'))
         return ConversationHandler.END
     
     if query.data.startswith("join_"):
         game_id = int(query.data.split("_")[1])
         user = query.from_user
-        
-        # Проверяем, не присоединился ли уже пользователь
-        conn = sqlite3.connect('secret_santa.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM game_participants 
-            WHERE game_id = ? AND user_id = ?
-        ''', (game_id, user.id))
-        
-        existing_participant = cursor.fetchone()
-        
-        if existing_participant:
-            language = get_user_language(user.id)
-            if language == 'ru':
-                await query.edit_message_text("Вы уже участвуете в этой игре!")
-            else:
-                await query.edit_message_text("You are already in this game!")
-            conn.close()
+    
+        # Добавляем пользователя в игру и в той же транзакции ставим уведомление администратору
+        # Вступления за DIGEST_WINDOW секунд придут организатору одной сводкой
+        game_info = await storage.participants.join(game_id, user.id, lambda game_info: [Notification(
+            game_info.admin_id, 'join_admin_notice',
+            {'game_name': game_info.name, 'first_name': user.first_name, 'username': user.username},
+            digest=f'join:{game_info.game_id}'
+        )])
+    
+        if game_info is None:
+            await query.edit_message_text(catalog.render(context.profile.language, 'join_already'))
             return ConversationHandler.END
-        
-        # Добавляем пользователя в игру
-        cursor.execute('''
-            INSERT INTO game_participants (game_id, user_id)
-            VALUES (?, ?)
-        ''', (game_id, user.id))
-        
-        # Получаем информацию об игре для уведомления
-        cursor.execute('''
-            SELECT g.name, g.admin_id, u.first_name as admin_name
-            FROM games g
-            LEFT JOIN users u ON g.admin_id = u.user_id
-            WHERE g.game_id = ?
-        ''', (game_id,))
-        
-        game_info = cursor.fetchone()
-        conn.commit()
-        conn.close()
-        
-        # Уведомляем администратора игры
-        try:
-            admin_language = get_user_language(game_info[1])
-            if admin_language == 'ru':
-                message = (
-                    f"🎉 Новый участник в игре '{game_info[0]}'!\n"
-                    f"👤 {user.first_name} (@{user.username}) присоединился к игре."
-                )
-            else:
-                message = (
-                    f"🎉 New participant in game '{game_info[0]}'!\n"
-                    f"👤 {user.first_name} (@{user.username}) joined the game."
-                )
-            
-            await context.bot.send_message(chat_id=game_info[1], text=message)
-        except Exception as e:
-            logger.error(f"Не удалось уведомить администратора: {e}")
-        
-        language = get_user_language(user.id)
-        if language == 'ru':
-            await query.edit_message_text(
-                f"🎉 Вы успешно присоединились к игре '{game_info[0]}'!\n\n"
-                f"Организатор: {game_info[2]}\n"
-                f"Ожидайте начала жеребьевки!"
-            )
-        else:
-            await query.edit_message_text(
-                f"🎉 You successfully joined the game '{game_info[0]}'!\n\n"
-                f"Organizer: {game_info[2]}\n"
-                f"Wait for the draw to start!"
-            )
-        
+    
+        outbox.wake()
+    
+        await query.edit_message_text(catalog.render(
+            context.profile.language, 'join_done', game_name=game_info.name, admin_name=game_info.admin_name
+        ))
+    
         return ConversationHandler.END
 
 # ========== МОИ ИГРЫ ==========
 
-async def my_games(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def my_games(update: Update, context: SantaContext):
     user = update.effective_user
-    language = get_user_language(user.id)
-    
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
+    language = context.profile.language
     
     # Получаем игры, где пользователь участник
-    cursor.execute('''
-        SELECT g.game_id, g.name, g.budget, g.event_date, g.status,
-               g.admin_id, COUNT(gp.user_id) as participants_count,
-               (SELECT COUNT(*) FROM game_participants 
-                WHERE game_id = g.game_id AND assigned_to IS NOT NULL) as assigned_count
-        FROM games g
-        JOIN game_participants gp ON g.game_id = gp.game_id
-        WHERE gp.user_id = ?
-        GROUP BY g.game_id
-        ORDER BY g.event_date
-    ''', (user.id,))
-    
-    user_games = cursor.fetchall()
-    conn.close()
+    user_games = await storage.games.for_user(user.id)
     
     if not user_games:
-        if language == 'ru':
-            await update.message.reply_text(
-                "Вы пока не участвуете ни в одной игре.\n"
-                "Присоединитесь к существующей (/join) или создайте новую (/create)"
-            )
-        else:
-            await update.message.reply_text(
-                "You are not participating in any games yet.\n"
-                "Join an existing one (/join) or create a new one (/create)"
-            )
+        await update.message.reply_text(catalog.render(language, 'my_games_empty'))
         return
     
-    if language == 'ru':
-        games_text = "🎄 Ваши игры Тайного Санты:\n\n"
-    else:
-        games_text = "🎄 Your Secret Santa games:\n\n"
+    games_text = catalog.render(language, 'my_games_header')
     
     for game in user_games:
-        (game_id, name, budget, event_date, status, 
-         admin_id, participants_count, assigned_count) = game
-        
-        status_emoji = "🟢" if status == 'active' else "🔴"
-        
-        if language == 'ru':
-            draw_status = "✅ Жеребьевка проведена" if assigned_count > 0 else "⏳ Ожидает жеребьевки"
-            is_admin = " (👑 Организатор)" if admin_id == user.id else ""
-            
-            games_text += (
-                f"{status_emoji} *{name}*{is_admin}\n"
-                f"📅 Дата: {event_date}\n"
-                f"💰 Бюджет: {budget}\n"
-                f"👥 Участников: {participants_count}\n"
-                f"🎲 {draw_status}\n"
-                f"ID игры: `{game_id}`\n\n"
-            )
-        else:
-            draw_status = "✅ Draw completed" if assigned_count > 0 else "⏳ Waiting for draw"
-            is_admin = " (👑 Admin)" if admin_id == user.id else ""
-            
-            games_text += (
-                f"{status_emoji} *{name}*{is_admin}\n"
-                f"📅 Date: {event_date}\n"
-                f"💰 Budget: {budget}\n"
-                f"👥 Participants: {participants_count}\n"
-                f"🎲 {draw_status}\n"
-                f"Game ID: `{game_id}`\n\n"
-            )
+        draw_status = 'my_games_drawn' if game.assigned_count > 0 else 'my_games_waiting'
+        games_text += catalog.render(
+            language, 'my_games_item',
+            status_emoji="🟢" if game.status == 'active' else "🔴",
+            name=game.name,
+            admin_mark=catalog.render(language, 'my_games_admin_mark') if game.admin_id == user.id else "",
+            event_date=game.event_date,
+            budget=game.budget,
+            participants_count=game.participants_count,
+            draw_status=catalog.render(language, draw_status),
+            game_id=game.game_id,
+        )
     
     await update.message.reply_text(games_text, parse_mode='Markdown')
 
 # ========== ЖЕРЕБЬЕВКА ==========
 
-async def draw(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def draw(update: Update, context: SantaContext):
     user = update.effective_user
-    language = get_user_language(user.id)
+    language = context.profile.language
     
     if context.args:
-        game_id = context.args[0]
+        game_id = parse_game_id(context.args[0])
     else:
-        if language == 'ru':
-            await update.message.reply_text(
-                "Укажите ID игры: /draw <ID_игры>\n"
-                "ID игры можно посмотреть в /my_games"
-            )
-        else:
-            await update.message.reply_text(
-                "Specify game ID: /draw <game_id>\n"
-                "You can see game ID in /my_games"
-            )
+        await update.message.reply_text(catalog.render(language, 'draw_usage'))
         return
     
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
-    
     # Проверяем, существует ли игра и является ли пользователь администратором
-    cursor.execute('''
-        SELECT g.name, g.admin_id, COUNT(gp.user_id) as participants_count
-        FROM games g
-        LEFT JOIN game_participants gp ON g.game_id = gp.game_id
-        WHERE g.game_id = ?
-        GROUP BY g.game_id
-    ''', (game_id,))
-    
-    game_info = cursor.fetchone()
+    game_info = await storage.games.summary(game_id)
     
     if not game_info:
-        if language == 'ru':
-            await update.message.reply_text("Игра с таким ID не найдена.")
-        else:
-            await update.message.reply_text("Game with this ID not found.")
-        conn.close()
+        await update.message.reply_text(catalog.render(language, 'draw_game_not_found'))
         return
     
-    game_name, admin_id, participants_count = game_info
+    game_name, participants_count = game_info.name, game_info.participants_count
     
-    if admin_id != user.id:
-        if language == 'ru':
-            await update.message.reply_text("Только организатор игры может проводить жеребьевку.")
-        else:
-            await update.message.reply_text("Only the game organizer can conduct the draw.")
-        conn.close()
+    if game_info.admin_id != user.id:
+        await update.message.reply_text(catalog.render(language, 'draw_admin_only'))
         return
     
     if participants_count < 3:
-        if language == 'ru':
-            await update.message.reply_text(
-                "Для жеребьевки нужно минимум 3 участника.\n"
-                f"Сейчас участников: {participants_count}"
-            )
-        else:
-            await update.message.reply_text(
-                "Minimum 3 participants required for drawing.\n"
-                f"Current participants: {participants_count}"
-            )
-        conn.close()
+        await update.message.reply_text(
+            catalog.render(language, 'draw_not_enough', participants_count=participants_count)
+        )
         return
     
     # Проверяем, не проводилась ли уже жеребьевка
-    cursor.execute('''
-        SELECT COUNT(*) FROM game_participants 
-        WHERE game_id = ? AND assigned_to IS NOT NULL
-    ''', (game_id,))
-    
-    already_drawn = cursor.fetchone()[0]
-    
-    if already_drawn > 0:
-        if language == 'ru':
-            await update.message.reply_text(
-                "Жеребьевка в этой игре уже проводилась.\n"
-                "Если нужно перепровести, сначала сбросьте результаты."
-            )
-        else:
-            await update.message.reply_text(
-                "Draw has already been conducted in this game.\n"
-                "If you need to redraw, reset the results first."
-            )
-        conn.close()
+    if game_info.assigned_count > 0:
+        await update.message.reply_text(catalog.render(language, 'draw_already'))
         return
     
     # Получаем список участников
-    cursor.execute('''
-        SELECT gp.user_id, u.first_name, u.wishes
-        FROM game_participants gp
-        JOIN users u ON gp.user_id = u.user_id
-        WHERE gp.game_id = ?
-    ''', (game_id,))
-    
-    participants = cursor.fetchall()
-    
-    # Алгоритм жеребьевки
-    assigned = False
-    attempts = 0
-    max_attempts = 100
-    
-    while not assigned and attempts < max_attempts:
-        attempts += 1
-        # Создаем копию списка для назначения
-        receivers = [p[0] for p in participants]
-        random.shuffle(receivers)
-        
-        # Проверяем, чтобы никто не вытянул себя
-        valid_assignment = True
-        assignment = []
-        
-        for i, participant in enumerate(participants):
-            giver_id = participant[0]
-            receiver_id = receivers[i]
-            
-            if giver_id == receiver_id:
-                valid_assignment = False
-                break
-            
-            assignment.append((giver_id, receiver_id))
-        
-        if valid_assignment:
-            # Сохраняем результаты в базу
-            for giver_id, receiver_id in assignment:
-                cursor.execute('''
-                    UPDATE game_participants 
-                    SET assigned_to = ?
-                    WHERE game_id = ? AND user_id = ?
-                ''', (receiver_id, game_id, giver_id))
-            
-            conn.commit()
-            assigned = True
+    participants = await storage.participants.for_draw(game_id)
     
-    if not assigned:
-        if language == 'ru':
-            await update.message.reply_text("❌ Не удалось провести жеребьевку. Попробуйте еще раз.")
-        else:
-            await update.message.reply_text("❌ Failed to conduct the draw. Please try again.")
-        conn.close()
-        return
+    exclusions = [(exclusion.user_id, exclusion.excluded_id) for exclusion in await storage.exclusions.for_game(game_id)]
     
-    # Отправляем уведомления участникам
-    if language == 'ru':
-        await update.message.reply_text(
-            f"🎉 Жеребьевка для игры '{game_name}' проведена успешно!\n"
-            f"Участники получат уведомления с именами их Тайных Сант."
-        )
-    else:
-        await update.message.reply_text(
-            f"🎉 Draw for game '{game_name}' completed successfully!\n"
-            f"Participants will receive notifications with their Secret Santa assignments."
+    # Пары прошлых сезонов этой группы загружаются одним запросом и проверяются по множествам
+    history = await storage.history.recent(game_info, REPEAT_SEASONS) if REPEAT_SEASONS else []
+    past_pairs = [(pairing.giver_id, pairing.receiver_id) for pairing in history]
+    if REPEAT_POLICY == 'exclude':
+        exclusions += past_pairs
+        past_pairs = []
+    
+    # Жеребьевка: никто не вытягивает себя и исключенные пары. На больших играх с
+    # плотными исключениями она занимает секунды, поэтому идет в пуле потоков,
+    # а цикл событий тем временем обрабатывает другие обновления
+    loop = asyncio.get_running_loop()
+    try:
+        assignment = await loop.run_in_executor(
+            None, draw_engine.draw, [p.user_id for p in participants], exclusions, past_pairs
         )
+    except DrawImpossible:
+        await update.message.reply_text(catalog.render(language, 'draw_impossible'))
+        return
     
-    # Рассылаем уведомления участникам
-    for giver_id, receiver_id in assignment:
-        # Находим информацию о получателе
-        receiver_info = next(p for p in participants if p[0] == receiver_id)
-        receiver_name, receiver_wishes = receiver_info[1], receiver_info[2]
-        
-        giver_language = get_user_language(giver_id)
-        
-        try:
-            if giver_language == 'ru':
-                message = (
-                    f"🎅 Тайный Санта для игры *{game_name}*\n\n"
-                    f"Вы дарите подарок: *{receiver_name}*\n\n"
-                    f"🎁 Пожелания получателя:\n"
-                    f"{receiver_wishes}\n\n"
-                    f"💰 Бюджет: {game_info[2]}\n"
-                    f"📅 Дата обмена: {game_info[3]}\n\n"
-                    f"Удачи в выборе подарка! 🎄"
-                )
-            else:
-                message = (
-                    f"🎅 Secret Santa for game *{game_name}*\n\n"
-                    f"You are gifting to: *{receiver_name}*\n\n"
-                    f"🎁 Recipient's wishes:\n"
-                    f"{receiver_wishes}\n\n"
-                    f"💰 Budget: {game_info[2]}\n"
-                    f"📅 Exchange date: {game_info[3]}\n\n"
-                    f"Good luck choosing a gift! 🎄"
-                )
-            
-            await context.bot.send_message(
-                chat_id=giver_id,
-                text=message,
-                parse_mode='Markdown'
-            )
-            await asyncio.sleep(0.1)  # Чтобы не превысить лимиты Telegram
-        except Exception as e:
-            logger.error(f"Не удалось отправить сообщение пользователю {giver_id}: {e}")
+    # Уведомления участникам сохраняются в outbox той же транзакцией, что и пары:
+    # после коммита ни одно из них не потеряется. Рассылает их OutboxDispatcher в фоне,
+    # обработчик отвечает организатору сразу, прогресс - /draw_status
+    participants_by_id = {p.user_id: p for p in participants}
+    notifications = [
+        Notification(giver_id, 'draw_assignment', {
+            'game_name': game_name,
+            'receiver_name': participants_by_id[receiver_id].first_name,
+            'wishes': participants_by_id[receiver_id].wishes,
+            'budget': game_info.budget,
+            'event_date': game_info.event_date,
+        }, 'Markdown')
+        for giver_id, receiver_id in assignment
+    ]
+    await storage.participants.assign(game_id, assignment, notifications)
+    outbox.wake()
+    
+    await update.message.reply_text(catalog.render(language, 'draw_done', game_name=game_name, game_id=game_id))
     
-    conn.close()
+    # Предупреждаем организатора о тех, кому уведомление сейчас не дойдет
+    unreachable = await storage.reachability.for_game(game_id)
+    if unreachable:
+        await update.message.reply_text(catalog.render(
+            language, 'draw_unreachable', names=', '.join(member.first_name for member in unreachable)
+        ))
 
 # ========== АНОНИМНЫЕ СООБЩЕНИЯ ==========
 
-async def send_anonymous_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def send_anonymous_message(update: Update, context: SantaContext):
     """Начало отправки анонимного сообщения"""
     user = update.effective_user
-    language = get_user_language(user.id)
-    
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
+    language = context.profile.language
     
     # Ищем игры, где пользователь участвует и жеребьевка проведена
-    cursor.execute('''
-        SELECT g.game_id, g.name, u2.first_name, u2.user_id
-        FROM games g
-        JOIN game_participants gp ON g.game_id = gp.game_id
-        JOIN users u2 ON gp.assigned_to = u2.user_id
-        WHERE gp.user_id = ? AND gp.assigned_to IS NOT NULL
-    ''', (user.id,))
-    
-    games = cursor.fetchall()
-    conn.close()
+    games = await storage.participants.assignments_of(user.id)
     
     if not games:
-        if language == 'ru':
-            await update.message.reply_text(
-                "У вас нет активных игр с проведенной жеребьевкой, "
-                "в которые можно отправить сообщение."
-            )
-        else:
-            await update.message.reply_text(
-                "You don't have any active games with completed draw "
-                "where you can send messages."
-            )
+        await update.message.reply_text(catalog.render(language, 'anon_no_games'))
         return ConversationHandler.END
     
     # Создаем клавиатуру с играми
-    keyboard = []
-    for game in games:
-        game_id, game_name, receiver_name, receiver_id = game
-        if language == 'ru':
-            button_text = f"{game_name} → {receiver_name}"
-        else:
-            button_text = f"{game_name} → {receiver_name}"
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"anon_msg_{game_id}")])
-    
-    if language == 'ru':
-        keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="cancel_anon_msg")])
-    else:
-        keyboard.append([InlineKeyboardButton("❌ Cancel", callback_data="cancel_anon_msg")])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = keyboards.choices(language, (
+        (f"{game.game_name} → {game.receiver_name}", f"anon_msg_{game.game_id}")
+        for game in games
+    ), 'cancel_anon_msg')
     
-    if language == 'ru':
-        await update.message.reply_text(
-            "📨 Выберите игру для отправки анонимного сообщения вашему Тайному Санте "
-            "или тому, кому вы дарите подарок:",
-            reply_markup=reply_markup
-        )
-    else:
-        await update.message.reply_text(
-            "📨 Select a game to send an anonymous message to your Secret Santa "
-            "or to the person you're gifting to:",
-            reply_markup=reply_markup
-        )
+    await update.message.reply_text(catalog.render(language, 'anon_choose_game'), reply_markup=reply_markup)
     
     return ANON_MESSAGE_CHOOSE_GAME
 
-async def anon_message_choose_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def anon_message_choose_game(update: Update, context: SantaContext):
     """Обработчик выбора игры для анонимного сообщения"""
     query = update.callback_query
     await query.answer()
     
     if query.data == "cancel_anon_msg":
-        language = get_user_language(query.from_user.id)
-        if language == 'ru':
-            await query.edit_message_text("Отправка сообщения отменена.")
-        else:
-            await query.edit_message_text("Message sending cancelled.")
+        await query.edit_message_text(catalog.render(context.profile.language, 'anon_cancelled'))
         return ConversationHandler.END
     
     game_id = int(query.data.split("_")[2])
     context.user_data['anon_message_game_id'] = game_id
     
-    language = get_user_language(query.from_user.id)
-    
-    if language == 'ru':
-        await query.edit_message_text(
-            "✍️ Введите ваше анонимное сообщение:\n\n"
-            "💡 Вы можете:\n"
-            "• Уточнить пожелания к подарку\n"
-            "• Спросить о размерах/предпочтениях\n"
-            "• Просто отправить ободряющее сообщение!"
-        )
-    else:
-        await query.edit_message_text(
-            "✍️ Enter your anonymous message:\n\n"
-            "💡 You can:\n"
-            "• Clarify gift preferences\n"
-            "• Ask about sizes/preferences\n"
-            "• Just send an encouraging message!"
-        )
+    await query.edit_message_text(catalog.render(context.profile.language, 'anon_ask_text'))
     
     return ANON_MESSAGE_TEXT
 
-async def anon_message_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def anon_message_text(update: Update, context: SantaContext):
     """Обработчик текста анонимного сообщения"""
     message_text = update.message.text
     user = update.effective_user
     game_id = context.user_data['anon_message_game_id']
-    language = get_user_language(user.id)
-    
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
+    language = context.profile.language
     
     # Определяем, кому отправляем сообщение
     # Если пользователь - даритель, то отправляем получателю
     # Если пользователь - получатель, то отправляем дарителю
     
-    cursor.execute('''
-        SELECT assigned_to FROM game_participants 
-        WHERE game_id = ? AND user_id = ?
-    ''', (game_id, user.id))
-    
-    assignment = cursor.fetchone()
+    receiver_id = await storage.participants.receiver_of(game_id, user.id)
     
-    if assignment and assignment[0]:  # Пользователь - даритель
-        to_user_id = assignment[0]
-        if language == 'ru':
-            message_type = "получателю"
-        else:
-            message_type = "recipient"
+    if receiver_id:  # Пользователь - даритель
+        to_user_id = receiver_id
+        recipient = catalog.render(language, 'anon_to_recipient')
     else:  # Пользователь - получатель, находим его дарителя
-        cursor.execute('''
-            SELECT user_id FROM game_participants 
-            WHERE game_id = ? AND assigned_to = ?
-        ''', (game_id, user.id))
-        
-        donor = cursor.fetchone()
-        if donor:
-            to_user_id = donor[0]
-            if language == 'ru':
-                message_type = "вашему Тайному Санте"
-            else:
-                message_type = "your Secret Santa"
+        donor_id = await storage.participants.santa_of(game_id, user.id)
+    
+        if donor_id:
+            to_user_id = donor_id
+            recipient = catalog.render(language, 'anon_to_santa')
         else:
-            if language == 'ru':
-                await update.message.reply_text("❌ Не удалось найти получателя сообщения.")
-            else:
-                await update.message.reply_text("❌ Failed to find message recipient.")
-            conn.close()
+            await update.message.reply_text(catalog.render(language, 'anon_no_recipient'))
             return ConversationHandler.END
     
-    # Сохраняем сообщение в базу
-    cursor.execute('''
-        INSERT INTO anonymous_messages (game_id, from_user_id, to_user_id, message)
-        VALUES (?, ?, ?, ?)
-    ''', (game_id, user.id, to_user_id, message_text))
-    
-    conn.commit()
-    conn.close()
+    # Сохраняем сообщение в базу вместе с уведомлением получателю (анонимно)
+    await storage.messages.add(
+        game_id, user.id, to_user_id, message_text,
+        # Текст пользователя экранируется: лишние * или _ сломали бы разметку уведомления
+        [Notification(to_user_id, 'anon_received', {'message': escape_markdown(message_text)}, 'Markdown')]
+    )
+    outbox.wake()
     
     # Отправляем подтверждение отправителю
-    if language == 'ru':
-        await update.message.reply_text(
-            f"✅ Ваше анонимное сообщение {message_type} отправлено!\n\n"
-            f"Сообщение: \"{message_text}\""
-        )
-    else:
-        await update.message.reply_text(
-            f"✅ Your anonymous message to {message_type} sent!\n\n"
-            f"Message: \"{message_text}\""
-        )
+    await update.message.reply_text(
+        catalog.render(language, 'anon_sent', recipient=recipient, message=message_text)
+    )
     
-    # Отправляем сообщение получателю (анонимно)
-    try:
-        to_user_language = get_user_language(to_user_id)
-        
-        if to_user_language == 'ru':
-            message = (
-                f"📨 У вас новое анонимное сообщение!\n\n"
-                f"💬 *Сообщение:* {message_text}\n\n"
-                f"🎅 Это сообщение от вашего Тайного Санты/получателя."
-            )
-        else:
-            message = (
-                f"📨 You have a new anonymous message!\n\n"
-                f"💬 *Message:* {message_text}\n\n"
-                f"🎅 This message is from your Secret Santa/recipient."
-            )
-        
-        await context.bot.send_message(
-            chat_id=to_user_id,
-            text=message,
-            parse_mode='Markdown'
-        )
-    except Exception as e:
-        logger.error(f"Не удалось отправить анонимное сообщение: {e}")
-        if language == 'ru':
-            await update.message.reply_text(
-                "❌ Не удалось доставить сообщение. "
-                "Возможно, пользователь заблокировал бота."
-            )
-        else:
-            await update.message.reply_text(
-                "❌ Failed to deliver message. "
-                "Maybe the user blocked the bot."
-            )
+    if await storage.reachability.among([to_user_id]):
+        await update.message.reply_text(catalog.render(language, 'anon_held'))
     
     return ConversationHandler.END
 
-async def view_anonymous_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def view_anonymous_messages(update: Update, context: SantaContext):
     """Просмотр полученных анонимных сообщений"""
     user = update.effective_user
-    language = get_user_language(user.id)
-    
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT am.message, am.sent_at, g.name, u.first_name
-        FROM anonymous_messages am
-        JOIN games g ON am.game_id = g.game_id
-        JOIN users u ON am.from_user_id = u.user_id
-        WHERE am.to_user_id = ? AND am.is_read = FALSE
-        ORDER BY am.sent_at DESC
-    ''', (user.id,))
+    language = context.profile.language
     
-    messages = cursor.fetchall()
+    messages = await storage.messages.unread_for(user.id)
     
     if not messages:
-        if language == 'ru':
-            await update.message.reply_text("📭 У вас нет новых анонимных сообщений.")
-        else:
-            await update.message.reply_text("📭 You have no new anonymous messages.")
-        conn.close()
+        await update.message.reply_text(catalog.render(language, 'messages_empty'))
         return
     
-    if language == 'ru':
-        messages_text = "📨 Ваши анонимные сообщения:\n\n"
-    else:
-        messages_text = "📨 Your anonymous messages:\n\n"
-    
-    for i, (message, sent_at, game_name, from_name) in enumerate(messages, 1):
-        if language == 'ru':
-            messages_text += (
-                f"*Сообщение {i}:*\n"
-                f"🎮 Игра: {game_name}\n"
-                f"💬 {message}\n"
-                f"⏰ {sent_at[:16]}\n\n"
-            )
-        else:
-            messages_text += (
-                f"*Message {i}:*\n"
-                f"🎮 Game: {game_name}\n"
-                f"💬 {message}\n"
-                f"⏰ {sent_at[:16]}\n\n"
-            )
+    messages_text = catalog.render(language, 'messages_header')
     
-    # Помечаем сообщения как прочитанные
-    cursor.execute('''
-        UPDATE anonymous_messages 
-        SET is_read = TRUE 
-        WHERE to_user_id = ? AND is_read = FALSE
-    ''', (user.id,))
+    for i, message in enumerate(messages, 1):
+        messages_text += catalog.render(
+            language, 'messages_item',
+            number=i, game_name=message.game_name, message=message.message, sent_at=message.sent_at[:16]
+        )
     
-    conn.commit()
-    conn.close()
+    # Помечаем прочитанными только показанные сообщения
+    await storage.messages.mark_read(user.id, max(message.message_id for message in messages))
     
     await update.message.reply_text(messages_text, parse_mode='Markdown')
 
 # ========== ПОДТВЕРЖДЕНИЕ ПОДАРКОВ ==========
 
-async def confirm_gift_sent(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def confirm_gift_sent(update: Update, context: SantaContext):
     """Подтверждение отправки подарка"""
     user = update.effective_user
-    language = get_user_language(user.id)
+    language = context.profile.language
     
     if not context.args:
-        if language == 'ru':
-            await update.message.reply_text(
-                "Укажите ID игры: /gift_sent <ID_игры>\n"
-                "ID можно посмотреть в /my_games"
-            )
-        else:
-            await update.message.reply_text(
-                "Specify game ID: /gift_sent <game_id>\n"
-                "You can see ID in /my_games"
-            )
+        await update.message.reply_text(catalog.render(language, 'gift_sent_usage'))
         return
     
-    game_id = context.args[0]
-    
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
+    game_id = parse_game_id(context.args[0])
     
     # Проверяем участие в игре
-    cursor.execute('''
-        SELECT g.name, u2.first_name 
-        FROM game_participants gp
-        JOIN games g ON gp.game_id = g.game_id
-        JOIN users u2 ON gp.assigned_to = u2.user_id
-        WHERE gp.game_id = ? AND gp.user_id = ?
-    ''', (game_id, user.id))
-    
-    game_info = cursor.fetchone()
+    game_info = await storage.participants.assignment(game_id, user.id)
     
     if not game_info:
-        if language == 'ru':
-            await update.message.reply_text("Вы не участвуете в этой игре или игра не найдена.")
-        else:
-            await update.message.reply_text("You are not in this game or game not found.")
-        conn.close()
+        await update.message.reply_text(catalog.render(language, 'gift_sent_not_member'))
         return
     
-    game_name, receiver_name = game_info
-    
-    # Сохраняем подтверждение
-    cursor.execute('''
-        INSERT OR REPLACE INTO gift_confirmations 
-        (game_id, user_id, gift_sent, sent_at)
-        VALUES (?, ?, TRUE, CURRENT_TIMESTAMP)
-    ''', (game_id, user.id))
-    
-    conn.commit()
-    conn.close()
+    game_name, receiver_name = game_info.game_name, game_info.receiver_name
     
-    if language == 'ru':
-        await update.message.reply_text(
-            f"✅ Вы подтвердили отправку подарка для *{receiver_name}* в игре \"{game_name}\"!\n\n"
-            f"🎁 Получатель будет уведомлен о том, что подарок в пути.",
-            parse_mode='Markdown'
-        )
-    else:
-        await update.message.reply_text(
-            f"✅ You confirmed sending gift to *{receiver_name}* in game \"{game_name}\"!\n\n"
-            f"🎁 The recipient will be notified that the gift is on its way.",
-            parse_mode='Markdown'
-        )
+    # Сохраняем подтверждение вместе с уведомлением получателю
+    await storage.confirmations.mark_sent(game_id, user.id, [
+        Notification(game_info.receiver_id, 'gift_sent_notice', {'game_name': game_name}, 'Markdown')
+    ])
+    outbox.wake()
     
-    # Уведомляем получателя
-    try:
-        cursor.execute('''
-            SELECT assigned_to FROM game_participants 
-            WHERE game_id = ? AND user_id = ?
-        ''', (game_id, user.id))
-        
-        receiver_id = cursor.fetchone()[0]
-        
-        receiver_language = get_user_language(receiver_id)
-        
-        if receiver_language == 'ru':
-            message = (
-                f"🎉 Отличные новости!\n\n"
-                f"Ваш Тайный Санта отправил вам подарок! 🎁\n"
-                f"Скоро он будет у вас!\n\n"
-                f"Игра: *{game_name}*"
-            )
-        else:
-            message = (
-                f"🎉 Great news!\n\n"
-                f"Your Secret Santa sent you a gift! 🎁\n"
-                f"It will be with you soon!\n\n"
-                f"Game: *{game_name}*"
-            )
-        
-        await context.bot.send_message(
-            chat_id=receiver_id,
-            text=message,
-            parse_mode='Markdown'
-        )
-    except Exception as e:
-        logger.error(f"Не удалось уведомить получателя: {e}")
+    await update.message.reply_text(
+        catalog.render(language, 'gift_sent_done', receiver_name=receiver_name, game_name=game_name),
+        parse_mode='Markdown'
+    )
 
-async def confirm_gift_received(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def confirm_gift_received(update: Update, context: SantaContext):
     """Подтверждение получения подарка"""
     user = update.effective_user
-    language = get_user_language(user.id)
+    language = context.profile.language
     
     if not context.args:
-        if language == 'ru':
-            await update.message.reply_text("Укажите ID игры: /gift_received <ID_игры>")
-        else:
-            await update.message.reply_text("Specify game ID: /gift_received <game_id>")
+        await update.message.reply_text(catalog.render(language, 'gift_received_usage'))
         return
     
-    game_id = context.args[0]
-    
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
+    game_id = parse_game_id(context.args[0])
     
     # Проверяем участие в игре
-    cursor.execute('''
-        SELECT g.name 
-        FROM game_participants gp
-        JOIN games g ON gp.game_id = g.game_id
-        WHERE gp.game_id = ? AND gp.user_id = ?
-    ''', (game_id, user.id))
-    
-    game_info = cursor.fetchone()
+    game_info = await storage.participants.member_game(game_id, user.id)
     
     if not game_info:
-        if language == 'ru':
-            await update.message.reply_text("Вы не участвуете в этой игре.")
-        else:
-            await update.message.reply_text("You are not in this game.")
-        conn.close()
+        await update.message.reply_text(catalog.render(language, 'gift_received_not_member'))
         return
     
-    game_name = game_info[0]
+    game_name = game_info.name
     
     # Сохраняем подтверждение
-    cursor.execute('''
-        INSERT OR REPLACE INTO gift_confirmations 
-        (game_id, user_id, gift_received, received_at)
-        VALUES (?, ?, TRUE, CURRENT_TIMESTAMP)
-    ''', (game_id, user.id))
-    
-    conn.commit()
-    conn.close()
+    await storage.confirmations.mark_received(game_id, user.id)
     
-    if language == 'ru':
-        keyboard = [[InlineKeyboardButton("⭐ Оценить подарок", callback_data=f"rate_{game_id}")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            f"🎉 Спасибо за подтверждение получения подарка в игре \"{game_name}\"!\n\n"
-            f"Теперь вы можете оценить подарок и оставить отзыв.",
-            reply_markup=reply_markup
-        )
-    else:
-        keyboard = [[InlineKeyboardButton("⭐ Rate gift", callback_data=f"rate_{game_id}")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            f"🎉 Thank you for confirming gift receipt in game \"{game_name}\"!\n\n"
-            f"Now you can rate the gift and leave feedback.",
-            reply_markup=reply_markup
-        )
+    await update.message.reply_text(
+        catalog.render(language, 'gift_received_done', game_name=game_name),
+        reply_markup=keyboards.rate_gift(language, game_id)
+    )
 
-async def gift_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def gift_status(update: Update, context: SantaContext):
     """Просмотр статуса подарков в игре"""
-    user = update.effective_user
-    language = get_user_language(user.id)
+    language = context.profile.language
     
     if not context.args:
-        if language == 'ru':
-            await update.message.reply_text("Укажите ID игры: /gift_status <ID_игры>")
-        else:
-            await update.message.reply_text("Specify game ID: /gift_status <game_id>")
+        await update.message.reply_text(catalog.render(language, 'gift_status_usage'))
         return
     
-    game_id = context.args[0]
-    
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
+    game_id = parse_game_id(context.args[0])
     
     # Получаем статус по игре
-    cursor.execute('''
-        SELECT u.first_name, 
-               CASE WHEN gc.gift_sent THEN '✅ Отправлен' ELSE '❌ Не отправлен' END as sent_status,
-               CASE WHEN gc.gift_received THEN '✅ Получен' ELSE '❌ Не получен' END as received_status
-        FROM game_participants gp
-        JOIN users u ON gp.user_id = u.user_id
-        LEFT JOIN gift_confirmations gc ON gp.game_id = gc.game_id AND gp.user_id = gc.user_id
-        WHERE gp.game_id = ?
-    ''', (game_id,))
-    
-    participants = cursor.fetchall()
+    participants = await storage.confirmations.statuses(game_id)
     
     if not participants:
-        if language == 'ru':
-            await update.message.reply_text("Игра не найдена или в ней нет участников.")
-        else:
-            await update.message.reply_text("Game not found or no participants.")
-        conn.close()
+        await update.message.reply_text(catalog.render(language, 'gift_status_not_found'))
         return
     
-    if language == 'ru':
-        status_text = f"📊 Статус подарков в игре:\n\n"
-    else:
-        status_text = f"📊 Gift status in game:\n\n"
+    status_text = catalog.render(language, 'gift_status_header')
     
     for participant in participants:
-        name, sent_status, received_status = participant
-        if language == 'ru':
-            status_text += f"👤 {name}:\n"
-            status_text += f"   🎁 {sent_status}\n"
-            status_text += f"   📦 {received_status}\n\n"
-        else:
-            # Translate status for English
-            sent_status_en = '✅ Sent' if '✅' in sent_status else '❌ Not sent'
-            received_status_en = '✅ Received' if '✅' in received_status else '❌ Not received'
-            status_text += f"👤 {name}:\n"
-            status_text += f"   🎁 {sent_status_en}\n"
-            status_text += f"   📦 {received_status_en}\n\n"
-    
-    conn.close()
+        sent_status = 'gift_status_sent' if participant.gift_sent else 'gift_status_not_sent'
+        received_status = 'gift_status_received' if participant.gift_received else 'gift_status_not_received'
+        status_text += catalog.render(
+            language, 'gift_status_item',
+            first_name=participant.first_name,
+            sent_status=catalog.render(language, sent_status),
+            received_status=catalog.render(language, received_status),
+        )
+    
     await update.message.reply_text(status_text)
 
 # ========== РЕЙТИНГИ И ОТЗЫВЫ ==========
 
-async def rate_gift_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def rate_gift_start(update: Update, context: SantaContext):
     """Начало оценки подарка"""
     query = update.callback_query
     await query.answer()
@@ -1566,303 +3323,112 @@ async def rate_gift_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     game_id = int(query.data.split("_")[1])
     context.user_data['rating_game_id'] = game_id
     
-    language = get_user_language(query.from_user.id)
+    language = context.profile.language
     
-    keyboard = [
-        [InlineKeyboardButton("⭐", callback_data="rate_1"),
-         InlineKeyboardButton("⭐⭐", callback_data="rate_2"),
-         InlineKeyboardButton("⭐⭐⭐", callback_data="rate_3"),
-         InlineKeyboardButton("⭐⭐⭐⭐", callback_data="rate_4"),
-         InlineKeyboardButton("⭐⭐⭐⭐⭐", callback_data="rate_5")],
-    ]
-    
-    if language == 'ru':
-        keyboard.append([InlineKeyboardButton("❌ Отмена", callback_data="cancel_rate")])
-    else:
-        keyboard.append([InlineKeyboardButton("❌ Cancel", callback_data="cancel_rate")])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    if language == 'ru':
-        await query.edit_message_text(
-            "⭐ Оцените подарок:\n\n"
-            "Выберите количество звезд от 1 до 5:",
-            reply_markup=reply_markup
-        )
-    else:
-        await query.edit_message_text(
-            "⭐ Rate the gift:\n\n"
-            "Select number of stars from 1 to 5:",
-            reply_markup=reply_markup
-        )
+    await query.edit_message_text(catalog.render(language, 'rate_ask_score'), reply_markup=keyboards.rating(language))
     
     return RATING_SCORE
 
-async def rate_gift_score(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def rate_gift_score(update: Update, context: SantaContext):
     """Обработчик выбора оценки"""
     query = update.callback_query
     await query.answer()
     
     if query.data == "cancel_rate":
-        language = get_user_language(query.from_user.id)
-        if language == 'ru':
-            await query.edit_message_text("Оценка отменена.")
-        else:
-            await query.edit_message_text("Rating cancelled.")
+        await query.edit_message_text(catalog.render(context.profile.language, 'rate_cancelled'))
         return ConversationHandler.END
     
     rating = int(query.data.split("_")[1])
     context.user_data['rating_score'] = rating
     
-    language = get_user_language(query.from_user.id)
-    
-    if language == 'ru':
-        await query.edit_message_text(
-            f"⭐ Вы оценили подарок на {rating} звезд.\n\n"
-            f"💬 Хотите оставить текстовый отзыв? "
-            f"Напишите ваш отзыв или нажмите /skip чтобы пропустить:"
-        )
-    else:
-        await query.edit_message_text(
-            f"⭐ You rated the gift {rating} stars.\n\n"
-            f"💬 Would you like to leave a text feedback? "
-            f"Write your feedback or press /skip to skip:"
-        )
+    await query.edit_message_text(
+        catalog.render(context.profile.language, 'rate_ask_feedback', rating=rating)
+    )
     
     return RATING_FEEDBACK
 
-async def rate_gift_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def rate_gift_feedback(update: Update, context: SantaContext):
     """Обработчик отзыва"""
     user = update.effective_user
     game_id = context.user_data['rating_game_id']
     rating = context.user_data['rating_score']
     feedback = update.message.text
-    language = get_user_language(user.id)
-    
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
-    
-    # Обновляем подтверждение с рейтингом и отзывом
-    cursor.execute('''
-        UPDATE gift_confirmations 
-        SET rating = ?, feedback = ?
-        WHERE game_id = ? AND user_id = ?
-    ''', (rating, feedback, game_id, user.id))
-    
-    # Находим дарителя для уведомления
-    cursor.execute('''
-        SELECT gp.user_id, g.name 
-        FROM game_participants gp
-        JOIN games g ON gp.game_id = g.game_id
-        WHERE gp.game_id = ? AND gp.assigned_to = ?
-    ''', (game_id, user.id))
-    
-    donor_info = cursor.fetchone()
+    language = context.profile.language
     
-    conn.commit()
-    conn.close()
-    
-    if donor_info:
-        donor_id, game_name = donor_info
-        
-        # Уведомляем дарителя об оценке
-        stars = "⭐" * rating
-        donor_language = get_user_language(donor_id)
-        
-        try:
-            if donor_language == 'ru':
-                message = (
-                    f"🎉 Ваш подарок получил оценку!\n\n"
-                    f"🏆 Оценка: {stars} ({rating}/5)\n"
-                    f"💬 Отзыв: {feedback}\n\n"
-                    f"Игра: *{game_name}*"
-                )
-            else:
-                message = (
-                    f"🎉 Your gift received a rating!\n\n"
-                    f"🏆 Rating: {stars} ({rating}/5)\n"
-                    f"💬 Feedback: {feedback}\n\n"
-                    f"Game: *{game_name}*"
-                )
-            
-            await context.bot.send_message(
-                chat_id=donor_id,
-                text=message,
-                parse_mode='Markdown'
-            )
-        except Exception as e:
-            logger.error(f"Не удалось уведомить дарителя: {e}")
+    # Обновляем подтверждение с рейтингом и отзывом, уведомление дарителю - в той же транзакции
+    await storage.confirmations.rate(game_id, user.id, rating, feedback, lambda donor_info: [Notification(
+        donor_info.donor_id, 'rating_notice_feedback',
+        {'stars': "⭐" * rating, 'rating': rating, 'feedback': feedback, 'game_name': donor_info.game_name},
+        'Markdown'
+    )])
+    outbox.wake()
     
-    if language == 'ru':
-        await update.message.reply_text(
-            f"✅ Спасибо за вашу оценку и отзыв!\n\n"
-            f"⭐ Оценка: {rating}/5\n"
-            f"💬 Отзыв: {feedback}"
-        )
-    else:
-        await update.message.reply_text(
-            f"✅ Thank you for your rating and feedback!\n\n"
-            f"⭐ Rating: {rating}/5\n"
-            f"💬 Feedback: {feedback}"
-        )
+    await update.message.reply_text(
+        catalog.render(language, 'rating_thanks_feedback', rating=rating, feedback=feedback)
+    )
     
     return ConversationHandler.END
 
-async def skip_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def skip_feedback(update: Update, context: SantaContext):
     """Пропуск отзыва"""
     user = update.effective_user
     game_id = context.user_data['rating_game_id']
     rating = context.user_data['rating_score']
-    language = get_user_language(user.id)
-    
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE gift_confirmations 
-        SET rating = ?
-        WHERE game_id = ? AND user_id = ?
-    ''', (rating, game_id, user.id))
+    language = context.profile.language
     
-    # Находим дарителя
-    cursor.execute('''
-        SELECT gp.user_id, g.name 
-        FROM game_participants gp
-        JOIN games g ON gp.game_id = g.game_id
-        WHERE gp.game_id = ? AND gp.assigned_to = ?
-    ''', (game_id, user.id))
-    
-    donor_info = cursor.fetchone()
-    conn.close()
-    
-    if donor_info:
-        donor_id, game_name = donor_info
-        stars = "⭐" * rating
-        donor_language = get_user_language(donor_id)
-        
-        try:
-            if donor_language == 'ru':
-                message = (
-                    f"🎉 Ваш подарок получил оценку!\n\n"
-                    f"🏆 Оценка: {stars} ({rating}/5)\n\n"
-                    f"Игра: *{game_name}*"
-                )
-            else:
-                message = (
-                    f"🎉 Your gift received a rating!\n\n"
-                    f"🏆 Rating: {stars} ({rating}/5)\n\n"
-                    f"Game: *{game_name}*"
-                )
-            
-            await context.bot.send_message(
-                chat_id=donor_id,
-                text=message,
-                parse_mode='Markdown'
-            )
-        except Exception as e:
-            logger.error(f"Не удалось уведомить дарителя: {e}")
+    # Сохраняем оценку и ставим уведомление дарителю
+    await storage.confirmations.rate(game_id, user.id, rating, notify=lambda donor_info: [Notification(
+        donor_info.donor_id, 'rating_notice',
+        {'stars': "⭐" * rating, 'rating': rating, 'game_name': donor_info.game_name},
+        'Markdown'
+    )])
+    outbox.wake()
     
-    if language == 'ru':
-        await update.message.reply_text(
-            f"✅ Спасибо за вашу оценку!\n\n"
-            f"⭐ Оценка: {rating}/5"
-        )
-    else:
-        await update.message.reply_text(
-            f"✅ Thank you for your rating!\n\n"
-            f"⭐ Rating: {rating}/5"
-        )
+    await update.message.reply_text(catalog.render(language, 'rating_thanks', rating=rating))
     
     return ConversationHandler.END
 
 # ========== НАПОМИНАНИЯ ==========
 
-async def reminder_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def reminder_settings(update: Update, context: SantaContext):
     """Настройки напоминаний"""
-    user = update.effective_user
-    language = get_user_language(user.id)
+    language = context.profile.language
     
-    if language == 'ru':
-        keyboard = [
-            [InlineKeyboardButton("🔔 Включить напоминания", callback_data="reminders_on")],
-            [InlineKeyboardButton("🔕 Выключить напоминания", callback_data="reminders_off")],
-        ]
-        
-        await update.message.reply_text(
-            "⚙️ Настройки напоминаний:\n\n"
-            "Здесь вы можете управлять уведомлениями о предстоящих обменах подарками.",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-    else:
-        keyboard = [
-            [InlineKeyboardButton("🔔 Enable reminders", callback_data="reminders_on")],
-            [InlineKeyboardButton("🔕 Disable reminders", callback_data="reminders_off")],
-        ]
-        
-        await update.message.reply_text(
-            "⚙️ Reminder settings:\n\n"
-            "Here you can manage notifications about upcoming gift exchanges.",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
+    await update.message.reply_text(
+        catalog.render(language, 'reminders_menu'),
+        reply_markup=keyboards.reminders(language)
+    )
 
-async def reminder_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def reminder_toggle(update: Update, context: SantaContext):
     """Включение/выключение напоминаний"""
     query = update.callback_query
     await query.answer()
     
     user = query.from_user
     action = query.data
-    language = get_user_language(user.id)
-    
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
+    language = context.profile.language
     
     if action == 'reminders_on':
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_settings (user_id, reminders_enabled)
-            VALUES (?, TRUE)
-        ''', (user.id,))
-        
-        if language == 'ru':
-            message = "🔔 Напоминания включены! Вы будете получать уведомления о предстоящих событиях."
-        else:
-            message = "🔔 Reminders enabled! You will receive notifications about upcoming events."
+        await storage.settings.set_reminders(user.id, True)
+        message = catalog.render(language, 'reminders_enabled')
     
     else:  # reminders_off
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_settings (user_id, reminders_enabled)
-            VALUES (?, FALSE)
-        ''', (user.id,))
-        
-        if language == 'ru':
-            message = "🔕 Напоминания выключены. Вы не будете получать уведомления."
-        else:
-            message = "🔕 Reminders disabled. You will not receive notifications."
-    
-    conn.commit()
-    conn.close()
+        await storage.settings.set_reminders(user.id, False)
+        message = catalog.render(language, 'reminders_disabled')
     
     await query.edit_message_text(message)
 
 # ========== ЯЗЫК ==========
 
-async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def set_language(update: Update, context: SantaContext):
     """Установка языка"""
-    user = update.effective_user
-    
-    keyboard = [
-        [InlineKeyboardButton("🇷🇺 Русский", callback_data="lang_ru"),
-         InlineKeyboardButton("🇺🇸 English", callback_data="lang_en")],
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
+    # Кнопка на каждый язык из каталога: новый язык - новый файл в locales/
     await update.message.reply_text(
-        "🌍 Выберите язык / Select language:",
-        reply_markup=reply_markup
+        keyboards.language_prompt,
+        reply_markup=keyboards.language_menu
     )
 
-async def language_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def language_selected(update: Update, context: SantaContext):
     """Обработчик выбора языка"""
     query = update.callback_query
     await query.answer()
@@ -1870,110 +3436,201 @@ async def language_selected(update: Update, context: ContextTypes.DEFAULT_TYPE):
     language = query.data.split("_")[1]
     user = query.from_user
     
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT OR REPLACE INTO user_settings (user_id, language)
-        VALUES (?, ?)
-    ''', (user.id, language))
-    
-    conn.commit()
-    conn.close()
+    if language not in catalog.languages:
+        return
     
-    if language == 'ru':
-        message = "🌍 Язык изменен на Русский"
-    else:
-        message = "🌍 Language changed to English"
+    await storage.settings.set_language(user.id, language)
+    context.profile.settings = UserSettings(user.id, language, context.profile.settings.reminders_enabled)
     
-    await query.edit_message_text(message)
+    await query.edit_message_text(catalog.render(language, 'language_changed'))
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
 
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def cancel(update: Update, context: SantaContext):
     """Отмена текущей операции"""
-    user = update.effective_user
-    language = get_user_language(user.id)
-    
     context.user_data.clear()
     
-    if language == 'ru':
-        await update.message.reply_text("Операция отменена.")
-    else:
-        await update.message.reply_text("Operation cancelled.")
+    await update.message.reply_text(catalog.render(context.profile.language, 'operation_cancelled'))
     
     return ConversationHandler.END
 
-async def reset_draw(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def reset_draw(update: Update, context: SantaContext):
     """Сброс результатов жеребьевки"""
     user = update.effective_user
-    language = get_user_language(user.id)
+    language = context.profile.language
     
     if not context.args:
-        if language == 'ru':
-            await update.message.reply_text("Укажите ID игры: /reset_draw <ID_игры>")
-        else:
-            await update.message.reply_text("Specify game ID: /reset_draw <game_id>")
+        await update.message.reply_text(catalog.render(language, 'reset_usage'))
         return
     
-    game_id = context.args[0]
-    
-    conn = sqlite3.connect('secret_santa.db')
-    cursor = conn.cursor()
+    game_id = parse_game_id(context.args[0])
     
     # Проверяем права администратора
-    cursor.execute('SELECT admin_id FROM games WHERE game_id = ?', (game_id,))
-    game = cursor.fetchone()
+    game = await storage.games.get(game_id)
     
     if not game:
-        if language == 'ru':
-            await update.message.reply_text("Игра не найдена.")
-        else:
-            await update.message.reply_text("Game not found.")
-        conn.close()
+        await update.message.reply_text(catalog.render(language, 'reset_game_not_found'))
         return
     
-    if game[0] != user.id:
-        if language == 'ru':
-            await update.message.reply_text("Только организатор может сбросить жеребьевку.")
-        else:
-            await update.message.reply_text("Only the organizer can reset the draw.")
-        conn.close()
+    if game.admin_id != user.id:
+        await update.message.reply_text(catalog.render(language, 'reset_admin_only'))
         return
     
     # Сбрасываем назначения
-    cursor.execute('''
-        UPDATE game_participants 
-        SET assigned_to = NULL 
-        WHERE game_id = ?
-    ''', (game_id,))
+    await storage.participants.reset(game_id)
     
-    conn.commit()
-    conn.close()
+    await update.message.reply_text(catalog.render(language, 'reset_done'))
+
+async def exclude_pair(update: Update, context: SantaContext):
+    """Запрет паре участников дарить друг другу"""
+    user = update.effective_user
+    language = context.profile.language
     
-    if language == 'ru':
-        await update.message.reply_text(
-            "✅ Результаты жеребьевки сброшены.\n"
-            "Теперь можно провести жеребьевку заново командой /draw"
-        )
-    else:
-        await update.message.reply_text(
-            "✅ Draw results reset.\n"
-            "Now you can conduct the draw again with /draw"
+    if len(context.args) != 3:
+        await update.message.reply_text(catalog.render(language, 'exclude_usage'))
+        return
+    
+    game_id = parse_game_id(context.args[0])
+    first, second = context.args[1:]
+    
+    # Проверяем права администратора
+    game = await storage.games.get(game_id)
+    
+    if not game:
+        await update.message.reply_text(catalog.render(language, 'exclude_game_not_found'))
+        return
+    
+    if game.admin_id != user.id:
+        await update.message.reply_text(catalog.render(language, 'exclude_admin_only'))
+        return
+    
+    # Находим участников по @username или ID
+    member_ids = []
+    for handle in (first, second):
+        member_id = await storage.participants.find(game_id, handle)
+        if member_id is None:
+            await update.message.reply_text(catalog.render(language, 'exclude_not_member', handle=handle))
+            return
+        member_ids.append(member_id)
+    
+    if member_ids[0] == member_ids[1]:
+        await update.message.reply_text(catalog.render(language, 'exclude_same'))
+        return
+    
+    await storage.exclusions.add(game_id, *member_ids)
+    
+    await update.message.reply_text(catalog.render(language, 'exclude_done', first=first, second=second))
+
+async def draw_status(update: Update, context: SantaContext):
+    """Прогресс рассылки результатов жеребьевки"""
+    user = update.effective_user
+    language = context.profile.language
+    
+    if not context.args:
+        await update.message.reply_text(catalog.render(language, 'draw_status_usage'))
+        return
+    
+    game_id = parse_game_id(context.args[0])
+    
+    # Проверяем права администратора
+    game = await storage.games.get(game_id)
+    
+    if not game:
+        await update.message.reply_text(catalog.render(language, 'draw_status_game_not_found'))
+        return
+    
+    if game.admin_id != user.id:
+        await update.message.reply_text(catalog.render(language, 'draw_status_admin_only'))
+        return
+    
+    progress = await storage.outbox.progress(game_id, 'draw')
+    
+    if progress is None:
+        await update.message.reply_text(catalog.render(language, 'draw_status_none', game_name=game.name))
+        return
+    
+    key = 'draw_status_done' if progress.pending == 0 else 'draw_status_progress'
+    await update.message.reply_text(catalog.render(
+        language, key,
+        game_name=game.name,
+        delivered=progress.delivered,
+        total=progress.total,
+        pending=progress.pending,
+        held=progress.held,
+        failed=progress.failed,
+    ))
+
+async def unreachable_participants(update: Update, context: SantaContext):
+    """Участники игры, которым бот не может писать"""
+    user = update.effective_user
+    language = context.profile.language
+    
+    if not context.args:
+        await update.message.reply_text(catalog.render(language, 'unreachable_usage'))
+        return
+    
+    game_id = parse_game_id(context.args[0])
+    
+    # Проверяем права администратора
+    game = await storage.games.get(game_id)
+    
+    if not game:
+        await update.message.reply_text(catalog.render(language, 'unreachable_game_not_found'))
+        return
+    
+    if game.admin_id != user.id:
+        await update.message.reply_text(catalog.render(language, 'unreachable_admin_only'))
+        return
+    
+    unreachable = await storage.reachability.for_game(game_id)
+    
+    if not unreachable:
+        await update.message.reply_text(catalog.render(language, 'unreachable_none', game_name=game.name))
+        return
+    
+    text = catalog.render(language, 'unreachable_header', game_name=game.name)
+    for member in unreachable:
+        text += catalog.render(
+            language, 'unreachable_item',
+            first_name=member.first_name,
+            username=f"@{member.username}" if member.username else member.user_id,
+            since=member.since,
         )
+    
+    await update.message.reply_text(text)
 
 # ========== ОСНОВНАЯ ФУНКЦИЯ ==========
 
+async def post_init(application):
+    """Запуск фоновых систем, когда цикл событий бота уже работает"""
+    # Запускаем систему напоминаний
+    reminder_system = ReminderSystem(application, storage)
+    reminder_system.start(asyncio.get_running_loop())
+    # Доставка уведомлений, включая оставшиеся в outbox с прошлого запуска
+    outbox.start(application.bot)
+
+async def post_shutdown(application):
+    """Освобождение ресурсов при остановке бота"""
+    if isinstance(storage.settings, SettingsCache):
+        logger.info(
+            f"Кэш настроек: попаданий {storage.settings.hits}, промахов {storage.settings.misses}"
+        )
+    await outbox.stop()
+    await storage.close()
+
 def main():
-    # Инициализация базы данных
-    init_db()
+    # Инициализация хранилища
+    storage.init()
     
     # Создаем приложение
-    application = Application.builder().token("ВАШ_ТОКЕН_БОТА").build()
-    
-    # Запускаем систему напоминаний
-    reminder_system = ReminderSystem(application)
-    reminder_system.start()
+    application = (
+        Application.builder()
+        .token("ВАШ_ТОКЕН_БОТА")
+        .context_types(ContextTypes(context=SantaContext))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Обработчик регистрации
     reg_conv_handler = ConversationHandler(
@@ -2028,6 +3685,9 @@ def main():
         fallbacks=[CommandHandler('cancel', cancel)]
     )
     
+    # Профиль пользователя загружается до всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, load_profile), group=-1)
+    
     # Регистрируем все обработчики
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
@@ -2040,7 +3700,10 @@ def main():
     # Основные команды
     application.add_handler(CommandHandler("my_games", my_games))
     application.add_handler(CommandHandler("draw", draw))
+    application.add_handler(CommandHandler("draw_status", draw_status))
     application.add_handler(CommandHandler("reset_draw", reset_draw))
+    application.add_handler(CommandHandler("exclude", exclude_pair))
+    application.add_handler(CommandHandler("unreachable", unreachable_participants))
     application.add_handler(CommandHandler("gift_sent", confirm_gift_sent))
     application.add_handler(CommandHandler("gift_received", confirm_gift_received))
     application.add_handler(CommandHandler("gift_status", gift_status))
@@ -2053,6 +3716,9 @@ def main():
     application.add_handler(CallbackQueryHandler(reminder_toggle, pattern='^reminders_'))
     application.add_handler(CallbackQueryHandler(language_selected, pattern='^lang_'))
     
+    # Блокировка и разблокировка бота пользователями
+    application.add_handler(ChatMemberHandler(track_bot_status, ChatMemberHandler.MY_CHAT_MEMBER))
+    
     # Запускаем бота
     print("🎅 Бот Тайный Санта запущен со всеми функциями!")
     print("✨ Доступные функции:")
@@ -0,0 +1,240 @@
+"""Скорость, память и равномерность жеребьевки.
+
+Запуск:
+    python benchmarks/bench_draw.py [--sizes 10 100 1000 10000 100000 1000000] [--densities 0 2 10]
+                                    [--algorithms legacy derangement cycle] [--samples 50000]
+
+Для каждого алгоритма, числа участников и плотности исключений (сколько
+исключенных пар приходится на участника) измеряются время жеребьевки,
+пик выделенной памяти (tracemalloc) и число неудач. legacy - прежний
+алгоритм обработчика draw: перемешивание и отбраковка до 100 попыток.
+
+Равномерность проверяется критерием хи-квадрат: на малой игре каждое
+допустимое распределение должно выпадать одинаково часто - без исключений и
+с исключенными парами, на игре побольше - каждый получатель у первого
+дарителя. Результат печатается в JSON; код возврата 1, если какая-то
+проверка равномерности не прошла (p < --alpha).
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from itertools import permutations
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import SecretSanta  # noqa: E402
+
+
+def legacy_draw(user_ids, exclusions, rng, max_attempts=100):
+    """Прежняя жеребьевка: перемешивание с отбраковкой; None, если попытки кончились"""
+    exclusions = set(exclusions)
+    for _ in range(max_attempts):
+        receivers = list(user_ids)
+        rng.shuffle(receivers)
+        pairs = list(zip(user_ids, receivers))
+        if all(giver_id != receiver_id and (giver_id, receiver_id) not in exclusions
+               for giver_id, receiver_id in pairs):
+            return pairs
+    return None
+
+
+def make_draw(algorithm, rng):
+    if algorithm == 'legacy':
+        return lambda user_ids, exclusions: legacy_draw(user_ids, exclusions, rng)
+    engine = SecretSanta.DrawEngine(algorithm, rng)
+
+    def draw(user_ids, exclusions):
+        try:
+            return engine.draw(user_ids, exclusions)
+        except SecretSanta.DrawImpossible:
+            return None
+    return draw
+
+
+def make_exclusions(user_ids, density, rng):
+    """Симметричные исключения: в среднем density пар на участника"""
+    exclusions = []
+    for _ in range(len(user_ids) * density // 2):
+        first, second = rng.sample(user_ids, 2)
+        exclusions += [(first, second), (second, first)]
+    return exclusions
+
+
+def run_timing(algorithm, size, density, repeats):
+    rng = random.Random(size * 31 + density)
+    user_ids = list(range(1, size + 1))
+    exclusions = make_exclusions(user_ids, density, rng)
+    draw = make_draw(algorithm, rng)
+
+    failures = 0
+    started = time.perf_counter()
+    for _ in range(repeats):
+        if draw(user_ids, exclusions) is None:
+            failures += 1
+    elapsed = (time.perf_counter() - started) / repeats
+
+    # Память - отдельным прогоном: tracemalloc заметно замедляет выполнение
+    tracemalloc.start()
+    draw(user_ids, exclusions)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'algorithm': algorithm,
+        'participants': size,
+        'exclusions_per_participant': density,
+        'repeats': repeats,
+        'seconds': round(elapsed, 6),
+        'peak_kib': round(peak / 1024, 1),
+        'failures': failures,
+    }
+
+
+def chi2_sf(statistic, dof):
+    """P(X >= statistic) для распределения хи-квадрат: регуляризованная неполная гамма-функция Q"""
+    a, x = dof / 2, statistic / 2
+    if x <= 0:
+        return 1.0
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        # Ряд для P(a, x)
+        term = total = 1 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1 - total * math.exp(log_prefix))
+    # Цепная дробь для Q(a, x) (метод Лентца)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return math.exp(log_prefix) * h
+
+
+def chi2_test(counts, outcomes, samples):
+    """Статистика, степени свободы и p-value для равновероятных исходов"""
+    expected = samples / len(outcomes)
+    statistic = sum((counts.get(outcome, 0) - expected) ** 2 / expected for outcome in outcomes)
+    dof = len(outcomes) - 1
+    return statistic, dof, chi2_sf(statistic, dof)
+
+
+# Исключения для проверки равномерности с ограничениями: две пары на шести участниках
+QUALITY_EXCLUSIONS = [(0, 1), (1, 0), (2, 3), (3, 2)]
+
+
+def run_quality(algorithm, samples):
+    """Проверки равномерности: распределения целиком на 5 участниках, на 6 участниках
+    с исключениями QUALITY_EXCLUSIONS и получатель первого дарителя на 50"""
+    rng = random.Random(samples)
+    draw = make_draw(algorithm, rng)
+    results = []
+
+    user_ids = list(range(5))
+    outcomes = _valid_assignments(algorithm, user_ids, ())
+    counts = Counter(tuple(receiver_id for _, receiver_id in sorted(draw(user_ids, ()))) for _ in range(samples))
+    unexpected = sum(count for outcome, count in counts.items() if outcome not in outcomes)
+    statistic, dof, p_value = chi2_test(counts, outcomes, samples)
+    results.append(_quality(algorithm, 'assignment', len(user_ids), samples, statistic, dof, p_value, unexpected))
+
+    # Исключения: все допустимые распределения перечисляются и должны выпадать одинаково часто.
+    # При двух исключенных парах движок обходится перевыбором, так что cycle остается единым кругом
+    user_ids = list(range(6))
+    outcomes = _valid_assignments(algorithm, user_ids, QUALITY_EXCLUSIONS)
+    counts = Counter(
+        tuple(receiver_id for _, receiver_id in sorted(draw(user_ids, QUALITY_EXCLUSIONS))) for _ in range(samples)
+    )
+    unexpected = sum(count for outcome, count in counts.items() if outcome not in outcomes)
+    statistic, dof, p_value = chi2_test(counts, outcomes, samples)
+    results.append(_quality(algorithm, 'excluded_assignment', len(user_ids), samples, statistic, dof, p_value, unexpected))
+
+    user_ids = list(range(50))
+    counts = Counter(dict(draw(user_ids, ()))[0] for _ in range(samples))
+    outcomes = user_ids[1:]
+    unexpected = sum(count for outcome, count in counts.items() if outcome not in outcomes)
+    statistic, dof, p_value = chi2_test(counts, outcomes, samples)
+    results.append(_quality(algorithm, 'first_receiver', len(user_ids), samples, statistic, dof, p_value, unexpected))
+    return results
+
+
+def _valid_assignments(algorithm, user_ids, exclusions):
+    """Все допустимые распределения перебором: кортежи получателей по порядку дарителей"""
+    exclusions = set(exclusions)
+    return {
+        tuple(receivers) for receivers in permutations(user_ids)
+        if all(
+            giver_id != receiver_id and (giver_id, receiver_id) not in exclusions
+            for giver_id, receiver_id in zip(user_ids, receivers)
+        )
+        # cycle выдает только единые круги: без исключений (n-1)! вариантов
+        and (algorithm != 'cycle' or _single_cycle(receivers))
+    }
+
+
+def _single_cycle(receivers):
+    current, length = receivers[0], 1
+    while current != 0:
+        current = receivers[current]
+        length += 1
+    return length == len(receivers)
+
+
+def _quality(algorithm, check, size, samples, statistic, dof, p_value, unexpected):
+    return {
+        'algorithm': algorithm,
+        'check': check,
+        'participants': size,
+        'samples': samples,
+        'chi2': round(statistic, 3),
+        'dof': dof,
+        'p_value': round(p_value, 6),
+        'invalid': unexpected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000, 10000, 100000, 1000000])
+    parser.add_argument('--densities', nargs='+', type=int, default=[0, 2, 10])
+    parser.add_argument('--algorithms', nargs='+', default=['legacy', *SecretSanta.DrawEngine.MODES])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--samples', type=int, default=50000)
+    parser.add_argument('--alpha', type=float, default=0.001)
+    args = parser.parse_args()
+
+    timings = [
+        run_timing(algorithm, size, density, args.repeats)
+        for algorithm in args.algorithms
+        for size in args.sizes
+        for density in args.densities
+    ]
+    quality = [result for algorithm in args.algorithms for result in run_quality(algorithm, args.samples)]
+    passed = all(result['p_value'] >= args.alpha and not result['invalid'] for result in quality)
+
+    print(json.dumps({'timings': timings, 'quality': quality, 'passed': passed}, indent=2))
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Сценарий бота целиком на разных реализациях хранилища.
+
+Запуск:
+    python benchmarks/bench_flow.py [--games 50] [--players 20] [--backends sqlite memory]
+
+Для каждой реализации прогоняется тот же набор обращений к хранилищу, что и
+у обработчиков: регистрация, создание игр, список игр и вступление, жеребьевка,
+анонимные сообщения, подтверждения и оценки подарков, статус. Разница между
+sqlite и memory показывает, какая часть задержки приходится на хранилище.
+Результат печатается в JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import SecretSanta  # noqa: E402
+
+
+async def run_flow(storage, games, players):
+    timings = {}
+
+    async def step(name, calls):
+        started = time.perf_counter()
+        await asyncio.gather(*calls)
+        timings[name] = round(time.perf_counter() - started, 4)
+
+    users = range(1, games * players + 1)
+    await step('register', (
+        storage.users.register(user_id, f'user{user_id}', f'User {user_id}', 'socks')
+        for user_id in users
+    ))
+
+    game_ids = []
+    for index in range(games):
+        admin_id = index * players + 1
+        game_ids.append(await storage.games.create(f'game{index}', admin_id, '10$', '2030-12-25'))
+
+    await step('available_for', (storage.games.available_for(user_id) for user_id in users))
+    await step('join', (
+        storage.participants.join(game_id, game_ids.index(game_id) * players + offset)
+        for game_id in game_ids for offset in range(2, players + 1)
+    ))
+    await step('for_user', (storage.games.for_user(user_id) for user_id in users))
+
+    engine = SecretSanta.DrawEngine(rng=random.Random(0))
+
+    async def draw(game_id):
+        participants = await storage.participants.for_draw(game_id)
+        await storage.participants.assign(game_id, engine.draw(participant.user_id for participant in participants))
+
+    await step('draw', (draw(game_id) for game_id in game_ids))
+    await step('assignments_of', (storage.participants.assignments_of(user_id) for user_id in users))
+
+    async def message(game_id, user_id):
+        receiver_id = await storage.participants.receiver_of(game_id, user_id)
+        await storage.messages.add(game_id, user_id, receiver_id, 'hi')
+
+    members = [
+        (game_id, game_ids.index(game_id) * players + offset)
+        for game_id in game_ids for offset in range(1, players + 1)
+    ]
+    await step('messages', (message(game_id, user_id) for game_id, user_id in members))
+    await step('unread_for', (storage.messages.unread_for(user_id) for user_id in users))
+
+    async def confirm(game_id, user_id):
+        await storage.confirmations.mark_sent(game_id, user_id)
+        await storage.confirmations.mark_received(game_id, user_id)
+        await storage.confirmations.rate(game_id, user_id, 5, 'thanks')
+
+    await step('confirmations', (confirm(game_id, user_id) for game_id, user_id in members))
+    await step('statuses', (storage.confirmations.statuses(game_id) for game_id in game_ids))
+    return timings
+
+
+def run_backend(backend, games, players):
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        if backend == 'sqlite':
+            database = SecretSanta.Database(os.path.join(tmp, 'bench.db'))
+            storage = SecretSanta.SqliteStorage(database)
+        else:
+            storage = SecretSanta.create_storage(backend)
+        storage.init()
+
+        async def flow():
+            try:
+                return await run_flow(storage, games, players)
+            finally:
+                await storage.close()
+
+        started = time.perf_counter()
+        timings = asyncio.run(flow())
+        elapsed = time.perf_counter() - started
+
+    return {
+        'backend': backend,
+        'users': games * players,
+        'seconds': round(elapsed, 4),
+        'steps': timings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--players', type=int, default=20)
+    parser.add_argument('--backends', nargs='+', default=list(SecretSanta.STORAGE_BACKENDS))
+    args = parser.parse_args()
+
+    results = [run_backend(backend, args.games, args.players) for backend in args.backends]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
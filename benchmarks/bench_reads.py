@@ -0,0 +1,97 @@
+"""Масштабирование чтений по размеру пула соединений только для чтения.
+
+Запуск:
+    python benchmarks/bench_reads.py [--games 200] [--users 2000] [--requests 2000] [--pools 1 2 4 8]
+
+На временной базе создаются игры с участниками, затем конкурентно выполняются
+тяжелые выборки обработчиков (список доступных игр для /join_game и «мои игры»)
+при параллельной записи подтверждений подарков через GroupCommitWriter.
+Результат печатается в JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import SecretSanta  # noqa: E402
+
+
+def populate(database, games, users):
+    with database.transaction() as cursor:
+        cursor.executemany(
+            'INSERT INTO users (user_id, first_name) VALUES (?, ?)',
+            [(user_id, f'user{user_id}') for user_id in range(1, users + 1)]
+        )
+        cursor.executemany(
+            "INSERT INTO games (game_id, name, admin_id, status) VALUES (?, ?, 1, 'active')",
+            [(game_id, f'game{game_id}') for game_id in range(1, games + 1)]
+        )
+        cursor.executemany(
+            'INSERT INTO game_participants (game_id, user_id) VALUES (?, ?)',
+            [(random.randint(1, games), user_id) for user_id in range(1, users + 1)]
+        )
+
+
+async def run_load(storage, users, requests):
+    async def one(i):
+        user_id = random.randint(1, users)
+        if i % 2:
+            await storage.games.available_for(user_id)
+        else:
+            await storage.games.for_user(user_id)
+
+    async def writes():
+        await asyncio.gather(*(
+            storage.writer.write('''
+                INSERT INTO gift_confirmations (game_id, user_id, gift_sent, sent_at)
+                VALUES (1, ?, TRUE, CURRENT_TIMESTAMP)
+                ON CONFLICT (game_id, user_id) DO UPDATE SET gift_sent = TRUE
+            ''', (user_id,))
+            for user_id in range(1, users + 1)
+        ))
+
+    started = time.perf_counter()
+    await asyncio.gather(writes(), *(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    await storage.close()
+    return elapsed
+
+
+def run_pool(pool_size, games, users, requests):
+    random.seed(pool_size)
+    with tempfile.TemporaryDirectory() as tmp:
+        database = SecretSanta.Database(os.path.join(tmp, 'bench.db'), read_pool_size=pool_size)
+        SecretSanta.db = database
+        SecretSanta.init_db()
+        populate(database, games, users)
+        elapsed = asyncio.run(run_load(SecretSanta.SqliteStorage(database), users, requests))
+        database.close()
+
+    return {
+        'read_pool_size': pool_size,
+        'requests': requests,
+        'seconds': round(elapsed, 4),
+        'requests_per_second': round(requests / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--pools', nargs='+', type=int, default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    results = [run_pool(size, args.games, args.users, args.requests) for size in args.pools]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Сравнение профилей хранилища SQLite на типичной нагрузке бота.
+
+Запуск:
+    python benchmarks/bench_storage.py [--users 2000] [--profiles durable balanced fast]
+
+Для каждого профиля создается отдельная временная база, на ней прогоняются
+мелкие транзакции записи (регистрация, вступление в игру, подтверждения
+подарков) параллельно с потоком чтения. Затем те же подтверждения
+подарков пишутся конкурентно через GroupCommitWriter, чтобы сравнить
+одну транзакцию на запись с групповым коммитом. Результат печатается в JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import SecretSanta  # noqa: E402
+
+
+def run_profile(profile, users):
+    with tempfile.TemporaryDirectory() as tmp:
+        database = SecretSanta.Database(os.path.join(tmp, 'bench.db'), profile)
+        SecretSanta.db = database
+        SecretSanta.init_db()
+        database.execute("INSERT INTO games (name, admin_id) VALUES ('bench', 1)")
+
+        reads = 0
+        stop = False
+
+        def reader():
+            nonlocal reads
+            while not stop:
+                database.fetchall('''
+                    SELECT g.game_id, COUNT(gp.user_id) FROM games g
+                    LEFT JOIN game_participants gp ON g.game_id = gp.game_id
+                    GROUP BY g.game_id
+                ''')
+                reads += 1
+
+        thread = Thread(target=reader)
+        thread.start()
+
+        started = time.perf_counter()
+        for user_id in range(1, users + 1):
+            database.execute(
+                'INSERT INTO users (user_id, first_name, wishes) VALUES (?, ?, ?)',
+                (user_id, f'user{user_id}', 'socks')
+            )
+            database.execute(
+                'INSERT INTO game_participants (game_id, user_id) VALUES (1, ?)', (user_id,)
+            )
+            database.execute('''
+                INSERT INTO gift_confirmations (game_id, user_id, gift_sent, sent_at)
+                VALUES (1, ?, TRUE, CURRENT_TIMESTAMP)
+                ON CONFLICT (game_id, user_id) DO UPDATE SET gift_sent = TRUE
+            ''', (user_id,))
+        elapsed = time.perf_counter() - started
+
+        stop = True
+        thread.join()
+        grouped = asyncio.run(run_group_commit(database, users))
+        database.close()
+
+    writes = users * 3
+    return {
+        'profile': profile,
+        'writes': writes,
+        'seconds': round(elapsed, 4),
+        'writes_per_second': round(writes / elapsed, 1),
+        'concurrent_reads': reads,
+        'group_commit': grouped,
+    }
+
+
+async def run_group_commit(database, users):
+    writer = SecretSanta.GroupCommitWriter(database)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        writer.write('''
+            INSERT INTO gift_confirmations (game_id, user_id, gift_received, received_at)
+            VALUES (1, ?, TRUE, CURRENT_TIMESTAMP)
+            ON CONFLICT (game_id, user_id) DO UPDATE SET gift_received = TRUE
+        ''', (user_id,))
+        for user_id in range(1, users + 1)
+    ))
+    elapsed = time.perf_counter() - started
+    await writer.close()
+    return {
+        'writes': writer.writes,
+        'batches': writer.batches,
+        'seconds': round(elapsed, 4),
+        'writes_per_second': round(writer.writes / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--profiles', nargs='+', default=list(SecretSanta.STORAGE_PROFILES))
+    args = parser.parse_args()
+
+    results = [run_profile(profile, args.users) for profile in args.profiles]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()